@@ -2,7 +2,7 @@ import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from routers import main_router, ai_router, data_router
+from routers import main_router, ai_router, data_router, debug_router
 import logging
 import colorlog
 from config.config_manager import config
@@ -49,6 +49,7 @@ async def root(request: Request):
 app.include_router(main_router)
 app.include_router(ai_router, prefix="/ai")
 app.include_router(data_router, prefix="/data")
+app.include_router(debug_router, prefix="/debug")
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -56,5 +57,7 @@ if __name__ == "__main__":
         host=config.get('app.host', '127.0.0.1'),
         port=config.get('app.port', 5000),
         log_config=None,
-        use_colors=True
+        use_colors=True,
+        # 浏览器支持时协商 permessage-deflate，压缩所有 WebSocket 消息
+        ws_per_message_deflate=config.get('websocket.per_message_deflate', True)
     )
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""端到端负载测试：模拟多个客户端驱动 ChatService 和 TaskExecutor
+
+模型请求发往本地模拟服务（benchmarks.mock_llm_server），浏览器操作由 FakeBrowserService 模拟，
+不需要网络。每个客户端先发一条聊天消息，等待搜索意图卡片，再启动搜索任务并一路选择继续搜索，
+直到收到 search_result。结束后输出吞吐量和各阶段的 p50/p95/p99 延迟。
+
+用法:
+    python -m benchmarks.bench_e2e --clients 5 --latency 0.3 --token-rate 80
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from benchmarks.fake_browser import FakeBrowserService
+from benchmarks.mock_llm_server import MockLLMServer, add_mock_arguments, mock_config_from_args
+from config.config_manager import config
+from services.ai_service import AIService
+from services.chat_service import ChatService
+from services.task_state import apply_task_patch
+from services.websocket_service import WebsocketService
+
+logger = logging.getLogger(__name__)
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+class StageRecorder:
+    """记录各阶段耗时"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, obj, method_name: str, stage: str):
+        """包装实例上的异步方法，记录每次调用耗时；方法不存在时忽略"""
+        method = getattr(obj, method_name, None)
+        if method is None:
+            return
+
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(obj, method_name, timed)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values)
+            }
+            for stage, values in sorted(self.samples.items())
+        }
+
+class SimulatedClient:
+    """模拟前端的 WebSocket 连接，记录收到的每条消息及时间"""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.messages: List[tuple] = []
+        self.tasks: Dict[str, Dict] = {}  # task_id -> {"seq": ..., "task": ...}，与前端一样由快照和 patch 还原
+        self._condition = asyncio.Condition()
+
+    async def accept(self):
+        pass
+
+    def _apply_task_update(self, message: dict) -> dict:
+        """还原任务的完整状态，记录的消息中 task 字段总是完整状态"""
+        current = self.tasks.get(message["task_id"])
+        if "task" in message:
+            if current is None or message["seq"] >= current["seq"]:
+                current = self.tasks[message["task_id"]] = {"seq": message["seq"], "task": message["task"]}
+        elif current is not None and message["base_seq"] == current["seq"]:
+            current["seq"] = message["seq"]
+            current["task"] = apply_task_patch(current["task"], message["patch"])
+        elif current is None or message["seq"] > current["seq"]:
+            logger.warning(f"Client {self.client_id} missed updates of task {message['task_id']}")
+        return {**message, "task": current["task"]} if current else message
+
+    async def send_text(self, text: str):
+        await self.send_json(json.loads(text))
+
+    async def send_json(self, message: dict):
+        if message.get("type") == "search_task_update":
+            message = self._apply_task_update(message)
+        async with self._condition:
+            self.messages.append((time.perf_counter(), message))
+            self._condition.notify_all()
+
+    async def wait_for(self, predicate: Callable[[dict], bool], since: int = 0,
+                       timeout: float = 60.0) -> Optional[tuple]:
+        """等待第 since 条之后满足条件的消息，返回 (序号, 时间, 消息)，超时返回 None"""
+        deadline = time.perf_counter() + timeout
+        index = since
+        async with self._condition:
+            while True:
+                while index < len(self.messages):
+                    received_at, message = self.messages[index]
+                    if predicate(message):
+                        return index, received_at, message
+                    index += 1
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(self._condition.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+
+async def run_client(index: int, chat_service: ChatService, recorder: StageRecorder,
+                     args: argparse.Namespace) -> bool:
+    """单个客户端的完整流程：聊天 -> 搜索意图 -> 搜索任务 -> 结果"""
+    client_id = f"bench-{index}"
+    client = SimulatedClient(client_id)
+    await WebsocketService().connect(client_id, client)
+
+    # 1. 聊天回复和搜索意图
+    start = time.perf_counter()
+    await chat_service.process_chat(args.message, client_id=client_id)
+    first_chunk = await client.wait_for(
+        lambda m: m.get("type") == "chat_response" and m.get("message_type") == "chat", timeout=args.timeout
+    )
+    if first_chunk:
+        recorder.record("client.chat_first_chunk", first_chunk[1] - start)
+    intent = await client.wait_for(lambda m: m.get("type") == "search_intent", timeout=args.intent_timeout)
+    if intent:
+        recorder.record("client.chat_to_search_intent", intent[1] - start)
+        keywords, task_id = intent[2]["keywords"], intent[2]["task_id"]
+    else:
+        # 没有收到搜索意图（例如模型判断不是搜索或超时），直接创建任务继续测试
+        recorder.record("client.search_intent_missing", 0.0)
+        keywords = args.keywords
+        task_id = chat_service.task_manager.create_pending_task(keywords, client_id)
+
+    # 2. 搜索任务，遇到继续搜索的询问一律继续
+    task_start = time.perf_counter()
+    await chat_service.start_auto_search(keywords, client_id, task_id)
+    cursor = len(client.messages)
+    while True:
+        result = await client.wait_for(
+            lambda m: m.get("type") == "search_result" or (
+                m.get("type") == "search_task_update"
+                and m["task_id"] == task_id
+                and m.get("task", {}).get("state") in ("waiting_user_input", "failed", "cancelled")
+            ),
+            since=cursor, timeout=args.timeout
+        )
+        if result is None:
+            logger.warning(f"Client {client_id} timed out waiting for task {task_id}")
+            return False
+        cursor = result[0] + 1
+        message = result[2]
+        if message["type"] == "search_result":
+            recorder.record("client.task_total", result[1] - task_start)
+            return True
+        if message["task"]["state"] != "waiting_user_input":
+            logger.warning(f"Task {task_id} ended with state {message['task']['state']}")
+            return False
+        await chat_service.submit_user_input(task_id, client_id, {"continue_search": True})
+
+@contextmanager
+def temporary_storage():
+    """任务存储、检查点和对话会话写到临时目录，结束后删除并恢复配置
+
+    使用默认配置时 ChatService 会打开 data/ 下的正式数据库，并从检查点恢复中断的任务，
+    这些任务会被模拟浏览器和模拟模型执行，测试产生的任务和会话也会写入正式数据。
+    """
+    overrides = {
+        ("task", "store", "path"): "tasks.db",
+        ("chat", "session", "store_path"): "chat_sessions.db",
+    }
+    saved = {}
+    with tempfile.TemporaryDirectory(prefix="bench_e2e_", ignore_cleanup_errors=True) as directory:
+        for keys, filename in overrides.items():
+            node = config._config
+            for name in keys[:-1]:
+                node = node.setdefault(name, {})
+            saved[keys] = (node, node.get(keys[-1]))
+            node[keys[-1]] = os.path.join(directory, filename)
+        try:
+            yield directory
+        finally:
+            for keys, (node, value) in saved.items():
+                node[keys[-1]] = value
+
+async def run_benchmark(args: argparse.Namespace) -> Dict:
+    with temporary_storage():
+        return await _run_benchmark(args)
+
+async def _run_benchmark(args: argparse.Namespace) -> Dict:
+    mock_server = None
+    base_url = args.mock_url
+    if not base_url:
+        mock_server = MockLLMServer(mock_config_from_args(args), port=args.mock_port)
+        await mock_server.start()
+        base_url = mock_server.base_url
+
+    try:
+        browser = FakeBrowserService(
+            search_latency=args.search_latency,
+            open_note_latency=args.open_note_latency,
+            seed=args.seed
+        )
+        chat_service = await ChatService.create(
+            browser_service=browser,
+            ai_service=AIService(base_url=base_url, api_key="mock"),
+            ai_service_mm=AIService(base_url=base_url, api_key="mock")
+        )
+
+        recorder = StageRecorder()
+        executor = chat_service.task_executor
+        recorder.wrap(chat_service.ai_service, "generate_response", "llm.generate_response")
+        recorder.wrap(chat_service, "analyze_search_intent", "chat.analyze_search_intent")
+        recorder.wrap(browser, "search_xiaohongshu", "browser.search")
+        recorder.wrap(browser, "open_note", "browser.open_note")
+        recorder.wrap(executor, "_stream_search_keywords", "task.keywords")
+        recorder.wrap(executor.triage_service, "triage", "task.triage")
+        recorder.wrap(executor, "_analyze_note_opinions", "task.analyze_note")
+        recorder.wrap(executor, "_analyze_notes_opinions_batch", "task.analyze_note_batch")
+        recorder.wrap(executor, "_summarize_batch_opinions", "task.batch_summary")
+        recorder.wrap(executor, "_analyze_all_opinions", "task.analyze_all")
+        recorder.wrap(executor, "_generate_user_summary", "task.user_summary")
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*[
+            run_client(i, chat_service, recorder, args) for i in range(args.clients)
+        ])
+        wall_time = time.perf_counter() - start
+
+        completed = sum(1 for ok in outcomes if ok)
+        return {
+            "clients": args.clients,
+            "completed_tasks": completed,
+            "wall_time": wall_time,
+            "tasks_per_minute": completed / wall_time * 60 if wall_time else 0.0,
+            "stages": recorder.report()
+        }
+    finally:
+        if mock_server:
+            await mock_server.stop()
+
+def print_report(report: Dict):
+    print(f"clients: {report['clients']}, completed tasks: {report['completed_tasks']}, "
+          f"wall time: {report['wall_time']:.2f}s, throughput: {report['tasks_per_minute']:.2f} tasks/min")
+    print(f"{'stage':<34}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<34}{s['count']:>7}{s['mean']:>9.3f}{s['p50']:>9.3f}"
+              f"{s['p95']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端负载测试")
+    parser.add_argument("--clients", type=int, default=3, help="并发客户端数量")
+    parser.add_argument("--message", type=str, default="我想了解一下遛狗有哪些注意事项", help="聊天消息")
+    parser.add_argument("--keywords", type=str, default="遛狗", help="未识别出搜索意图时使用的关键词")
+    parser.add_argument("--timeout", type=float, default=600.0, help="单个任务的超时（秒）")
+    parser.add_argument("--intent-timeout", type=float, default=30.0, help="等待搜索意图的超时（秒）")
+    parser.add_argument("--search-latency", type=float, default=1.5, help="模拟搜索耗时（秒）")
+    parser.add_argument("--open-note-latency", type=float, default=2.0, help="模拟打开笔记耗时（秒）")
+    parser.add_argument("--mock-url", type=str, default=None, help="使用已启动的模拟服务，不在进程内启动")
+    parser.add_argument("--mock-port", type=int, default=8900, help="进程内模拟服务端口")
+    parser.add_argument("--output", type=str, default=None, help="将结果写入 JSON 文件")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING,
+        format='%(asctime)s - %(levelname)s [in %(pathname)s:%(lineno)d] - %(message)s')
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
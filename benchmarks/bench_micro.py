@@ -0,0 +1,228 @@
+"""热点函数的微基准测试：解析和序列化
+
+每个任务中会被调用成千上万次的函数，用 benchmarks/fixtures 下的固定数据测量单次调用耗时，
+与 benchmarks/baseline_micro.json 中的基线比较，超出阈值时以非零状态码退出。
+
+机器负载会让绝对耗时波动很大，每轮测量都和一个固定的参照负载交替运行，比较的是
+用例耗时 / 参照耗时（relative），不同机器上的结果也大致可比。确认性能变化后用 --save-baseline 更新基线。
+
+用法:
+    python -m benchmarks.bench_micro                    # 与基线比较
+    python -m benchmarks.bench_micro --filter browser   # 只运行名称包含 browser 的用例
+    python -m benchmarks.bench_micro --save-baseline    # 把本次结果保存为基线
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from benchmarks.make_fixtures import FIXTURES_DIR
+from models.ai_models import ImageContent, Message, MessageRole, TextContent
+from services.ai_service import AIService
+from services.browser_service import BrowserService
+from services.chat_service import ChatService
+from services.task_state import SearchTask, TaskEvent, TaskState
+from tools.json_tools import extract_json_from_text
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline_micro.json")
+DEFAULT_THRESHOLD = 0.3
+
+def load_fixture(name: str) -> Any:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def replay_stream(chunks: List[str]) -> int:
+    """按 ChatService.process_chat 的方式逐个分片拼接并切分句子，返回切出的句子数"""
+    sentences = 0
+    one_sentence = ""
+    for chunk in chunks:
+        one_sentence += chunk
+        pos = ChatService.last_sentence_end(one_sentence)
+        if pos > 0:
+            one_sentence = one_sentence[pos + 1:]
+            sentences += 1
+    return sentences
+
+def make_task() -> SearchTask:
+    """一个执行到中途的任务：多个关键词、几十条结果和完整的状态历史"""
+    task = SearchTask("遛狗 技巧", "bench-client")
+    for i in range(SearchTask.max_state_history):
+        task.update_state(TaskState.RUNNING, TaskEvent.PROGRESS, f"正在处理第 {i} 篇笔记")
+    task.results = [{"note_id": str(i), "title": "遛狗技巧分享", "opinions": {}} for i in range(30)]
+    task.progress.keywords_total = 6
+    task.progress.keyword_states = {
+        f"关键词{i}": {"state": "analyzing", "notes_total": 5, "notes_processed": 3} for i in range(6)
+    }
+    task.user_input_required = {"type": "continue_search", "message": "是否继续搜索？" * 5, "remaining_keywords": 3}
+    return task
+
+def make_multimodal_message(images: int) -> Message:
+    content: List[Any] = [TextContent(text="请描述这些图片中狗狗的状态。" * 20)]
+    content += [ImageContent(image_url={"url": "data:image/jpeg;base64," + "A" * 20000}) for _ in range(images)]
+    return Message(role=MessageRole.user, content=content)
+
+def build_cases() -> Dict[str, Callable[[], Any]]:
+    """用例名 -> 无参函数，每次调用为一次测量"""
+    search = load_fixture("search_logs.json")
+    note = load_fixture("note_logs.json")
+    llm_outputs = load_fixture("llm_outputs.json")
+    stream = load_fixture("chat_stream.json")
+    no_break_chunks = [stream["no_break"][i:i + 2] for i in range(0, len(stream["no_break"]), 2)]
+
+    task = make_task()
+    message = make_multimodal_message(6)
+    dict_message = Message(role=MessageRole.user, content=message.to_dict()["content"])
+    ai_service = AIService(max_images=2, base_url="http://127.0.0.1:1/v1", api_key="bench")
+    history = [make_multimodal_message(3) for _ in range(10)]
+
+    def progress_update():
+        # 一篇笔记处理完后的典型进度推送：只有个别计数变化
+        task.progress.notes_processed += 1
+        task.progress.update_keyword_state("关键词0", notes_processed=task.progress.notes_processed)
+        return json.dumps(task.build_update("progress"), ensure_ascii=False)
+
+    def process_messages():
+        # _process_messages 会原地删除图片，每次复制一份消息列表（复制本身的开销很小）
+        return ai_service._process_messages([Message(role=m.role, content=list(m.content)) for m in history])
+
+    cases: Dict[str, Callable[[], Any]] = {
+        "browser.parse_search_logs": lambda: BrowserService.parse_search_logs(search["logs"], search["bodies"].get),
+        "browser.parse_note_logs": lambda: BrowserService.parse_note_logs(note["logs"], note["bodies"].get),
+    }
+    for kind, text in llm_outputs.items():
+        cases[f"json.extract_json_from_text[{kind}]"] = lambda text=text: extract_json_from_text(text)
+    cases.update({
+        "task.to_dict": task.to_dict,
+        "task.to_dict+json": lambda: json.dumps(task.to_dict(), ensure_ascii=False),
+        "task.build_update[progress]+json": progress_update,
+        "message.to_dict[multimodal]": message.to_dict,
+        "message.to_dict[dict_content]": dict_message.to_dict,
+        "ai.process_messages[30_images]": process_messages,
+        "chat.last_sentence_end[stream]": lambda: replay_stream(stream["chunks"]),
+        "chat.last_sentence_end[no_break]": lambda: replay_stream(no_break_chunks),
+    })
+    return cases
+
+def reference_workload():
+    """参照负载：纯 Python 的字典、字符串和 json 操作，与被测函数的开销类型相近"""
+    data = {str(i): [i, "遛狗" * (i % 5)] for i in range(200)}
+    return json.loads(json.dumps(data, ensure_ascii=False))
+
+def _loops_for(func: Callable[[], Any], min_time: float) -> int:
+    """确定调用次数，使一轮耗时不少于 min_time"""
+    number = 1
+    while True:
+        elapsed = _run(func, number)
+        if elapsed >= min_time:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+def _run(func: Callable[[], Any], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+def measure(func: Callable[[], Any], min_time: float, repeat: int) -> Dict[str, float]:
+    """用例和参照负载交替测量 repeat 轮，返回单次调用的微秒数和相对参照负载的耗时比"""
+    number = _loops_for(func, min_time)
+    ref_number = _loops_for(reference_workload, min_time / 4)
+    timings, ratios = [], []
+    for _ in range(repeat):
+        ref = _run(reference_workload, ref_number) / ref_number
+        timing = _run(func, number) / number
+        timings.append(timing)
+        ratios.append(timing / ref)
+    return {
+        "best_us": round(min(timings) * 1e6, 3),
+        "median_us": round(statistics.median(timings) * 1e6, 3),
+        "relative": round(statistics.median(ratios), 4),
+        "loops": number
+    }
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {"cases": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]], baseline: Dict[str, Any]):
+    """保存本次结果为基线，已有的单个用例阈值保留"""
+    cases = baseline.get("cases", {})
+    for name, result in results.items():
+        entry = {"relative": result["relative"], "best_us": result["best_us"]}
+        if "threshold" in cases.get(name, {}):
+            entry["threshold"] = cases[name]["threshold"]
+        cases[name] = entry
+    data = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cases": dict(sorted(cases.items()))
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    """打印结果和相对基线的变化，返回超出阈值的用例名"""
+    regressions = []
+    print(f"{'case':<42} {'best_us':>12} {'median_us':>12} {'relative':>10} {'baseline':>10} {'change':>9}")
+    for name, result in results.items():
+        row = f"{name:<42} {result['best_us']:>12.2f} {result['median_us']:>12.2f} {result['relative']:>10.3f}"
+        base = baseline.get("cases", {}).get(name)
+        if base and "relative" in base:
+            change = result["relative"] / base["relative"] - 1
+            limit = base.get("threshold", threshold)
+            flag = "  REGRESSION" if change > limit else ""
+            if flag:
+                regressions.append(name)
+            print(f"{row} {base['relative']:>10.3f} {change:>+8.1%}{flag}")
+        else:
+            print(f"{row} {'-':>10} {'new':>9}")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="解析和序列化热点函数的微基准测试")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮测量的最短时间（秒）")
+    parser.add_argument("--repeat", type=int, default=7, help="测量轮数，比较各轮耗时比的中位数")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="比基线慢超过该比例视为退化，基线中单个用例的 threshold 优先")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--output", help="把本次结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    # 解析失败等日志不计入测量
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = {}
+    for name, func in build_cases().items():
+        if args.filter in name:
+            results[name] = measure(func, args.min_time, args.repeat)
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        save_baseline(args.baseline, results, baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""评估搜索意图本地预判的效果
+
+用 benchmarks/fixtures/intent_cases.json 中标注好的用户消息（{"text", "is_search"}），统计本地规则能直接判定的比例
+（覆盖率，即省掉的模型调用），以及本地判定部分的精确率和召回率；判断不了的消息交给模型，不计入精确率和召回率。
+线上的抽样对照结果见 /ai/intent_stats。
+
+用法:
+    python -m benchmarks.eval_intent             # 输出统计
+    python -m benchmarks.eval_intent --verbose   # 同时列出每条消息的判定结果
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+from benchmarks.make_fixtures import FIXTURES_DIR
+from services.intent_service import IntentDecision, SearchIntentPrefilter
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="评估搜索意图本地预判的覆盖率、精确率和召回率")
+    parser.add_argument("--cases", default=os.path.join(FIXTURES_DIR, "intent_cases.json"), help="标注数据")
+    parser.add_argument("--verbose", action="store_true", help="列出每条消息的判定结果")
+    args = parser.parse_args(argv)
+
+    with open(args.cases, "r", encoding="utf-8") as f:
+        cases = json.load(f)
+
+    prefilter = SearchIntentPrefilter()
+    counts = {"tp": 0, "fp": 0, "fn": 0, "tn": 0, "unsure": 0}
+    for case in cases:
+        decision, keywords = prefilter.classify(case["text"])
+        if decision == IntentDecision.UNSURE:
+            counts["unsure"] += 1
+        elif decision == IntentDecision.SEARCH:
+            counts["tp" if case["is_search"] else "fp"] += 1
+        else:
+            counts["fn" if case["is_search"] else "tn"] += 1
+        if args.verbose:
+            mark = "" if decision == IntentDecision.UNSURE or (decision == IntentDecision.SEARCH) == case["is_search"] else "  WRONG"
+            print(f"{'search' if case['is_search'] else 'chat':<7} {decision:<11} {keywords or '':<16} {case['text']}{mark}")
+
+    total = len(cases)
+    resolved = total - counts["unsure"]
+    predicted = counts["tp"] + counts["fp"]
+    actual = counts["tp"] + counts["fn"]
+    print(f"cases: {total}, resolved locally: {resolved} ({resolved / total:.0%}), sent to model: {counts['unsure']}")
+    print(f"search:     {sum(1 for c in cases if c['is_search'])} labeled, {counts['tp']} resolved locally")
+    print(f"not search: {sum(1 for c in cases if not c['is_search'])} labeled, {counts['tn']} resolved locally")
+    print(f"precision: {counts['tp'] / predicted:.3f}" if predicted else "precision: -")
+    print(f"recall (of resolved): {counts['tp'] / actual:.3f}" if actual else "recall (of resolved): -")
+    print(f"false positives: {counts['fp']}, false negatives: {counts['fn']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
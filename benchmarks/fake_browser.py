@@ -0,0 +1,77 @@
+"""模拟 BrowserService 的搜索和打开笔记接口，不启动浏览器、不访问网络"""
+import asyncio
+import logging
+import random
+import zlib
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class FakeBrowserService:
+    def __init__(self, search_latency: float = 1.5, open_note_latency: float = 2.0,
+                 latency_jitter: float = 0.3, results_per_search: int = 20,
+                 comments_per_note: int = 10, seed: Optional[int] = None):
+        self.driver = object()  # 保持与 BrowserService 相同的 "已启动" 判断
+        self.search_latency = search_latency
+        self.open_note_latency = open_note_latency
+        self.latency_jitter = latency_jitter
+        self.results_per_search = results_per_search
+        self.comments_per_note = comments_per_note
+        self._rng = random.Random(seed)
+
+    async def _sleep(self, base: float):
+        await asyncio.sleep(max(0.0, base + self._rng.uniform(-1, 1) * self.latency_jitter))
+
+    async def search_xiaohongshu(self, keyword):
+        """返回与 BrowserService.search_xiaohongshu 相同结构的搜索结果"""
+        await self._sleep(self.search_latency)
+        results = []
+        for i in range(self.results_per_search):
+            results.append({
+                "id": f"{zlib.crc32(keyword.encode()) % 100000:05d}{i:03d}",
+                "xsec_token": f"token-{i}",
+                "type": "video" if i % 4 == 3 else "normal",
+                "title": f"{keyword}经验分享 第{i + 1}篇",
+                "cover_url": "",
+                "nickname": f"用户{i}",
+                "liked_count": str(self._rng.randint(0, 20000))
+            })
+        logger.debug(f'{keyword} got {len(results)} fake search results')
+        return {
+            "status": "success",
+            "results": results
+        }
+
+    async def reset_page(self):
+        pass
+
+    async def open_note(self, note_id: str, xsec_token: str):
+        """返回与 BrowserService.open_note 相同结构的笔记详情"""
+        await self._sleep(self.open_note_latency)
+        comments_count = self._rng.randint(0, self.comments_per_note)
+        note_data = {
+            "topics": ["生活", "经验"],
+            "desc": "这是一篇模拟笔记的正文，" * self._rng.randint(2, 40),
+            "title": f"模拟笔记 {note_id}",
+            "type": "normal",
+            "images": [],
+            "interact_info": {
+                "share_count": str(self._rng.randint(0, 100)),
+                "collected_count": str(self._rng.randint(0, 1000)),
+                "comment_count": str(comments_count),
+                "liked_count": str(self._rng.randint(0, 5000))
+            }
+        }
+        comments_data = [
+            {
+                "content": f"模拟评论 {i}，说得很有道理",
+                "like_count": str(self._rng.randint(0, 300)),
+                "sub_comments": [{"content": "同意", "like_count": "1"}] if i % 3 == 0 else []
+            }
+            for i in range(comments_count)
+        ]
+        return {
+            "status": "success",
+            "note_data": note_data,
+            "comments_data": comments_data
+        }
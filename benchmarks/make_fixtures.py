@@ -0,0 +1,189 @@
+"""生成微基准测试使用的固定数据（benchmarks/fixtures/*.json）
+
+数据结构与线上一致：Chrome performance 日志（Network.* 事件，message 为 JSON 字符串）和
+Network.getResponseBody 的返回、模型的典型输出、流式回复的分片。内容由固定种子生成，
+需要用真实录制的数据时直接替换对应文件即可，格式见各函数说明。
+
+用法:
+    python -m benchmarks.make_fixtures
+"""
+import json
+import os
+import random
+from typing import Dict, List
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+_WORDS = ["遛狗", "狗狗", "训练", "牵引绳", "公园", "早上", "晚上", "天气", "小区", "邻居", "零食", "散步",
+          "体验", "推荐", "真的", "建议", "大家", "注意", "安全", "时间", "柯基", "金毛", "泰迪", "每天"]
+_STATIC_HOSTS = ["https://fe-static.xhscdn.com", "https://sns-webpic-qc.xhscdn.com", "https://sns-avatar-qc.xhscdn.com"]
+
+def _text(rng: random.Random, words: int) -> str:
+    parts = []
+    for i in range(words):
+        parts.append(rng.choice(_WORDS))
+        if i % 7 == 6:
+            parts.append(rng.choice(["，", "。", "！", "～"]))
+    return "".join(parts)
+
+def _headers(rng: random.Random, count: int) -> Dict[str, str]:
+    headers = {"content-type": "application/json; charset=utf-8", "server": "openresty", "date": "Mon, 02 Dec 2024 08:00:00 GMT"}
+    for i in range(count):
+        headers[f"x-{rng.choice(['b3', 'trace', 'request', 'cache'])}-{i}"] = "%032x" % rng.getrandbits(128)
+    return headers
+
+def _event(method: str, params: Dict, timestamp: int) -> Dict:
+    """一条 performance 日志，与 driver.get_log("performance") 的返回相同"""
+    return {
+        "level": "INFO",
+        "message": json.dumps({"message": {"method": method, "params": params}, "webview": "D0C1A9B1"}, ensure_ascii=False),
+        "timestamp": timestamp
+    }
+
+def _page_logs(rng: random.Random, requests: int, api_urls: List[str]) -> List[Dict]:
+    """模拟一次页面加载的日志：大部分是静态资源和图片，api_urls 对应的请求混在其中"""
+    logs = []
+    api_positions = set(rng.sample(range(requests), len(api_urls)))
+    api_iter = iter(api_urls)
+    timestamp = 1733126400000
+    for i in range(requests):
+        request_id = f"{rng.randint(1000, 9999)}.{i}"
+        if i in api_positions:
+            url = next(api_iter)
+        else:
+            url = f"{rng.choice(_STATIC_HOSTS)}/{'%016x' % rng.getrandbits(64)}.{rng.choice(['js', 'css', 'webp', 'jpg'])}"
+        timestamp += rng.randint(1, 20)
+        logs.append(_event("Network.requestWillBeSent", {
+            "requestId": request_id,
+            "request": {"url": url, "method": "GET", "headers": _headers(rng, 4)},
+            "timestamp": timestamp / 1000, "type": "Fetch" if "/api/" in url else "Image"
+        }, timestamp))
+        timestamp += rng.randint(5, 80)
+        logs.append(_event("Network.responseReceived", {
+            "requestId": request_id,
+            "response": {"url": url, "status": rng.choice([200] * 19 + [304]) if "/api/" not in url else 200,
+                         "headers": _headers(rng, 8), "mimeType": "application/json",
+                         "timing": {"requestTime": timestamp / 1000, "receiveHeadersEnd": rng.random() * 100}},
+            "timestamp": timestamp / 1000, "type": "Fetch"
+        }, timestamp))
+        logs.append(_event("Network.dataReceived", {
+            "requestId": request_id, "dataLength": rng.randint(100, 90000), "encodedDataLength": rng.randint(100, 90000)
+        }, timestamp))
+        logs.append(_event("Network.loadingFinished", {
+            "requestId": request_id, "encodedDataLength": rng.randint(100, 90000), "timestamp": timestamp / 1000
+        }, timestamp))
+    return logs
+
+def _request_id(logs: List[Dict], url_part: str) -> str:
+    for log in logs:
+        message = json.loads(log["message"])["message"]
+        if message["method"] == "Network.responseReceived" and url_part in message["params"]["response"]["url"]:
+            return message["params"]["requestId"]
+    raise ValueError(url_part)
+
+def make_search_fixture(rng: random.Random) -> Dict:
+    """搜索页：{"logs": [...], "bodies": {requestId: {"body": ...}}}"""
+    url = "https://edith.xiaohongshu.com/api/sns/web/v1/search/notes"
+    logs = _page_logs(rng, 60, [url])
+    items = []
+    for i in range(20):
+        items.append({
+            "id": "%024x" % rng.getrandbits(96),
+            "model_type": "note",
+            "xsec_token": "AB" + "%040x" % rng.getrandbits(160),
+            "note_card": {
+                "type": rng.choice(["normal", "video"]),
+                "display_title": _text(rng, 8),
+                "user": {"nickname": _text(rng, 2), "user_id": "%024x" % rng.getrandbits(96),
+                         "avatar": f"{_STATIC_HOSTS[2]}/avatar/{'%016x' % rng.getrandbits(64)}"},
+                "interact_info": {"liked": False, "liked_count": str(rng.randint(0, 50000))},
+                "cover": {"url_default": f"{_STATIC_HOSTS[1]}/{'%032x' % rng.getrandbits(128)}", "width": 1080, "height": 1440}
+            }
+        })
+    body = {"code": 0, "success": True, "data": {"has_more": True, "items": items}}
+    return {"logs": logs, "bodies": {_request_id(logs, url): {"body": json.dumps(body, ensure_ascii=False)}}}
+
+def make_note_fixture(rng: random.Random) -> Dict:
+    """笔记页：详情接口和评论接口，格式同 make_search_fixture"""
+    feed_url = "https://edith.xiaohongshu.com/api/sns/web/v1/feed"
+    comment_url = "https://edith.xiaohongshu.com/api/sns/web/v2/comment/page?note_id=x&cursor="
+    logs = _page_logs(rng, 80, [feed_url, comment_url])
+    note = {
+        "title": _text(rng, 8),
+        "desc": _text(rng, 300),
+        "type": "normal",
+        "tag_list": [{"name": rng.choice(_WORDS), "type": "topic"} for _ in range(5)],
+        "interact_info": {"share_count": "120", "collected_count": "860", "comment_count": "97", "liked_count": "2301"},
+        "image_list": [
+            {"info_list": [{"image_scene": "WB_PRV", "url": f"{_STATIC_HOSTS[1]}/prv/{i}"},
+                           {"image_scene": "WB_DFT", "url": f"{_STATIC_HOSTS[1]}/dft/{i}"}]}
+            for i in range(9)
+        ]
+    }
+    comments = []
+    for _ in range(20):
+        comments.append({
+            "content": _text(rng, rng.randint(5, 60)),
+            "like_count": str(rng.randint(0, 500)),
+            "sub_comments": [{"content": _text(rng, rng.randint(3, 20)), "like_count": str(rng.randint(0, 50))}
+                             for _ in range(rng.randint(0, 3))]
+        })
+    return {
+        "logs": logs,
+        "bodies": {
+            _request_id(logs, feed_url): {"body": json.dumps(
+                {"code": 0, "data": {"items": [{"id": "n1", "note_card": note}]}}, ensure_ascii=False)},
+            _request_id(logs, comment_url): {"body": json.dumps(
+                {"code": 0, "data": {"comments": comments, "has_more": True}}, ensure_ascii=False)}
+        }
+    }
+
+def make_llm_outputs(rng: random.Random) -> Dict[str, str]:
+    """模型输出的常见形态：纯 JSON、代码块、前后带说明文字、带注释和尾逗号、被截断，{形态: 文本}"""
+    opinions = {
+        "summary": _text(rng, 40),
+        "opinions": [{"viewpoint": _text(rng, 10), "support": rng.randint(1, 50), "evidence": _text(rng, 20)}
+                     for _ in range(6)],
+        "sentiment": "positive",
+        "relevance_score": 82
+    }
+    plain = json.dumps(opinions, ensure_ascii=False, indent=2)
+    return {
+        "plain": plain,
+        "fenced": f"```json\n{plain}\n```",
+        "prose_fenced": f"好的，下面是分析结果：\n\n```json\n{plain}\n```\n\n以上观点仅供参考。",
+        "prose_inline": f"根据笔记内容，分析如下 {plain} 希望对你有帮助",
+        "comments": plain.replace('"sentiment": "positive",', '"sentiment": "positive", // 整体偏正面').replace("82\n}", "82,\n}"),
+        "truncated": plain[:int(len(plain) * 0.7)],
+        "small_intent": json.dumps({"is_search": True, "keywords": "遛狗 技巧", "reason": _text(rng, 15)}, ensure_ascii=False),
+        "small_fenced": f"```\n{json.dumps({'score': 35, 'reason': _text(rng, 12)}, ensure_ascii=False)}\n```",
+    }
+
+def make_chat_stream(rng: random.Random) -> Dict:
+    """流式回复：chunks 为模型逐个返回的分片；no_break 为一段很长且没有句末标点的文本（如列表、代码）"""
+    reply = _text(rng, 1200) + "\n" + "\n".join(f"{i}. {_text(rng, 30)}" for i in range(1, 20))
+    chunks, pos = [], 0
+    while pos < len(reply):
+        size = rng.randint(1, 4)
+        chunks.append(reply[pos:pos + size])
+        pos += size
+    no_break = "".join(rng.choice(_WORDS) for _ in range(400))
+    return {"chunks": chunks, "no_break": no_break}
+
+def main():
+    rng = random.Random(20241202)
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    fixtures = {
+        "search_logs.json": make_search_fixture(rng),
+        "note_logs.json": make_note_fixture(rng),
+        "llm_outputs.json": make_llm_outputs(rng),
+        "chat_stream.json": make_chat_stream(rng),
+    }
+    for name, data in fixtures.items():
+        path = os.path.join(FIXTURES_DIR, name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"{path}: {os.path.getsize(path) // 1024} KB")
+
+if __name__ == "__main__":
+    main()
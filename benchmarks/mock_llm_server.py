@@ -0,0 +1,270 @@
+"""本地 OpenAI 兼容的 chat completions 模拟服务
+
+用于在没有网络的情况下对 AIService / ChatService / TaskExecutor 做可重复的性能测试。
+支持流式输出、response_format=json_object，可配置首包延迟、输出速率、失败注入和长时间卡顿，
+并按提示词类型返回符合 schema 的预置 JSON。
+
+用法:
+    python -m benchmarks.mock_llm_server --port 8900 --latency 0.3 --token-rate 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from tools.token_tools import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class MockLLMConfig:
+    latency: float = 0.2            # 首个 token 之前的延迟（秒）
+    latency_jitter: float = 0.1     # 延迟的随机抖动（秒）
+    token_rate: float = 50.0        # 每秒输出 token 数，<=0 表示不限速
+    chunk_tokens: int = 4           # 流式输出时每个分片的 token 数
+    failure_rate: float = 0.0       # 返回 HTTP 500 的概率
+    stall_rate: float = 0.0         # 卡顿的概率
+    stall_seconds: float = 60.0     # 卡顿时长
+    seed: Optional[int] = None
+    # 提示词类型 -> 固定返回内容，覆盖内置的预置响应
+    responses: Dict[str, str] = field(default_factory=dict)
+
+# 提示词类型识别规则，按顺序匹配最后一条用户消息和系统消息
+PROMPT_KINDS = [
+    ("keywords", "search keyword optimization expert"),
+    ("note_opinions_batch", r"分析以下 \d+ 篇小红书笔记"),
+    ("note_opinions", "分析以下小红书笔记及其评论中的观点"),
+    ("triage", "与该主题的相关程度"),
+    ("batch_summary", "分析以下笔记中的观点汇总"),
+    ("all_opinions", "分析以下所有笔记中的观点"),
+    ("user_summary", "生成一个用户友好的总结"),
+    ("search_intent", "判断用户是否在寻求信息搜索"),
+    ("ocr", "professional OCR model"),
+]
+
+def _note_opinion(title: str = "") -> dict:
+    return {
+        "note_influence_score": "60",
+        "main_opinion": {
+            "content": f"{title}的核心观点",
+            "confidence": "70",
+            "keywords": ["体验", "推荐"],
+            "support_metrics": {"likes": "120", "collects": "30", "shares": "5",
+                                "supporting_comments": "3", "opposing_comments": "1"}
+        },
+        "supporting_opinions": [
+            {"content": "评论区认同作者的做法", "source": "评论", "confidence": "60",
+             "keywords": ["认同"], "metrics": {"likes": "20", "sub_comments": "2"}}
+        ],
+        "opposing_opinions": [
+            {"content": "有人认为价格偏高", "source": "评论", "confidence": "40",
+             "keywords": ["价格"], "metrics": {"likes": "8", "sub_comments": "1"}}
+        ]
+    }
+
+def _batch_opinions(prompt: str) -> dict:
+    note_ids = re.findall(r'"note_id":\s*"([^"]*)"', prompt)
+    # schema 说明中也有一个 note_id 占位，需要排除
+    return {"results": [{"note_id": nid, "analysis": _note_opinion(nid)}
+                        for nid in note_ids if nid != "输入中的 note_id，原样返回"]}
+
+def _triage(prompt: str) -> dict:
+    ids = re.findall(r'"id":\s*"([^"]*)"', prompt)
+    return {"scores": {nid: str(40 + sum(map(ord, nid)) % 60) for nid in ids}}
+
+CANNED_RESPONSES: Dict[str, Union[str, Callable[[str], Union[str, dict]]]] = {
+    "keywords": "遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项",
+    "note_opinions": lambda prompt: _note_opinion(),
+    "note_opinions_batch": _batch_opinions,
+    "triage": _triage,
+    "batch_summary": "1. 主流观点：多数人认为值得尝试\n2. 争议点：价格\n3. 支持度较高\n4. 未发现明显误导信息",
+    "all_opinions": lambda prompt: {
+        "trending_opinions": [
+            {"content": "多数人认为值得尝试", "confidence": "75", "support_level": "70",
+             "influence_score": "65", "keywords": ["体验", "推荐"], "sources": ["n1"], "trend": "上升"}
+        ],
+        "controversial_points": [
+            {"topic": "价格", "supporting_view": "物有所值", "opposing_view": "偏贵",
+             "support_ratio": "60", "discussion_heat": "50"}
+        ],
+        "time_based_analysis": {"opinion_shifts": ["关注点转向性价比"],
+                                "emerging_topics": ["平替"], "fading_topics": ["开箱"]}
+    },
+    "user_summary": "# 总体分析\n多数人认为值得尝试。\n\n## 主要观点\n- 体验好\n\n## 争议焦点\n1. 价格\n\n## 建议\n按需选择。",
+    "search_intent": lambda prompt: {"is_search": True, "keywords": "遛狗",
+                                     "reason": "用户在询问遛狗相关信息"},
+    "ocr": "模拟识别文本",
+    "chat": "好的，这是一个模拟回复。遛狗时请注意牵引绳和天气！还有其他问题吗？",
+}
+
+def _message_text(message: dict) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return "\n".join(item.get("text", "") for item in content if isinstance(item, dict))
+    return content or ""
+
+def detect_prompt_kind(messages: List[dict]) -> str:
+    """根据消息内容判断提示词类型"""
+    text = "\n".join(_message_text(m) for m in messages if m.get("role") in ("system", "user"))
+    for kind, pattern in PROMPT_KINDS:
+        if re.search(pattern, text):
+            return kind
+    return "chat"
+
+def create_app(mock_config: MockLLMConfig) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(mock_config.seed)
+    stats: Dict[str, Dict[str, int]] = {}
+
+    def render(kind: str, prompt: str) -> str:
+        canned = mock_config.responses.get(kind, CANNED_RESPONSES.get(kind, CANNED_RESPONSES["chat"]))
+        result = canned(prompt) if callable(canned) else canned
+        return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+
+    def split_tokens(text: str, chunk_tokens: int) -> List[str]:
+        # 按估算 token 数切分，中文每个字算一个 token
+        chunks, current = [], ""
+        for ch in text:
+            current += ch
+            if estimate_tokens(current) >= chunk_tokens:
+                chunks.append(current)
+                current = ""
+        if current:
+            chunks.append(current)
+        return chunks
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model") or "mock-model"
+        kind = detect_prompt_kind(messages)
+        prompt = "\n".join(_message_text(m) for m in messages)
+        kind_stats = stats.setdefault(kind, {"requests": 0, "failures": 0, "stalls": 0})
+        kind_stats["requests"] += 1
+
+        delay = max(0.0, mock_config.latency + rng.uniform(-1, 1) * mock_config.latency_jitter)
+        if rng.random() < mock_config.stall_rate:
+            kind_stats["stalls"] += 1
+            delay += mock_config.stall_seconds
+        await asyncio.sleep(delay)
+
+        if rng.random() < mock_config.failure_rate:
+            kind_stats["failures"] += 1
+            return JSONResponse(status_code=500, content={
+                "error": {"message": "mock injected failure", "type": "server_error"}
+            })
+
+        text = render(kind, prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(text)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        per_chunk_delay = (mock_config.chunk_tokens / mock_config.token_rate) if mock_config.token_rate > 0 else 0
+
+        if body.get("stream"):
+            async def event_stream():
+                for piece in split_tokens(text, mock_config.chunk_tokens):
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    if per_chunk_delay:
+                        await asyncio.sleep(per_chunk_delay)
+                final = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        # 非流式请求同样按 token 速率模拟生成耗时
+        if mock_config.token_rate > 0:
+            await asyncio.sleep(completion_tokens / mock_config.token_rate)
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    return app
+
+class MockLLMServer:
+    """在当前事件循环中后台运行模拟服务"""
+
+    def __init__(self, mock_config: MockLLMConfig, host: str = "127.0.0.1", port: int = 8900):
+        self.host = host
+        self.port = port
+        self._server = uvicorn.Server(uvicorn.Config(
+            create_app(mock_config), host=host, port=port, log_level="warning", log_config=None
+        ))
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                self._task.result()
+            await asyncio.sleep(0.05)
+        logger.info(f"Mock LLM server listening on {self.base_url}")
+
+    async def stop(self):
+        self._server.should_exit = True
+        if self._task:
+            await self._task
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.2, help="首个 token 前的延迟（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.1, help="延迟随机抖动（秒）")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每秒输出 token 数，0 表示不限速")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="注入 HTTP 500 的概率")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="注入长时间卡顿的概率")
+    parser.add_argument("--stall-seconds", type=float, default=60.0, help="卡顿时长（秒）")
+    parser.add_argument("--responses", type=str, default=None, help="JSON 文件，提示词类型 -> 固定返回内容")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+
+def mock_config_from_args(args: argparse.Namespace) -> MockLLMConfig:
+    responses = {}
+    if args.responses:
+        with open(args.responses, 'r', encoding='utf-8') as f:
+            responses = json.load(f)
+    return MockLLMConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        token_rate=args.token_rate,
+        failure_rate=args.failure_rate,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        seed=args.seed,
+        responses=responses
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s - %(levelname)s [in %(pathname)s:%(lineno)d] - %(message)s')
+    uvicorn.run(create_app(mock_config_from_args(args)), host=args.host, port=args.port, log_config=None)
@@ -18,7 +18,8 @@ class ConfigManager:
 
     def _load_config(self):
         """加载配置文件并处理环境变量覆盖"""
-        config_path = Path(__file__).parent / 'config.yaml'
+        # CONFIG_FILE 可指定其他配置文件（如测试使用 config.yaml.default）
+        config_path = Path(os.getenv('CONFIG_FILE') or Path(__file__).parent / 'config.yaml')
         
         with open(config_path, 'r', encoding='utf-8') as f:
             self._config = yaml.safe_load(f)
@@ -0,0 +1,127 @@
+# 各类提示词要求模型返回的 JSON 结构，使用 JSON Schema 的子集（type、properties、required、items）
+# 模型常把数值写成字符串（如 "70" 或 "70分"），数值字段同时接受字符串
+
+SCORE = {"type": ["string", "number"]}
+STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+OPINION_ITEM = {
+    "type": "object",
+    "required": ["content"],
+    "properties": {
+        "content": {"type": "string"},
+        "source": {"type": "string"},
+        "confidence": SCORE,
+        "keywords": STRING_LIST,
+        "metrics": {"type": "object"}
+    }
+}
+
+NOTE_OPINIONS = {
+    "type": "object",
+    "required": ["note_influence_score", "main_opinion", "supporting_opinions", "opposing_opinions"],
+    "properties": {
+        "note_influence_score": SCORE,
+        "main_opinion": {
+            "type": "object",
+            "required": ["content", "confidence"],
+            "properties": {
+                "content": {"type": "string"},
+                "confidence": SCORE,
+                "keywords": STRING_LIST,
+                "support_metrics": {"type": "object"}
+            }
+        },
+        "supporting_opinions": {"type": "array", "items": OPINION_ITEM},
+        "opposing_opinions": {"type": "array", "items": OPINION_ITEM}
+    }
+}
+
+NOTE_OPINIONS_BATCH = {
+    "type": "object",
+    "required": ["results"],
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["note_id", "analysis"],
+                "properties": {
+                    "note_id": {"type": ["string", "number"]},
+                    "analysis": {"type": "object"}
+                }
+            }
+        }
+    }
+}
+
+ALL_OPINIONS = {
+    "type": "object",
+    "required": ["trending_opinions", "controversial_points", "time_based_analysis"],
+    "properties": {
+        "trending_opinions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["content"],
+                "properties": {
+                    "content": {"type": "string"},
+                    "confidence": SCORE,
+                    "support_level": SCORE,
+                    "influence_score": SCORE,
+                    "keywords": STRING_LIST,
+                    "sources": {"type": "array"},
+                    "trend": {"type": "string"}
+                }
+            }
+        },
+        "controversial_points": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["topic"],
+                "properties": {
+                    "topic": {"type": "string"},
+                    "supporting_view": {"type": "string"},
+                    "opposing_view": {"type": "string"},
+                    "support_ratio": SCORE,
+                    "discussion_heat": SCORE
+                }
+            }
+        },
+        "time_based_analysis": {
+            "type": "object",
+            "properties": {
+                "opinion_shifts": STRING_LIST,
+                "emerging_topics": STRING_LIST,
+                "fading_topics": STRING_LIST
+            }
+        }
+    }
+}
+
+SEARCH_INTENT = {
+    "type": "object",
+    "required": ["is_search", "keywords"],
+    "properties": {
+        "is_search": {"type": "boolean"},
+        "keywords": {"type": ["string", "null"]},
+        "reason": {"type": "string"}
+    }
+}
+
+TRIAGE_SCORES = {
+    "type": "object",
+    "required": ["scores"],
+    "properties": {
+        "scores": {"type": "object"}
+    }
+}
+
+# 提示词类型 -> 返回格式
+OUTPUT_SCHEMAS = {
+    "note_opinions": NOTE_OPINIONS,
+    "note_opinions_batch": NOTE_OPINIONS_BATCH,
+    "all_opinions": ALL_OPINIONS,
+    "search_intent": SEARCH_INTENT,
+    "triage": TRIAGE_SCORES,
+}
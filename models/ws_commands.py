@@ -0,0 +1,27 @@
+# 客户端通过 WebSocket 发送的命令及其参数，与 /ai 下对应的 HTTP 接口一一对应
+#
+# 请求：{"type": "command", "id": "<客户端生成的请求ID>", "command": "<命令名>", "args": {...}}
+# 应答：{"type": "ack", "id": "<请求ID>", "command": "<命令名>", "status": "success" | "error" | "busy",
+#        "result": {...}}，result 与 HTTP 接口的返回相同；busy 时带 retry_after（秒），客户端稍后重试
+from typing import Any, Dict, Optional
+from pydantic import BaseModel
+
+class ChatCommand(BaseModel):
+    message: str
+
+class StartSearchCommand(BaseModel):
+    keywords: str
+    task_id: str
+
+class StartUnattendedSearchCommand(BaseModel):
+    keywords: str
+    max_notes: Optional[int] = None
+    max_seconds: Optional[int] = None
+    max_tokens: Optional[int] = None
+
+class CancelSearchCommand(BaseModel):
+    task_id: str
+
+class UserInputCommand(BaseModel):
+    task_id: str
+    input: Dict[str, Any]
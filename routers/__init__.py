@@ -1,5 +1,6 @@
 from .main_router import router as main_router
 from .ai_router import router as ai_router
 from .data_router import router as data_router
+from .debug_router import router as debug_router
 
-__all__ = ["main_router", "ai_router", "data_router"] 
\ No newline at end of file
+__all__ = ["main_router", "ai_router", "data_router", "debug_router"] 
\ No newline at end of file
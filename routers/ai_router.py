@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from services.chat_service import ChatService
+from services.structured_output_service import get_parse_stats
+from services.intent_service import get_intent_stats
+from services.chat_session import get_history_stats
 from typing import Optional
 import logging
 
@@ -25,6 +28,13 @@ class SearchTask(BaseModel):
     client_id: str
     task_id: str
 
+class UnattendedSearch(BaseModel):
+    keywords: str
+    client_id: str
+    max_notes: Optional[int] = None
+    max_seconds: Optional[int] = None
+    max_tokens: Optional[int] = None
+
 @router.post("/chat")
 async def chat(message: ChatMessage):
     if not message.client_id:
@@ -44,6 +54,21 @@ async def start_auto_search(task: SearchTask):
     logger.info(f"Auto search started with result: {result}")
     return result
 
+@router.post("/start_unattended_search")
+async def start_unattended_search(search: UnattendedSearch):
+    """开始无人值守搜索任务，适用于定时任务和接口调用"""
+    logger.debug(f"Starting unattended search: {search}")
+    if not search.keywords:
+        raise HTTPException(status_code=400, detail="keywords is required for starting search")
+    
+    result = await chat_service.start_unattended_search(search.keywords, search.client_id, {
+        "max_notes": search.max_notes,
+        "max_seconds": search.max_seconds,
+        "max_tokens": search.max_tokens
+    })
+    logger.info(f"Unattended search started with result: {result}")
+    return result
+
 @router.post("/cancel_auto_search")
 async def cancel_auto_search(task: SearchTask):
     """取消搜索任务"""
@@ -61,6 +86,12 @@ async def get_search_tasks(client_id: str):
     logger.info(f"Getting search tasks for client: {client_id}")
     return await chat_service.get_search_tasks(client_id)
 
+@router.get("/search_task/{task_id}")
+async def get_search_task(task_id: str, client_id: str):
+    """获取单个搜索任务的完整结果"""
+    logger.info(f"Getting search task {task_id} for client: {client_id}")
+    return await chat_service.get_search_task(task_id, client_id)
+
 @router.post("/submit_user_input")
 async def submit_user_input(task_input: dict):
     """提交用户输入"""
@@ -75,3 +106,27 @@ async def submit_user_input(task_input: dict):
     )
     logger.info(f"User input submitted with result: {result}")
     return result
+
+@router.get("/structured_output_stats")
+async def structured_output_stats():
+    """获取各模型结构化输出的解析失败率和补全情况"""
+    return {
+        "status": "success",
+        "stats": get_parse_stats()
+    }
+
+@router.get("/intent_stats")
+async def intent_stats():
+    """获取搜索意图本地预判的覆盖率，以及抽样对照得到的精确率和召回率"""
+    return {
+        "status": "success",
+        "stats": get_intent_stats()
+    }
+
+@router.get("/history_stats")
+async def history_stats():
+    """获取每轮对话提示词的大小和对话摘要的统计"""
+    return {
+        "status": "success",
+        "stats": get_history_stats()
+    }
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from services.trace_service import TraceService
+from services.profiling_service import ProfilingService
+from config.config_manager import config
+from typing import Optional
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """请求需要带上与 debug.admin_token 一致的 X-Admin-Token 请求头，未配置 admin_token 时调试接口不可用"""
+    token = config.get('debug.admin_token', '')
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+class CpuProfileRequest(BaseModel):
+    duration: float = 30
+    interval: Optional[float] = None
+
+@router.get("/trace/{task_id}")
+async def get_trace(task_id: str):
+    """获取任务各阶段 span 的瀑布图"""
+    trace = await TraceService().waterfall(task_id)
+    if trace is None:
+        return {"status": "error", "message": "没有该任务的追踪记录"}
+    return {"status": "success", "trace": trace}
+
+@router.post("/profile/cpu/start")
+async def start_cpu_profile(request: CpuProfileRequest):
+    """开始 CPU 采样，duration 秒后自动停止"""
+    return ProfilingService().start_cpu_profile(request.duration, request.interval)
+
+@router.post("/profile/cpu/stop")
+async def stop_cpu_profile():
+    """停止 CPU 采样并返回结果"""
+    return ProfilingService().stop_cpu_profile()
+
+@router.get("/profile/cpu")
+async def get_cpu_profile(format: str = "json"):
+    """获取最近一次 CPU 采样的结果，format=folded 时返回可直接生成火焰图的折叠调用栈文本"""
+    service = ProfilingService()
+    if format == "folded":
+        if not service.profiler:
+            raise HTTPException(status_code=404, detail="no cpu profile")
+        return PlainTextResponse(service.profiler.folded())
+    return service.get_cpu_profile()
+
+@router.post("/profile/memory/snapshot")
+async def take_memory_snapshot(top: int = 20):
+    """保存内存快照，返回按模块汇总的内存占用"""
+    return await ProfilingService().take_snapshot(top)
+
+@router.get("/profile/memory/diff")
+async def diff_memory_snapshots(base_id: int, target_id: Optional[int] = None, top: int = 20):
+    """按模块比较两个快照，不指定 target_id 时与当前内存比较"""
+    return await ProfilingService().diff_snapshots(base_id, target_id, top)
+
+@router.post("/profile/memory/stop")
+async def stop_memory_tracing():
+    """停止跟踪内存分配"""
+    return ProfilingService().stop_memory_tracing()
@@ -3,6 +3,7 @@ from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from services.browser_service import BrowserService
 from services.websocket_service import WebsocketService
+import json
 import logging
 from typing import Optional
 
@@ -81,14 +82,27 @@ async def open_note(
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     logger.info(f"New WebSocket connection request from client {client_id}")
-    await websocket_service.connect(client_id, websocket)
+    # 重连时客户端带上最后收到的消息序号，补发断线期间的消息
+    last_seq = websocket.query_params.get("last_seq")
+    await websocket_service.connect(client_id, websocket,
+                                    last_seq=int(last_seq) if last_seq and last_seq.isdigit() else None,
+                                    epoch=websocket.query_params.get("epoch"),
+                                    task_id=websocket.query_params.get("task_id"),
+                                    encoding=websocket.query_params.get("encoding"))
     logger.info(f"Client {client_id} connected, connection id: {id(websocket)}")
     try:
         while True:
             data = await websocket.receive_text()
             logger.debug(f"Received message from client {client_id}: {data}")
+            try:
+                message = json.loads(data)
+            except json.JSONDecodeError:
+                logger.warning(f"Invalid message from client {client_id}: {data[:200]}")
+                continue
+            if isinstance(message, dict):
+                await websocket_service.dispatch(client_id, message)
     except Exception as e:
         logger.error(f"WebSocket error for client {client_id}: {e}")
     finally:
         logger.info(f"Client {client_id} disconnected")
-        websocket_service.disconnect(client_id)
\ No newline at end of file
+        websocket_service.disconnect(client_id, websocket)
\ No newline at end of file
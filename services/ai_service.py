@@ -1,24 +1,232 @@
 import base64
 import logging
+import math
 import os
 import asyncio
-from typing import List
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from models.ai_models import Message, MessageRole
 from config.config_manager import config
 import openai
 from tools.image_tools import image_file_to_base64
+from tools.token_tools import estimate_tokens
+from services.trace_service import span, record_span
 from PIL import Image
 
+class TokenUsage:
+    """Token counter for one logical job, e.g. a search task"""
+
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+# Usage counter of the current job. Set it before making requests; every request made from that
+# context, including child asyncio tasks created afterwards, adds its tokens to the same counter.
+current_token_usage: ContextVar[Optional[TokenUsage]] = ContextVar('current_token_usage', default=None)
+
+def _prompt_tokens(messages: List[dict]) -> int:
+    tokens = 0
+    for m in messages:
+        content = m.get('content')
+        if isinstance(content, list):
+            # Only text parts count, base64 images would dominate the estimate
+            tokens += sum(estimate_tokens(item.get('text', '')) for item in content if isinstance(item, dict))
+        else:
+            tokens += estimate_tokens(content)
+    return tokens
+
+def _record_usage(prompt_tokens: int, completion_tokens: int):
+    usage = current_token_usage.get()
+    if usage is not None:
+        usage.add(prompt_tokens, completion_tokens)
+
+class Endpoint:
+    """One OpenAI-compatible endpoint with its own client and circuit breaker"""
+
+    def __init__(self, base_url: str, api_key: str, model: Optional[str] = None):
+        self.base_url = base_url
+        self.model = model  # overrides the requested model when set
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                         max_retries=config.get('llm.max_retries', 2))
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._half_open_trial = False
+
+    def available(self) -> bool:
+        """Closed breaker, or open breaker whose reset timeout has passed (one half-open trial)"""
+        if not self.open_until:
+            return True
+        return time.monotonic() >= self.open_until and not self._half_open_trial
+
+    def acquire(self):
+        if self.open_until and time.monotonic() >= self.open_until:
+            self._half_open_trial = True
+
+    def release(self):
+        """The attempt was cancelled before proving anything, allow another half-open trial"""
+        self._half_open_trial = False
+
+    def record_success(self):
+        if self.open_until:
+            logging.info(f'Circuit breaker closed for {self.base_url}')
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._half_open_trial = False
+
+    def record_failure(self, failure_threshold: int, reset_timeout: float):
+        self.consecutive_failures += 1
+        self._half_open_trial = False
+        if self.consecutive_failures >= failure_threshold:
+            self.open_until = time.monotonic() + reset_timeout
+            logging.warning(f'Circuit breaker opened for {self.base_url} after '
+                            f'{self.consecutive_failures} consecutive failures, retry in {reset_timeout}s')
+
 class AIService:
-    def __init__(self, max_images: int = 2, base_url: str = None, api_key: str = None):
+    def __init__(self, max_images: int = 2, base_url: str = None, api_key: str = None,
+                 fallback_endpoints: Optional[List[Dict]] = None):
+        """
+        Args:
+            max_images: Max images kept in one request
+            base_url: Primary endpoint
+            api_key: Primary endpoint API key
+            fallback_endpoints: Secondary endpoints used for hedging and failover, each a dict
+                with base_url, api_key or key_envname, and an optional model override.
+                Entries from llm.fallback_endpoints in the config are appended.
+        """
         if not base_url:
             base_url = config.llm.get('openai_custom_mm_url')
         self._base_url = base_url
         if not api_key:
             api_key = os.getenv(config.llm.get('openai_custom_key_envname_mm'))
-        self._client = openai.AsyncOpenAI(api_key=api_key, base_url=self._base_url)
+        self._endpoints = [Endpoint(base_url, api_key)]
+        for fallback in (fallback_endpoints or []) + (config.llm.get('fallback_endpoints') or []):
+            self._endpoints.append(Endpoint(
+                fallback['base_url'],
+                fallback.get('api_key') or os.getenv(fallback.get('key_envname') or '') or api_key,
+                fallback.get('model') or None
+            ))
         self._max_images = max_images
 
+        # Hedging: duplicate a request to the next endpoint when it is slower than
+        # the given percentile of recent latencies for similar requests
+        hedging = config.llm.get('hedging') or {}
+        self._hedging_enabled = hedging.get('enabled', False)
+        self._hedge_percentile = hedging.get('percentile', 95)
+        self._hedge_min_delay = hedging.get('min_delay', 2.0)
+        self._hedge_max_delay = hedging.get('max_delay', 30.0)
+        self._hedge_initial_delay = hedging.get('initial_delay', 10.0)
+        self._hedge_min_samples = hedging.get('min_samples', 10)
+        self._latency_window = hedging.get('window', 100)
+        self._latencies: Dict[Tuple, deque] = {}
+
+        breaker = config.llm.get('circuit_breaker') or {}
+        self._failure_threshold = breaker.get('failure_threshold', 3)
+        self._reset_timeout = breaker.get('reset_timeout', 30.0)
+
+    @staticmethod
+    def _latency_key(model: str, messages: List[dict], stream: bool) -> Tuple:
+        """Group latencies by model, streaming, and prompt size (log2 buckets of ~500 tokens)"""
+        tokens = _prompt_tokens(messages)
+        size_bucket = min(5, int(math.log2(max(1, tokens / 500))))
+        return model, stream, size_bucket
+
+    def _record_latency(self, key: Tuple, seconds: float):
+        if key not in self._latencies:
+            self._latencies[key] = deque(maxlen=self._latency_window)
+        self._latencies[key].append(seconds)
+
+    def _hedge_delay(self, key: Tuple) -> float:
+        samples = self._latencies.get(key)
+        if not samples or len(samples) < self._hedge_min_samples:
+            return self._hedge_initial_delay
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self._hedge_percentile / 100))
+        return min(self._hedge_max_delay, max(self._hedge_min_delay, ordered[index]))
+
+    async def _attempt(self, endpoint: Endpoint, call: Callable[[Endpoint], Awaitable], key: Tuple):
+        start = time.monotonic()
+        try:
+            result = await call(endpoint)
+        except asyncio.CancelledError:
+            endpoint.release()
+            raise
+        except Exception as e:
+            endpoint.record_failure(self._failure_threshold, self._reset_timeout)
+            logging.warning(f'Request to {endpoint.base_url} failed: {e}')
+            raise
+        endpoint.record_success()
+        self._record_latency(key, time.monotonic() - start)
+        return result
+
+    async def _hedged_call(self, call: Callable[[Endpoint], Awaitable], key: Tuple,
+                           discard: Optional[Callable[[Any], Awaitable]] = None):
+        """Run call on the first available endpoint, hedge to the next one if it is slow,
+        and fail over when it errors. The first successful result wins, the rest are cancelled;
+        results of other attempts that also succeeded are passed to discard (e.g. to close a stream)."""
+        candidates = [ep for ep in self._endpoints if ep.available()]
+        if not candidates:
+            # All breakers open: try the one that will recover first rather than failing outright
+            candidates = [min(self._endpoints, key=lambda ep: ep.open_until)]
+        pending: Dict[asyncio.Task, Endpoint] = {}
+        losers: List[asyncio.Task] = []
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch():
+            endpoint = candidates.pop(0)
+            endpoint.acquire()
+            pending[asyncio.create_task(self._attempt(endpoint, call, key))] = endpoint
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self._hedging_enabled and candidates and not hedged:
+                    timeout = self._hedge_delay(key)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    logging.info(f'No response from {next(iter(pending.values())).base_url} within '
+                                 f'{timeout:.1f}s, hedging to {candidates[0].base_url}')
+                    launch()
+                    continue
+
+                winner = None
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        if winner is None:
+                            winner = task
+                        else:
+                            losers.append(task)
+                    else:
+                        last_error = task.exception()
+                if winner:
+                    return winner.result()
+                if not pending and candidates:
+                    launch()
+            raise last_error
+        finally:
+            losers.extend(task for task in pending if task.done())
+            for task in pending:
+                task.cancel()
+            for task in losers:
+                if discard and not task.cancelled() and task.exception() is None:
+                    try:
+                        await discard(task.result())
+                    except Exception as e:
+                        logging.warning(f'Error discarding result of a losing attempt: {e}')
+
     def _process_messages(self, messages: List[Message]) -> List[Message]:
         """Process messages to ensure image count is within limits"""
         image_count = 0
@@ -52,52 +260,119 @@ class AIService:
         """
         messages = self._process_messages(messages)
         try:
-            kwargs = {
-                "model": model,
-                "messages": [message.to_dict() for message in messages],
-            }
-            
-            # Add response_format if json_mode is enabled and supported
-            if json_mode and config.llm.get('support_json_mode', False):
-                kwargs["response_format"] = {"type": "json_object"}
+            message_dicts = [message.to_dict() for message in messages]
+
+            async def create(endpoint: Endpoint):
+                kwargs = {
+                    "model": endpoint.model or model,
+                    "messages": message_dicts,
+                }
                 
-            response = await self._client.chat.completions.create(**kwargs)
+                # Add response_format if json_mode is enabled and supported
+                if json_mode and config.llm.get('support_json_mode', False):
+                    kwargs["response_format"] = {"type": "json_object"}
+                    
+                return await endpoint.client.chat.completions.create(**kwargs)
+
+            with span("llm.generate", model=model, json_mode=json_mode) as attrs:
+                response = await self._hedged_call(create, self._latency_key(model, message_dicts, False))
+                attrs["model"] = getattr(response, "model", None) or model
             
-            logging.debug(f"Token usage - Input: {response.usage.prompt_tokens}, "
-                         f"Output: {response.usage.completion_tokens}, "
-                         f"Total: {response.usage.total_tokens}")
+            content = response.choices[0].message.content
+            if response.usage:
+                logging.debug(f"Token usage - Input: {response.usage.prompt_tokens}, "
+                             f"Output: {response.usage.completion_tokens}, "
+                             f"Total: {response.usage.total_tokens}")
+                _record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+            else:
+                _record_usage(_prompt_tokens(message_dicts), estimate_tokens(content))
             
-            return response.choices[0].message.content
+            return content
         except Exception as e:
             logging.error(f'send message to {self._base_url} error: {e}')
             return ''
 
-    async def generate_response_stream(self, messages: List[Message], model: str = "Qwen/Qwen2-VL-2B-Instruct-AWQ"):
-        """Stream version of generate_response"""
+    async def generate_response_stream(self, messages: List[Message], model: str = "Qwen/Qwen2-VL-2B-Instruct-AWQ",
+                                       raise_errors: bool = False):
+        """Stream version of generate_response
+
+        Hedging and failover apply until the first content chunk arrives; after that the
+        stream stays on the endpoint that answered first.
+
+        Args:
+            messages: List of messages
+            model: Model name
+            raise_errors: Raise upstream errors instead of yielding them as an "Error: ..." chunk
+        """
         messages = self._process_messages(messages)
         try:
-            response_stream = await self._client.chat.completions.create(
-                model=model,
-                messages=[message.to_dict() for message in messages],
-                stream=True,
-                # stream_options = {
-                #     "include_usage": True
-                # }
+            message_dicts = [message.to_dict() for message in messages]
+
+            async def open_stream(endpoint: Endpoint):
+                response_stream = await endpoint.client.chat.completions.create(
+                    model=endpoint.model or model,
+                    messages=message_dicts,
+                    stream=True,
+                    # stream_options = {
+                    #     "include_usage": True
+                    # }
+                )
+                try:
+                    # Wait for the first content chunk so a stalled endpoint can be hedged
+                    async for chunk in response_stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            return response_stream, chunk.choices[0].delta.content
+                    return response_stream, None
+                except BaseException:
+                    await response_stream.close()
+                    raise
+
+            # The span covers the whole stream; it is recorded by hand because a context manager
+            # cannot stay open across the yields of an async generator
+            stream_start = time.perf_counter()
+            stream_status = "error"
+            response_stream, first_content = await self._hedged_call(
+                open_stream, self._latency_key(model, message_dicts, True),
+                discard=lambda result: result[0].close()
             )
+            first_chunk_ms = round((time.perf_counter() - stream_start) * 1000, 2)
             # total_prompt_tokens = 0
             # total_completion_tokens = 0
-            async for chunk in response_stream:
-                # if hasattr(chunk, 'usage') and chunk.usage:
-                #     total_prompt_tokens = chunk.usage.prompt_tokens
-                #     total_completion_tokens = chunk.usage.completion_tokens
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            completion_tokens = 0
+            try:
+                if first_content:
+                    completion_tokens += estimate_tokens(first_content)
+                    yield first_content
+                async for chunk in response_stream:
+                    # if hasattr(chunk, 'usage') and chunk.usage:
+                    #     total_prompt_tokens = chunk.usage.prompt_tokens
+                    #     total_completion_tokens = chunk.usage.completion_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        completion_tokens += estimate_tokens(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                stream_status = "ok"
+            except GeneratorExit:
+                # The consumer stopped reading early
+                stream_status = "closed"
+                raise
+            except asyncio.CancelledError:
+                stream_status = "cancelled"
+                raise
+            finally:
+                record_span("llm.stream", stream_start, stream_status, model=model,
+                            first_chunk_ms=first_chunk_ms, completion_tokens=completion_tokens)
+                # Streams carry no usage block here, count the estimate
+                _record_usage(_prompt_tokens(message_dicts), completion_tokens)
+                # Abort the upstream HTTP stream right away when the consumer stops early or is cancelled
+                await response_stream.close()
 
             # logging.debug(f"Stream response token usage - Input: {total_prompt_tokens}, "
             #              f"Output: {total_completion_tokens}, "
             #              f"Total: {total_prompt_tokens + total_completion_tokens}")
         except Exception as e:
             logging.error(f'Stream response error: {e}')
+            if raise_errors:
+                raise
             yield f"Error: {str(e)}"
 
     async def ocr(self, image_path: str = None, image_content_base64: str = None, model: str = "Qwen/Qwen2-VL-2B-Instruct-AWQ") -> str:
@@ -6,16 +6,18 @@ from io import BytesIO
 import base64
 import asyncio
 import json
+from typing import Callable, Dict, List, Optional, Tuple
 from config.config_manager import config
 from services.ai_service import AIService
+from services.trace_service import span
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.core.driver_cache import DriverCacheManager
 
@@ -37,6 +39,8 @@ class BrowserService:
             chrome_config = config.chrome
             self.debug_port = chrome_config['debug_port']
             self.user_data_dir = chrome_config['user_data_dir']
+            # 等待页面元素时每隔多少秒检查一次，间隔之间让出事件循环，任务取消可以及时生效
+            self.wait_poll_interval = config.get('chrome.wait_poll_interval', 0.2)
             self._initialized = True
 
     @classmethod
@@ -193,6 +197,178 @@ class BrowserService:
                 return None
             raise
 
+    def _get_response_body(self, request_id: str):
+        """通过 CDP 获取接口响应内容"""
+        with span("browser.fetch_body"):
+            return self.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+
+    async def _wait_until(self, condition: Callable, timeout: float):
+        """与 WebDriverWait(driver, timeout).until(condition) 相同，但等待期间不阻塞事件循环
+
+        WebDriverWait 在事件循环线程中同步等待，期间任务取消要等到超时后才生效；
+        这里每隔 wait_poll_interval 秒检查一次，其余时间 await asyncio.sleep，取消在下一次检查前生效。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                result = condition(self.driver)
+                if result:
+                    return result
+            except NoSuchElementException:
+                pass
+            if time.monotonic() >= deadline:
+                raise TimeoutException(f"Condition not met in {timeout}s")
+            await asyncio.sleep(self.wait_poll_interval)
+
+    async def reset_page(self):
+        """中止页面加载并清空性能日志，用于任务在浏览器操作中途被取消后，避免残留的请求日志混入下一个任务"""
+        if not self.driver:
+            return
+        try:
+            self.driver.execute_script("window.stop();")
+            self.driver.get_log("performance")
+        except Exception as e:
+            logger.warning(f"Error resetting page: {e}")
+
+    @staticmethod
+    def parse_search_logs(logs: List[Dict], get_body: Callable[[str], Optional[Dict]]) -> List[Dict]:
+        """从性能日志中找到搜索接口的响应，提取笔记列表
+
+        Args:
+            logs: driver.get_log("performance") 返回的日志
+            get_body: 根据 requestId 获取响应内容，返回 {"body": ...}
+        """
+        search_results = []
+        for log in logs:
+            try:
+                message = json.loads(log.get("message", "{}"))
+                method = message.get('message', {}).get('method')
+                if method != "Network.responseReceived":
+                    continue
+                message_params = message.get("message", {}).get("params", {})
+
+                if not message_params:
+                    continue
+
+                request_id = message_params.get("requestId")
+                response = message_params.get("response", {})
+                resp_url = response.get("url", "")
+                if not request_id or not resp_url or response.get("status") not in [200, 201]:
+                    continue
+
+                if "api/sns/web/v1/search/notes" in resp_url:
+                    response_body = get_body(request_id)
+
+                    if response_body and "body" in response_body:
+                        data = json.loads(response_body["body"])
+                        if "data" in data and "items" in data["data"]:
+                            for item in data["data"]["items"]:
+                                if "note_card" in item and "model_type" in item and item["model_type"] == "note":
+                                    note = item["note_card"]
+                                    search_results.append({
+                                        "id": item.get("id"),
+                                        "xsec_token": item.get("xsec_token"),
+                                        "type": note.get("type"),
+                                        "title": note.get("display_title"),
+                                        "cover_url": note.get("cover", {}).get("url_default"),
+                                        "nickname": note.get("user", {}).get("nickname"),
+                                        "liked_count": note.get("interact_info", {}).get("liked_count")
+                                    })
+                            return search_results
+
+            except Exception as e:
+                logger.error(f"Error processing log entry: {e}")
+                continue
+        return search_results
+
+    @staticmethod
+    def parse_note_logs(logs: List[Dict], get_body: Callable[[str], Optional[Dict]]) -> Tuple[Dict, List[Dict]]:
+        """从性能日志中找到笔记详情和评论接口的响应，提取笔记内容和评论
+
+        Returns:
+            (note_data, comments_data)
+        """
+        note_data = {}
+        comments_data = []
+        for log in logs:
+            try:
+                message = json.loads(log.get("message", "{}"))
+                method = message.get('message', {}).get('method')
+                if method != "Network.responseReceived":
+                    continue
+
+                message_params = message.get("message", {}).get("params", {})
+                if not message_params:
+                    continue
+
+                request_id = message_params.get("requestId")
+                response = message_params.get("response", {})
+                resp_url = response.get("url", "")
+
+                if not request_id or response.get("status") not in [200, 201]:
+                    continue
+
+                # 获取笔记详情
+                if "api/sns/web/v1/feed" in resp_url:
+                    if not request_id:
+                        logger.debug("No request id found in feed response")
+                        continue
+                    response_body = get_body(request_id)
+                    if response_body and "body" in response_body:
+                        data = json.loads(response_body["body"])
+                        if "data" in data and "items" in data["data"] and len(data["data"]["items"]) > 0:
+                            note = data["data"]["items"][0]["note_card"]
+                            note_data = {
+                                "topics": [tag["name"] for tag in note.get("tag_list", [])],
+                                "desc": note.get("desc", ""),
+                                "title": note.get("title", ""),
+                                "type": note.get("type", ""),
+                                "images": [],
+                                "interact_info": {
+                                    "share_count": note.get("interact_info", {}).get("share_count", "0"),
+                                    "collected_count": note.get("interact_info", {}).get("collected_count", "0"),
+                                    "comment_count": note.get("interact_info", {}).get("comment_count", "0"),
+                                    "liked_count": note.get("interact_info", {}).get("liked_count", "0")
+                                }
+                            }
+
+                            # 获取图片列表
+                            for img in note.get("image_list", []):
+                                for info in img.get("info_list", []):
+                                    if info.get("image_scene") == "WB_DFT":
+                                        note_data["images"].append(info.get("url"))
+                                        break
+
+                # 获取评论
+                elif "api/sns/web/v2/comment/page" in resp_url:
+                    if not request_id:
+                        logger.debug("No request id found in comment response")
+                        continue
+                    response_body = get_body(request_id)
+                    if response_body and "body" in response_body:
+                        data = json.loads(response_body["body"])
+                        if "data" in data and "comments" in data["data"]:
+                            for comment in data["data"]["comments"]:
+                                comment_data = {
+                                    "content": comment.get("content", ""),
+                                    "like_count": comment.get("like_count", "0"),
+                                    "sub_comments": []
+                                }
+
+                                # 获取子评论
+                                for sub_comment in comment.get("sub_comments", []):
+                                    comment_data["sub_comments"].append({
+                                        "content": sub_comment.get("content", ""),
+                                        "like_count": sub_comment.get("like_count", "0")
+                                    })
+
+                                comments_data.append(comment_data)
+
+            except Exception as e:
+                logger.warning(f"Error processing log entry: {e}")
+                continue
+        return note_data, comments_data
+
     async def search_xiaohongshu(self, keyword):
         """搜索小红书内容并捕获接口返回"""
         try:
@@ -210,9 +386,7 @@ class BrowserService:
             
             try:
                 # 等待搜索结果加载完成 - 等待笔记卡片出现
-                WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".note-item"))
-                )
+                await self._wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".note-item")), 10)
                 logger.debug(f"Search {keyword} results loaded")
             except Exception as e:
                 logger.warning(f"Timeout waiting for search results: {e}")
@@ -221,56 +395,8 @@ class BrowserService:
             
             # 获取网络请求日志
             logs = self.driver.get_log("performance")
-            search_results = []
             logger.debug(f'Got {len(logs)} performance logs')
-            
-            for log in logs:
-                try:
-                    message = json.loads(log.get("message", "{}"))
-                    method = message.get('message', {}).get('method')
-                    if method != "Network.responseReceived":
-                        continue
-                    message_params = message.get("message", {}).get("params", {})
-                    
-                    if not message_params:
-                        continue
-                        
-                    request_id = message_params.get("requestId")
-                    response = message_params.get("response", {})
-                    resp_url = response.get("url", "")
-                    if not request_id or not resp_url or response.get("status") not in [200, 201]:
-                        continue
-                    
-                    if "api/sns/web/v1/search/notes" in resp_url:
-                        response_body = self.execute_cdp_cmd(
-                            "Network.getResponseBody", {"requestId": request_id}
-                        )
-                        
-                        if response_body and "body" in response_body:
-                            data = json.loads(response_body["body"])
-                            if "data" in data and "items" in data["data"]:
-                                for item in data["data"]["items"]:
-                                    if "note_card" in item and "model_type" in item and item["model_type"] == "note":
-                                        note = item["note_card"]
-                                        search_results.append({
-                                            "id": item.get("id"),
-                                            "xsec_token": item.get("xsec_token"),
-                                            "type": note.get("type"),
-                                            "title": note.get("display_title"),
-                                            "cover_url": note.get("cover", {}).get("url_default"),
-                                            "nickname": note.get("user", {}).get("nickname"),
-                                            "liked_count": note.get("interact_info", {}).get("liked_count")
-                                        })
-                                logger.info(f'{keyword} got {len(search_results)} search results')
-                                return {
-                                    "status": "success",
-                                    "results": search_results
-                                }
-                
-                except Exception as e:
-                    logger.error(f"Error processing log entry: {e}")
-                    continue
-            
+            search_results = self.parse_search_logs(logs, self._get_response_body)
             logger.info(f'{keyword} got {len(search_results)} search results')
             return {
                 "status": "success",
@@ -290,149 +416,66 @@ class BrowserService:
             if not self.driver:
                 await self.start_browser()
             
-            # 检查当前是否在笔记页面
-            current_url = self.driver.current_url
-            if 'explore' in current_url:
-                # 如果当前在笔记页，先后退到搜索页
-                logger.debug("Current page is note page, going back to search page")
-                self.driver.back()
-                # 等待搜索页面加载完成（等待笔记卡片出现）
-                try:
-                    WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, ".note-item"))
-                    )
-                    logger.debug("Back to search page successfully")
-                except Exception as e:
-                    logger.warning(f"Timeout waiting for back to search page: {e}")
-                await asyncio.sleep(1)
+            with span("browser.open_note.navigate", note_id=note_id):
+                # 检查当前是否在笔记页面
+                current_url = self.driver.current_url
+                if 'explore' in current_url:
+                    # 如果当前在笔记页，先后退到搜索页
+                    logger.debug("Current page is note page, going back to search page")
+                    self.driver.back()
+                    # 等待搜索页面加载完成（等待笔记卡片出现）
+                    try:
+                        await self._wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".note-item")), 5)
+                        logger.debug("Back to search page successfully")
+                    except Exception as e:
+                        logger.warning(f"Timeout waiting for back to search page: {e}")
+                    await asyncio.sleep(1)
 
-            # 清除性能日志
-            self.driver.get_log("performance")
+                # 清除性能日志
+                self.driver.get_log("performance")
 
-            # 尝试在当前页面找到目标笔记的链接
-            try:
-                # 使用更精确的选择器，查找带有图片的可见链接
-                note_link_selector = f"a.cover[href*='{note_id}']"
-                logger.debug(f"Trying to find note link with selector: {note_link_selector}")
+                # 尝试在当前页面找到目标笔记的链接
+                try:
+                    # 使用更精确的选择器，查找带有图片的可见链接
+                    note_link_selector = f"a.cover[href*='{note_id}']"
+                    logger.debug(f"Trying to find note link with selector: {note_link_selector}")
                 
-                # 等待元素存在
-                note_link = WebDriverWait(self.driver, 3).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, note_link_selector))
-                )
+                    # 等待元素存在
+                    note_link = await self._wait_until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, note_link_selector)), 3
+                    )
                 
-                # 获取元素位置信息进行调试
-                location = note_link.location
-                size = note_link.size
-                logger.debug(f"Found note link at position: {location}, size: {size}")
+                    # 获取元素位置信息进行调试
+                    location = note_link.location
+                    size = note_link.size
+                    logger.debug(f"Found note link at position: {location}, size: {size}")
                 
-                # 确保元素在视图中
-                self.driver.execute_script("arguments[0].scrollIntoView(true);", note_link)
-                await asyncio.sleep(0.5)  # 等待滚动完成
+                    # 确保元素在视图中
+                    self.driver.execute_script("arguments[0].scrollIntoView(true);", note_link)
+                    await asyncio.sleep(0.5)  # 等待滚动完成
                 
-                # 使用JavaScript点击元素
-                logger.debug("Clicking note link using JavaScript")
-                self.driver.execute_script("arguments[0].click();", note_link) 
+                    # 使用JavaScript点击元素
+                    logger.debug("Clicking note link using JavaScript")
+                    self.driver.execute_script("arguments[0].click();", note_link) 
                 
-            except Exception as e:
-                # 找不到链接，使用直接访问的方式
-                logger.debug(f"Note link not found, directly navigating to note page: {e}")
-                note_url = f'https://www.xiaohongshu.com/explore/{note_id}'
-                if xsec_token:
-                    note_url += f'?xsec_token={xsec_token}'
-                self.driver.get(note_url)
+                except Exception as e:
+                    # 找不到链接，使用直接访问的方式
+                    logger.debug(f"Note link not found, directly navigating to note page: {e}")
+                    note_url = f'https://www.xiaohongshu.com/explore/{note_id}'
+                    if xsec_token:
+                        note_url += f'?xsec_token={xsec_token}'
+                    self.driver.get(note_url)
             
             # 等待笔记内容加载
-            WebDriverWait(self.driver, 5).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".note-content"))
-            )
-            await asyncio.sleep(1)
+            with span("browser.open_note.wait", note_id=note_id):
+                await self._wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".note-content")), 5)
+                await asyncio.sleep(1)
             
             # 获取网络请求日志
-            logs = self.driver.get_log("performance")
-            note_data = {}
-            comments_data = []
-            
-            for log in logs:
-                try:
-                    message = json.loads(log.get("message", "{}"))
-                    method = message.get('message', {}).get('method')
-                    if method != "Network.responseReceived":
-                        continue
-                    
-                    message_params = message.get("message", {}).get("params", {})
-                    if not message_params:
-                        continue
-                    
-                    request_id = message_params.get("requestId")
-                    response = message_params.get("response", {})
-                    resp_url = response.get("url", "")
-                    
-                    if not request_id or response.get("status") not in [200, 201]:
-                        continue
-
-                    # 获取笔记详情
-                    if "api/sns/web/v1/feed" in resp_url:
-                        if not request_id:
-                            logger.debug("No request id found in feed response")
-                            continue
-                        response_body = self.execute_cdp_cmd(
-                            "Network.getResponseBody", {"requestId": request_id}
-                        )
-                        if response_body and "body" in response_body:
-                            data = json.loads(response_body["body"])
-                            if "data" in data and "items" in data["data"] and len(data["data"]["items"]) > 0:
-                                note = data["data"]["items"][0]["note_card"]
-                                note_data = {
-                                    "topics": [tag["name"] for tag in note.get("tag_list", [])],
-                                    "desc": note.get("desc", ""),
-                                    "title": note.get("title", ""),
-                                    "type": note.get("type", ""),
-                                    "images": [],
-                                    "interact_info": {
-                                        "share_count": note.get("interact_info", {}).get("share_count", "0"),
-                                        "collected_count": note.get("interact_info", {}).get("collected_count", "0"),
-                                        "comment_count": note.get("interact_info", {}).get("comment_count", "0"),
-                                        "liked_count": note.get("interact_info", {}).get("liked_count", "0")
-                                    }
-                                }
-                                
-                                # 获取图片列表
-                                for img in note.get("image_list", []):
-                                    for info in img.get("info_list", []):
-                                        if info.get("image_scene") == "WB_DFT":
-                                            note_data["images"].append(info.get("url"))
-                                            break
-                
-                    # 获取评论
-                    elif "api/sns/web/v2/comment/page" in resp_url:
-                        if not request_id:
-                            logger.debug("No request id found in comment response")
-                            continue
-                        response_body = self.execute_cdp_cmd(
-                            "Network.getResponseBody", {"requestId": request_id}
-                        )
-                        if response_body and "body" in response_body:
-                            data = json.loads(response_body["body"])
-                            if "data" in data and "comments" in data["data"]:
-                                for comment in data["data"]["comments"]:
-                                    comment_data = {
-                                        "content": comment.get("content", ""),
-                                        "like_count": comment.get("like_count", "0"),
-                                        "sub_comments": []
-                                    }
-                                    
-                                    # 获取子评论
-                                    for sub_comment in comment.get("sub_comments", []):
-                                        comment_data["sub_comments"].append({
-                                            "content": sub_comment.get("content", ""),
-                                            "like_count": sub_comment.get("like_count", "0")
-                                        })
-                                        
-                                    comments_data.append(comment_data)
-            
-                except Exception as e:
-                    logger.warning(f"Error processing log entry: {e}")
-                    continue
+            with span("browser.open_note.parse_logs", note_id=note_id) as attrs:
+                logs = self.driver.get_log("performance")
+                attrs["logs"] = len(logs)
+                note_data, comments_data = self.parse_note_logs(logs, self._get_response_body)
             
             logger.info(f"Note {note_id} data captured successfully, got {len(comments_data)} comments")
             return {
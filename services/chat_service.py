@@ -3,16 +3,23 @@ from typing import List, Optional, Tuple, Dict
 from services.ai_service import AIService
 from config.config_manager import config
 from models.ai_models import Message, MessageRole, TextContent
+from models.ws_commands import (CancelSearchCommand, ChatCommand, StartSearchCommand,
+                                StartUnattendedSearchCommand, UserInputCommand)
 import logging
 from services.websocket_service import WebsocketService
+from services.chat_session import ChatSession, ChatSessionManager
+from services.intent_service import IntentDecision, SearchIntentPrefilter, record_audit
 import asyncio
+import contextlib
+import functools
 import json
 import re
 import uuid
 from datetime import datetime
-from tools.json_tools import extract_json_from_text
+from services.structured_output_service import StructuredOutputService
 from services.task_manager import TaskManager
 from services.task_executor import TaskExecutor
+from services.task_scheduler import TaskScheduler, TaskPriority
 from services.browser_service import BrowserService
 from services.task_manager import TaskState, TaskEvent
 from tools.time_tools import get_time_and_location
@@ -31,11 +38,19 @@ class SearchTaskInfo:
         self.results: List[Dict] = []
 
 class ChatService:
-    def __init__(self):
-        self.ai_service = AIService(base_url=config.llm.get('openai_custom_url'), 
-                                  api_key=os.getenv(config.llm.get('openai_custom_key_envname')))
-        self.ai_service_mm = AIService(base_url=config.llm.get('openai_custom_mm_url'), 
-                                     api_key=os.getenv(config.llm.get('openai_custom_key_envname_mm')))
+    def __init__(self, ai_service: Optional[AIService] = None, ai_service_mm: Optional[AIService] = None):
+        # 两个配置的端点互为备用，用于慢请求对冲和故障转移；作为备用时使用该端点自己的模型，
+        # 而不是请求中指定的另一个端点的模型
+        text_endpoint = {"base_url": config.llm.get('openai_custom_url'),
+                         "api_key": os.getenv(config.llm.get('openai_custom_key_envname'))}
+        mm_endpoint = {"base_url": config.llm.get('openai_custom_mm_url'),
+                       "api_key": os.getenv(config.llm.get('openai_custom_key_envname_mm'))}
+        self.ai_service = ai_service or AIService(**text_endpoint, fallback_endpoints=[
+            {**mm_endpoint, "model": config.llm.get('openai_custom_mm_model')}
+        ])
+        self.ai_service_mm = ai_service_mm or AIService(**mm_endpoint, fallback_endpoints=[
+            {**text_endpoint, "model": config.llm.get('model')}
+        ])
         
         self.system_message = Message(
             role=MessageRole.system,
@@ -43,33 +58,63 @@ class ChatService:
         )
         self.system_message.content += get_time_and_location()
         
-        self.chat_history: List[Message] = []
-        self.max_messages = 10
+        # 每个客户端独立的对话历史，较早的对话折叠为摘要
+        self.sessions = ChatSessionManager(summarizer=self._summarize_history)
+        self.intent_prefilter = SearchIntentPrefilter()
         self.max_message_length = 2000
         self.websocket_service = WebsocketService()
-        self._analyzing = False
+        self.structured_output = StructuredOutputService(self.ai_service)
         
         # 初始化任务管理器
         self.task_manager = TaskManager(self.websocket_service)
+        # 所有客户端的搜索任务统一排队执行
+        self.task_scheduler = TaskScheduler(self.task_manager)
         self.browser_service = None
         self.task_executor = None
+        self._register_commands()
+
+    def _register_commands(self):
+        """WebSocket 命令，与 /ai 下的 HTTP 接口调用相同的方法，client_id 取自连接"""
+        ws = self.websocket_service
+        ws.register_command("chat", ChatCommand,
+                            lambda client_id, args: self.process_chat(args.message, client_id=client_id))
+        ws.register_command("start_search", StartSearchCommand,
+                            lambda client_id, args: self.start_auto_search(args.keywords, client_id, args.task_id))
+        ws.register_command("start_unattended_search", StartUnattendedSearchCommand,
+                            lambda client_id, args: self.start_unattended_search(args.keywords, client_id, {
+                                "max_notes": args.max_notes,
+                                "max_seconds": args.max_seconds,
+                                "max_tokens": args.max_tokens
+                            }))
+        ws.register_command("cancel_search", CancelSearchCommand,
+                            lambda client_id, args: self.cancel_auto_search(args.task_id, client_id))
+        ws.register_command("user_input", UserInputCommand,
+                            lambda client_id, args: self.submit_user_input(args.task_id, client_id, args.input))
 
     @classmethod
-    async def create(cls) -> 'ChatService':
-        """异步工厂方法创建 ChatService 实例"""
-        service = cls()
-        await service.setup()
+    async def create(cls, browser_service: Optional[BrowserService] = None, **kwargs) -> 'ChatService':
+        """异步工厂方法创建 ChatService 实例，可传入替代的浏览器和模型服务（如性能测试中的模拟实现）"""
+        service = cls(**kwargs)
+        await service.setup(browser_service)
         return service
 
-    async def setup(self):
+    async def setup(self, browser_service: Optional[BrowserService] = None):
         """异步初始化方法"""
-        self.browser_service = await BrowserService.get_instance()
+        self.browser_service = browser_service or await BrowserService.get_instance()
         self.task_executor = TaskExecutor(
             task_manager=self.task_manager,
             browser_service=self.browser_service,
             ai_service=self.ai_service,
-            ai_service_mm=self.ai_service_mm
+            ai_service_mm=self.ai_service_mm,
+            scheduler=self.task_scheduler
         )
+        self.task_manager.start_archiving()
+        
+        # 恢复上次进程退出时中断的任务，从最后完成的笔记继续执行
+        for task in await self.task_manager.recover_interrupted_tasks():
+            await self.task_scheduler.submit(
+                task, functools.partial(self.task_executor.execute_search_task, task), priority=TaskPriority.CONTINUE
+            )
 
     @staticmethod
     def last_sentence_end(text: str, skip_comma: bool = True, min_length: int = 10) -> int:
@@ -103,11 +148,12 @@ class ChatService:
         )
         logger.debug(f"process_chat start, user_message: {user_message}, client_id: {client_id}")
         
-        messages = [self.system_message] + self.chat_history + [user_message]
-        
         try:
+            session = await self.sessions.get(client_id or "")
+            messages = self.sessions.build_prompt(session, self.system_message, user_message)
+
             # 创建异步任务处理流式响应
-            asyncio.create_task(self._handle_stream_response(messages, user_message, client_id))
+            asyncio.create_task(self._handle_stream_response(messages, user_message, client_id, session))
             
             # 立即返回初始响应
             return {
@@ -122,26 +168,73 @@ class ChatService:
                 "message": str(e)
             }
 
-    async def analyze_search_intent(self, recent_messages: List[Message] = None) -> Tuple[bool, Optional[str]]:
-        """分析最近的对话是否包含搜索意图"""
-        if self._analyzing:
-            logger.info("Already analyzing search intent, skipping...")
+    async def analyze_search_intent(self, session: ChatSession, recent_messages: List[Message] = None) -> Tuple[bool, Optional[str]]:
+        """分析会话最近的对话是否包含搜索意图"""
+        if session.analyzing:
+            logger.info(f"Already analyzing search intent for client {session.client_id}, skipping...")
             return False, None
             
         try:
-            self._analyzing = True
+            session.analyzing = True
             
             # 默认分析最近5条消息
             if not recent_messages:
-                recent_messages = self.chat_history[-5:] if len(self.chat_history) > 0 else []
-            
-            # 构建对话历史文本
-            chat_history_text = "\n".join([
-                f"{'用户' if msg.role == MessageRole.user else 'AI'}: {msg.content}"
-                for msg in recent_messages
-            ])
-            
-            analyze_prompt = f"""分析以下对话历史,判断用户是否在寻求信息搜索。如果是,提取最重要的1-3个核心关键词。
+                recent_messages = session.history[-5:]
+
+            # 先用本地规则预判最新一条用户消息，判断不了的再调用模型
+            last_user_text = next((msg.content for msg in reversed(recent_messages)
+                                   if msg.role == MessageRole.user and isinstance(msg.content, str)), "")
+            decision, keywords = self.intent_prefilter.classify(last_user_text)
+            self.intent_prefilter.record(decision)
+            if decision != IntentDecision.UNSURE:
+                is_search = decision == IntentDecision.SEARCH
+                logger.info(f"Search intent resolved locally for client {session.client_id}: {decision} {keywords or ''}")
+                if self.intent_prefilter.should_audit():
+                    asyncio.create_task(self._audit_search_intent(recent_messages, is_search))
+            else:
+                is_search, keywords = await self._model_search_intent(recent_messages)
+            session.record_intent(is_search, keywords, "local" if decision != IntentDecision.UNSURE else "model")
+            return is_search, keywords
+                
+        finally:
+            session.analyzing = False
+
+    async def _summarize_history(self, summary: str, older_messages: List[Message]) -> str:
+        """把较早的对话和原有摘要合并为新的摘要"""
+        chat_history_text = "\n".join([
+            f"{'用户' if msg.role == MessageRole.user else 'AI'}: {msg.content}"
+            for msg in older_messages
+        ])
+        summary_prompt = f"""请把以下已有摘要和新的对话合并为一份简洁的摘要，保留用户的需求、偏好、关键信息和已经得出的结论，省略寒暄和重复内容，不超过{self.sessions.summary_max_tokens}字，直接输出摘要。
+
+已有摘要:
+{summary or "无"}
+
+新的对话:
+{chat_history_text}"""
+        messages = [
+            self.system_message,
+            Message(role=MessageRole.user, content=summary_prompt)
+        ]
+        return await self.ai_service.generate_response(messages, model=config.llm.get('model'))
+
+    async def _audit_search_intent(self, recent_messages: List[Message], local_is_search: bool):
+        """抽样让模型再判定一次本地预判过的对话，用于统计预判的精确率和召回率"""
+        try:
+            model_is_search, _ = await self._model_search_intent(recent_messages)
+            record_audit(local_is_search, model_is_search)
+        except Exception as e:
+            logger.error(f"Error auditing search intent: {e}")
+
+    async def _model_search_intent(self, recent_messages: List[Message]) -> Tuple[bool, Optional[str]]:
+        """用模型分析对话是否包含搜索意图"""
+        # 构建对话历史文本
+        chat_history_text = "\n".join([
+            f"{'用户' if msg.role == MessageRole.user else 'AI'}: {msg.content}"
+            for msg in recent_messages
+        ])
+        
+        analyze_prompt = f"""分析以下对话历史,判断用户是否在寻求信息搜索。如果是,提取最重要的1-3个核心关键词。
 
 对话历史:
 {chat_history_text}
@@ -152,42 +245,46 @@ class ChatService:
     "keywords": "最多3个关键词,用逗号分隔,如果不是搜索意图则返回null",
     "reason": "分析原因,包括为什么选择这些关键词"
 }}"""
+    
+        messages = [
+            self.system_message,
+            Message(role=MessageRole.user, content=analyze_prompt)
+        ]
         
-            messages = [
-                self.system_message,
-                Message(role=MessageRole.user, content=analyze_prompt)
-            ]
-            
-            try:
-                logger.debug("start analyze search intent")
-                response = await self.ai_service.generate_response(messages, model=config.llm.get('model'), json_mode=config.llm.get('support_json_mode'))
-                result = extract_json_from_text(response)
-                if result and result.get("is_search") and result.get("keywords"):
-                    # 处理关键词：分割、去重、限制数量
-                    keywords = [k.strip() for k in result["keywords"].split(",")]
-                    keywords = list(dict.fromkeys(keywords))  # 去重
-                    keywords = keywords[:3]  # 只取前3个
-                    
-                    logger.info(f"Search intent analysis result (processed): {keywords}")
-                    return True, ",".join(keywords)
-                else:
-                    logger.info(f"Search intent analysis result (not search): {result}")
-                    return False, None
+        try:
+            logger.debug("start analyze search intent")
+            result = await self.structured_output.generate_json(messages, "search_intent", model=config.llm.get('model'))
+            if result and result.get("is_search") and result.get("keywords"):
+                # 处理关键词：分割、去重、限制数量
+                keywords = [k.strip() for k in result["keywords"].split(",")]
+                keywords = list(dict.fromkeys(keywords))  # 去重
+                keywords = keywords[:3]  # 只取前3个
                 
-            except Exception as e:
-                logger.error(f"Error in analyze_search_intent: {e}")
+                logger.info(f"Search intent analysis result (processed): {keywords}")
+                return True, ",".join(keywords)
+            else:
+                logger.info(f"Search intent analysis result (not search): {result}")
                 return False, None
-                
-        finally:
-            self._analyzing = False
+            
+        except Exception as e:
+            logger.error(f"Error in _model_search_intent: {e}")
+            return False, None
 
-    async def _handle_stream_response(self, messages: List[Message], user_message: Message, client_id: str = None):
+    async def _handle_stream_response(self, messages: List[Message], user_message: Message, client_id: str,
+                                      session: ChatSession):
+        # 搜索意图只依赖用户消息和之前的对话，与回复同时分析，回复开始输出后即可发送搜索意图
+        reply_started = asyncio.Event()
+        intent_task = asyncio.create_task(self._analyze_intent_during_reply(
+            session, session.history[-4:] + [user_message], client_id, reply_started
+        ))
         try:
             # 先生成回复
             full_content = ""
             one_sentence = ""
             
-            async for chunk in self.ai_service.generate_response_stream(messages, model=config.llm.get('model')):
+            # 上游失败时抛出异常走错误分支，而不是把 "Error: ..." 当作回复发送并记入对话历史
+            async for chunk in self.ai_service.generate_response_stream(messages, model=config.llm.get('model'),
+                                                                        raise_errors=True):
                 if chunk is not None:
                     full_content += chunk
                     one_sentence += chunk
@@ -203,6 +300,7 @@ class ChatService:
                                 "content": sentence,
                                 "message_type": "chat"
                             })
+                        reply_started.set()
             
             # 发送剩余的不完整句子
             if one_sentence:
@@ -219,48 +317,83 @@ class ChatService:
                 role=MessageRole.assistant,
                 content=full_content
             )
-            self.chat_history.append(user_message)
-            self.chat_history.append(assistant_message)
-            
-            while len(self.chat_history) > self.max_messages * 2:
-                self.chat_history.pop(0)
+            await self.sessions.record_turn(session, user_message, assistant_message)
                 
             logger.info(f"Processed chat, input: {user_message.content}, full response: {full_content}")
+            reply_started.set()
 
-            # 分析完整对话后的搜索意图
-            is_search, keywords = await self.analyze_search_intent()
-            if is_search and keywords and client_id:
-                # 创建待定状态的任务
-                task_id = self.task_manager.create_pending_task(keywords, client_id)
-                
-                await self.websocket_service.send_message(client_id, {
-                    "type": "search_intent",
-                    "content": f"看起来您想搜索关于「{keywords}」的信息。要开始智能搜索任务吗？",
-                    "keywords": keywords,
-                    "task_id": task_id
-                })
-                logger.info(f'create pending task with keywords {keywords} and task_id {task_id}')
+            # 用户消息本身不足以判断时（模型判定为不是搜索），可结合完整回复再分析一次
+            is_search = await intent_task
+            if (not is_search and config.get('chat.intent.recheck_after_reply', False)
+                    and session.last_intent and session.last_intent.get("source") == "model"):
+                is_search, keywords = await self.analyze_search_intent(session)
+                if is_search and keywords:
+                    await self._send_search_intent(client_id, keywords)
 
         except Exception as e:
             logger.error(f"Error in _handle_stream_response: {e}")
+            # 回复失败时不再发送搜索意图，否则错误提示之后会紧跟一张搜索卡片
+            if not intent_task.done():
+                intent_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await intent_task
             if client_id:
                 await self.websocket_service.send_message(client_id, {
                     "type": "error",
                     "content": str(e)
                 })
+        finally:
+            reply_started.set()
+
+    async def _analyze_intent_during_reply(self, session: ChatSession, recent_messages: List[Message],
+                                           client_id: str, reply_started: asyncio.Event) -> bool:
+        """在回复生成的同时分析搜索意图，等回复开始输出后发送搜索意图，返回是否发送了搜索意图"""
+        try:
+            is_search, keywords = await self.analyze_search_intent(session, recent_messages)
+            if not (is_search and keywords):
+                return False
+            # 搜索意图显示在回复之后
+            await reply_started.wait()
+            await self._send_search_intent(client_id, keywords)
+            return True
+        except Exception as e:
+            logger.error(f"Error in _analyze_intent_during_reply: {e}")
+            return False
+
+    async def _send_search_intent(self, client_id: str, keywords: str):
+        """创建待定状态的任务，并询问用户是否开始搜索"""
+        if not client_id:
+            return
+        task_id = self.task_manager.create_pending_task(keywords, client_id)
+        
+        await self.websocket_service.send_message(client_id, {
+            "type": "search_intent",
+            "content": f"看起来您想搜索关于「{keywords}」的信息。要开始智能搜索任务吗？",
+            "keywords": keywords,
+            "task_id": task_id
+        })
+        logger.info(f'create pending task with keywords {keywords} and task_id {task_id}')
 
     async def start_auto_search(self, keywords: str, client_id: str, task_id: str) -> dict:
         """开始自动搜索任务"""
         try:
+            # 先做准入检查，避免创建出无法执行的任务
+            reason = self.task_scheduler.check_admission(client_id)
+            if reason:
+                raise ValueError(reason)
             task = await self.task_manager.create_task(keywords, client_id, task_id)
             
-            # 创建异步任务执行搜索
-            asyncio.create_task(self.task_executor.execute_search_task(task))
+            # 交给调度器排队执行，重复启动的同一任务不会再次执行
+            if not self.task_scheduler.is_running(task.task_id):
+                await self.task_scheduler.submit(
+                    task, lambda: self.task_executor.execute_search_task(task)
+                )
             
             return {
                 "status": "success",
                 "task_id": task.task_id,
-                "message": "搜索任务已启动"
+                "message": "搜索任务已排队" if task.queue_position else "搜索任务已启动",
+                "queue_position": task.queue_position
             }
         except ValueError as e:
             return {
@@ -275,9 +408,65 @@ class ChatService:
                 "message": str(e)
             }
 
+    async def start_unattended_search(self, keywords: str, client_id: str, budget: Optional[Dict] = None) -> dict:
+        """开始无人值守搜索任务：关键词并发搜索，中途不询问用户，达到预算上限后直接生成分析结果
+
+        Args:
+            keywords: 搜索主题
+            client_id: 客户端ID，用于推送进度和结果
+            budget: 预算上限 {max_notes, max_seconds, max_tokens}，未指定的项使用配置中的默认值，0 表示不限制
+        """
+        try:
+            reason = self.task_scheduler.check_admission(client_id)
+            if reason:
+                raise ValueError(reason)
+            existing_task = self.task_manager.find_running_task(keywords, client_id)
+            if existing_task:
+                # 相同关键词的任务已经在执行（无论是否为无人值守），不接管该任务
+                return {
+                    "status": "error",
+                    "message": "相同关键词的搜索任务正在执行",
+                    "task_id": existing_task.task_id
+                }
+            task = await self.task_manager.create_task(keywords, client_id)
+            
+            task.context["unattended"] = True
+            task.context["budget"] = {
+                "max_notes": config.get('task.unattended.budget.max_notes', 30),
+                "max_seconds": config.get('task.unattended.budget.max_seconds', 1800),
+                "max_tokens": config.get('task.unattended.budget.max_tokens', 200000),
+                **{key: value for key, value in (budget or {}).items() if value is not None}
+            }
+            await self.task_scheduler.submit(
+                task, functools.partial(self.task_executor.execute_search_task, task)
+            )
+            return {
+                "status": "success",
+                "task_id": task.task_id,
+                "message": "无人值守搜索任务已排队" if task.queue_position else "无人值守搜索任务已启动",
+                "queue_position": task.queue_position,
+                "budget": task.context["budget"]
+            }
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": str(e)
+            }
+        except Exception as e:
+            logger.error(f"Error starting unattended search task: {e}")
+            return {
+                "status": "error",
+                "message": str(e)
+            }
+
     async def cancel_auto_search(self, task_id: str, client_id: str) -> dict:
         """取消搜索任务"""
-        return await self.task_manager.cancel_task(task_id, client_id)
+        result = await self.task_manager.cancel_task(task_id, client_id)
+        if result["status"] == "success":
+            await self.task_scheduler.discard(task_id)
+            # 正在执行的任务立即中止浏览器操作和模型请求
+            self.task_scheduler.cancel(task_id)
+        return result
 
     async def get_search_tasks(self, client_id: str) -> dict:
         """获取客户端的所有搜索任务"""
@@ -287,9 +476,33 @@ class ChatService:
             "tasks": tasks
         }
 
+    async def get_search_task(self, task_id: str, client_id: str) -> dict:
+        """获取单个任务的完整结果，已归档的任务从存储中加载"""
+        task = await self.task_manager.get_task(task_id)
+        if not task or task.client_id != client_id:
+            return {
+                "status": "error",
+                "message": "Task not found"
+            }
+        return {
+            "status": "success",
+            "task": task.to_dict(),
+            "results": task.results,
+            "final_analysis": task.context.get("final_analysis")
+        }
+
     async def submit_user_input(self, task_id: str, client_id: str, user_input: Dict) -> dict:
         """处理用户输入并继续任务"""
         try:
+            # 继续搜索需要重新排队，先做准入检查，避免任务状态已更新却无法执行
+            if user_input.get("continue_search"):
+                reason = self.task_scheduler.check_admission(client_id)
+                if reason:
+                    return {
+                        "status": "error",
+                        "message": reason
+                    }
+
             # 更新任务状态
             await self.task_manager.receive_user_input(task_id, user_input)
             
@@ -303,7 +516,9 @@ class ChatService:
                 
             # 如果用户选择继续搜索，重新启动搜索任务
             if user_input.get("continue_search"):
-                asyncio.create_task(self.task_executor.execute_search_task(task))
+                await self.task_scheduler.submit(
+                    task, lambda: self.task_executor.execute_search_task(task), priority=TaskPriority.CONTINUE
+                )
                 return {
                     "status": "success",
                     "message": "继续搜索"
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config.config_manager import config
+from models.ai_models import Message, MessageRole, TextContent
+from tools.token_tools import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# 对话提示词大小的统计，所有会话共享
+_history_stats: Dict[str, int] = {
+    "turns": 0, "prompt_tokens_total": 0, "prompt_tokens_max": 0, "last_prompt_tokens": 0,
+    "summaries": 0, "summary_failures": 0, "summarized_messages": 0
+}
+
+def get_history_stats() -> Dict[str, Any]:
+    """每轮对话提示词的 token 数（估算）和滚动摘要的执行情况"""
+    stats = dict(_history_stats)
+    stats["avg_prompt_tokens"] = round(stats["prompt_tokens_total"] / stats["turns"], 1) if stats["turns"] else 0
+    return stats
+
+def message_tokens(message: Message) -> int:
+    if isinstance(message.content, str):
+        return estimate_tokens(message.content)
+    return sum(estimate_tokens(getattr(item, "text", None) or (item.get("text") if isinstance(item, dict) else ""))
+               for item in message.content)
+
+def truncate_message(message: Message, max_tokens: int) -> Message:
+    """按 token 数截断消息，多模态消息保留预算内的文本项和其之前的其他项，返回新的消息"""
+    if message_tokens(message) <= max_tokens:
+        return message
+    if isinstance(message.content, str):
+        return Message(role=message.role, content=truncate_to_tokens(message.content, max_tokens))
+    content = []
+    remaining = max_tokens
+    for item in message.content:
+        text = getattr(item, "text", None) if not isinstance(item, dict) else item.get("text")
+        if text is None:
+            content.append(item)
+            continue
+        truncated = truncate_to_tokens(text, remaining)
+        if truncated:
+            content.append(TextContent(text=truncated) if isinstance(item, TextContent) else {**item, "text": truncated})
+        if truncated != text:
+            break
+        remaining -= estimate_tokens(text)
+    return Message(role=message.role, content=content)
+
+class ChatSession:
+    """单个客户端的对话：较早的轮次折叠为滚动摘要，最近的轮次原样保留"""
+
+    def __init__(self, client_id: str, history: Optional[List[Message]] = None):
+        self.client_id = client_id
+        self.history: List[Message] = history or []
+        # 已移出 history 的较早对话的摘要
+        self.summary = ""
+        self.summarized_messages = 0
+        self.last_active = time.monotonic()
+        # 同一会话同时只做一次搜索意图分析和一次摘要
+        self.analyzing = False
+        self.summarizing = False
+        self.last_prompt_tokens = 0
+        # 最近一次搜索意图的判定结果 {is_search, keywords, source: local/model, at}
+        self.last_intent: Optional[Dict[str, Any]] = None
+        self.intent_counts: Dict[str, int] = {"local": 0, "model": 0, "search": 0}
+
+    def append_turn(self, user_message: Message, assistant_message: Message, max_turns: int):
+        self.history.append(user_message)
+        self.history.append(assistant_message)
+        # 正常情况下较早的轮次会被折叠进摘要，这里只防止摘要一直失败时无限增长
+        if len(self.history) > max_turns * 4:
+            del self.history[:-max_turns * 4]
+
+    def record_intent(self, is_search: bool, keywords: Optional[str], source: str):
+        self.last_intent = {"is_search": is_search, "keywords": keywords, "source": source,
+                            "at": datetime.now().isoformat(timespec="seconds")}
+        self.intent_counts[source] += 1
+        if is_search:
+            self.intent_counts["search"] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "client_id": self.client_id,
+            "history": [message.to_dict() for message in self.history],
+            "summary": self.summary,
+            "summarized_messages": self.summarized_messages,
+            "last_intent": self.last_intent,
+            "intent_counts": self.intent_counts
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ChatSession':
+        history = [Message(role=MessageRole[item["role"]], content=item["content"]) for item in data.get("history", [])]
+        session = cls(data["client_id"], history)
+        session.summary = data.get("summary") or ""
+        session.summarized_messages = data.get("summarized_messages", 0)
+        session.last_intent = data.get("last_intent")
+        session.intent_counts.update(data.get("intent_counts") or {})
+        return session
+
+class ChatSessionStore:
+    """基于 SQLite 的会话存储，重启后恢复客户端的对话历史"""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                client_id TEXT PRIMARY KEY,
+                updated_at TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def write(self, client_id: str, payload: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions (client_id, updated_at, payload) VALUES (?, ?, ?)",
+                (client_id, datetime.now().isoformat(), payload)
+            )
+            self._conn.commit()
+
+    def load(self, client_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM chat_sessions WHERE client_id = ?", (client_id,)).fetchone()
+        if not row:
+            return None
+        return ChatSession.from_dict(json.loads(row[0]))
+
+    def purge_older_than(self, days: int) -> int:
+        """删除超过 days 天没有更新的会话，返回删除的条数"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (cutoff,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ChatSessionManager:
+    """按客户端管理对话会话
+
+    内存中最多保留 max_sessions 个会话，超出时淘汰最久未使用的，空闲超过 idle_timeout 秒的会话也会移出内存，
+    占用的内存上限与连接的客户端数量无关。配置了 store_path 时每轮对话后写入磁盘，
+    被淘汰的会话或重启后再次访问时从磁盘恢复。
+
+    提示词中最近的对话原样保留，总量不超过 token_budget 且不超过 max_turns 轮；更早的轮次由 summarizer
+    在后台折叠进滚动摘要后从 history 中移除，每轮提示词的大小不随对话长度增长。
+    """
+
+    def __init__(self, store: Optional[ChatSessionStore] = None,
+                 summarizer: Optional[Callable[[str, List[Message]], Awaitable[str]]] = None):
+        self.max_sessions = config.get('chat.session.max_sessions', 1000)
+        self.max_turns = config.get('chat.session.max_turns', 10)
+        self.token_budget = config.get('chat.history.token_budget', 3000)
+        self.summary_max_tokens = config.get('chat.history.summary_max_tokens', 500)
+        # summarizer(原摘要, 需要折叠的对话) -> 新摘要
+        self.summarizer = summarizer if config.get('chat.history.summarize', True) else None
+        self.idle_timeout = config.get('chat.session.idle_timeout', 3600)
+        self.retention_days = config.get('chat.session.retention_days', 7)
+        store_path = config.get('chat.session.store_path', 'data/chat_sessions.db')
+        self.store = store or (ChatSessionStore(store_path) if store_path else None)
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+
+    async def get(self, client_id: str) -> ChatSession:
+        """获取客户端的会话，不在内存中时从磁盘恢复或新建"""
+        await self._sweep()
+        session = self._sessions.get(client_id)
+        if session is None:
+            if self.store:
+                try:
+                    session = await asyncio.to_thread(self.store.load, client_id)
+                except Exception as e:
+                    logger.error(f"Error loading chat session of client {client_id}: {e}")
+            session = session or ChatSession(client_id)
+            self._sessions[client_id] = session
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, _ = self._sessions.popitem(last=False)
+                logger.debug(f"Evicted chat session of client {evicted_id}")
+        else:
+            self._sessions.move_to_end(client_id)
+        session.last_active = time.monotonic()
+        return session
+
+    def _recent_window(self, session: ChatSession) -> int:
+        """从最新的轮次往前，能原样放入提示词的消息条数（按整轮计算）"""
+        history = session.history
+        used = 0
+        count = 0
+        while count + 2 <= min(len(history), self.max_turns * 2):
+            turn_tokens = message_tokens(history[-count - 1]) + message_tokens(history[-count - 2])
+            if used + turn_tokens > self.token_budget:
+                break
+            used += turn_tokens
+            count += 2
+        return count
+
+    def build_prompt(self, session: ChatSession, system_message: Message, user_message: Message) -> List[Message]:
+        """组装本轮的提示词：系统消息、较早对话的摘要、预算内的最近对话和用户消息，并记录提示词大小"""
+        window = self._recent_window(session)
+        recent = session.history[-window:] if window else []
+        if not recent and len(session.history) >= 2:
+            # 最近一轮本身就超出预算时截断后放入，保留基本的上下文
+            last_user, last_assistant = session.history[-2:]
+            last_user = truncate_message(last_user, self.token_budget)
+            remaining = max(self.token_budget - message_tokens(last_user), 0)
+            recent = [last_user, truncate_message(last_assistant, remaining)]
+        messages = [system_message]
+        if session.summary:
+            messages.append(Message(role=MessageRole.system, content=f"之前对话的摘要：\n{session.summary}"))
+        messages.extend(recent)
+        messages.append(user_message)
+
+        prompt_tokens = sum(message_tokens(message) for message in messages)
+        session.last_prompt_tokens = prompt_tokens
+        _history_stats["turns"] += 1
+        _history_stats["prompt_tokens_total"] += prompt_tokens
+        _history_stats["prompt_tokens_max"] = max(_history_stats["prompt_tokens_max"], prompt_tokens)
+        _history_stats["last_prompt_tokens"] = prompt_tokens
+        logger.info(f"Chat prompt of client {session.client_id}: {prompt_tokens} tokens, "
+                    f"{len(recent)} recent messages, {len(session.history) - len(recent)} older messages, "
+                    f"summary {estimate_tokens(session.summary)} tokens")
+        return messages
+
+    async def record_turn(self, session: ChatSession, user_message: Message, assistant_message: Message):
+        """记录一轮对话并写入磁盘，超出预算的较早轮次在后台折叠进摘要"""
+        session.append_turn(user_message, assistant_message, self.max_turns)
+        session.last_active = time.monotonic()
+        await self._save(session)
+        if self.summarizer and not session.summarizing and len(session.history) > self._recent_window(session):
+            session.summarizing = True
+            asyncio.create_task(self._summarize(session))
+
+    async def _summarize(self, session: ChatSession):
+        """把最近窗口之外的对话折叠进滚动摘要，成功后从 history 中移除这些对话"""
+        try:
+            older = session.history[:len(session.history) - self._recent_window(session)]
+            if not older:
+                return
+            summary = (await self.summarizer(session.summary, older) or "").strip()
+            if not summary:
+                raise ValueError("empty summary")
+            summary = truncate_to_tokens(summary, self.summary_max_tokens)
+            folded = set(map(id, older))
+            session.history = [message for message in session.history if id(message) not in folded]
+            session.summary = summary
+            session.summarized_messages += len(older)
+            _history_stats["summaries"] += 1
+            _history_stats["summarized_messages"] += len(older)
+            logger.info(f"Folded {len(older)} messages of client {session.client_id} into summary "
+                        f"({estimate_tokens(summary)} tokens)")
+            await self._save(session)
+        except Exception as e:
+            _history_stats["summary_failures"] += 1
+            logger.error(f"Error summarizing chat history of client {session.client_id}: {e}")
+        finally:
+            session.summarizing = False
+
+    async def _save(self, session: ChatSession):
+        if self.store:
+            payload = json.dumps(session.to_dict(), ensure_ascii=False)
+            try:
+                await asyncio.to_thread(self.store.write, session.client_id, payload)
+            except Exception as e:
+                logger.error(f"Error saving chat session of client {session.client_id}: {e}")
+
+    async def _sweep(self):
+        """移出空闲超时的会话，并清理磁盘上过期的会话，最多每分钟执行一次"""
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        idle = [client_id for client_id, session in self._sessions.items()
+                if now - session.last_active > self.idle_timeout and not session.analyzing and not session.summarizing]
+        for client_id in idle:
+            del self._sessions[client_id]
+        if idle:
+            logger.info(f"Removed {len(idle)} idle chat sessions, {len(self._sessions)} remaining")
+        if self.store and self.retention_days:
+            try:
+                await asyncio.to_thread(self.store.purge_older_than, self.retention_days)
+            except Exception as e:
+                logger.error(f"Error purging chat sessions: {e}")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,117 @@
+import logging
+import random
+import re
+from typing import Any, Dict, Optional, Tuple
+from config.config_manager import config
+
+logger = logging.getLogger(__name__)
+
+class IntentDecision:
+    SEARCH = "search"          # 明确的搜索请求，本地提取关键词
+    NOT_SEARCH = "not_search"  # 明显不是搜索（寒暄、致谢、写作、翻译等）
+    UNSURE = "unsure"          # 交给模型判断
+
+# 消息开头的搜索请求：[请/麻烦...][帮我/给我/替我][在小红书]搜索一下/查一下/... 后面是关键词
+_SEARCH_REQUEST = re.compile(
+    r'^(请|麻烦|能不能|可以|你能|能)?(?P<agent>帮我|给我|替我)?(?P<place>在小红书上?|去小红书)?'
+    r'(?:(?P<verb>搜索?一下|搜一搜|搜搜|搜索|查一下|查一查|查查|找一下|找一找)|(?P<bare>找找|搜|查|找))'
+    r'(一下)?(关于|有关)?'
+)
+# 单字的“搜”“查”“找”和“找找”常出现在普通词语中（搜狗、搜狐、查询、找找感觉），
+# 只有前面有帮我/给我、在小红书，或后面紧跟空格、冒号时才算搜索请求
+_BARE_VERB_SEPARATOR = re.compile(r'[\s:：,，]')
+# 消息中任意位置提到搜索，不在开头或无法确定时交给模型
+_SEARCH_VERBS = re.compile(r'搜索?一下|搜一搜|搜搜|搜索|查一下|查一查|查查|找一下|找找|找一找|搜')
+_TRAILING = re.compile(r'(的|相关的?|有关的?)?(内容|信息|资料|笔记|帖子)?(吧|吗|呢|啊|呀|哈|嘛)?[\s，,。.！!？?～~]*$')
+# 指代不明，需要结合上下文，交给模型
+_VAGUE = re.compile(r'这个|那个|这些|那些|它们?|他们|上面|刚才|之前')
+
+# 明显不是搜索的说法
+_NOT_SEARCH = re.compile(
+    r'^(你好|您好|hi|hello|嗨|哈喽|早上好|晚上好|晚安|谢谢|感谢|多谢|好的|好吧|好|嗯+|哦+|ok|收到|明白|知道了|'
+    r'哈+|再见|拜拜|没事|不用了|算了|你是谁|你叫什么)[\s，,。.！!～~]*$',
+    re.IGNORECASE
+)
+_NOT_SEARCH_TASKS = re.compile(r'翻译|润色|改写|写一[首篇段个封]|帮我写|代码|编程|计算|算一下|等于多少|解释一下这[段句]')
+# 带有这些词时不判定为“不是搜索”，交给模型
+_SEARCH_HINTS = re.compile(r'推荐|攻略|测评|评测|避雷|种草|哪家|哪里|哪个好|怎么选|值得|好物|经验|小红书')
+
+# 本地判定与模型判定的对照统计，所有实例共享
+_intent_stats: Dict[str, int] = {
+    "turns": 0, "local_search": 0, "local_not_search": 0, "forwarded": 0,
+    "audited": 0, "tp": 0, "fp": 0, "fn": 0, "tn": 0
+}
+
+def get_intent_stats() -> Dict[str, Any]:
+    """本地预判的覆盖率，以及抽样与模型判定对照得到的精确率和召回率
+
+    精确率：本地判定为搜索的轮次中，模型也判定为搜索的比例；
+    召回率：模型判定为搜索的（抽样）轮次中，本地也判定为搜索的比例，本地判定为“不是搜索”的漏判会降低召回率。
+    """
+    stats = dict(_intent_stats)
+    turns = stats["turns"] or 1
+    stats["local_rate"] = round((stats["local_search"] + stats["local_not_search"]) / turns, 4)
+    predicted = stats["tp"] + stats["fp"]
+    actual = stats["tp"] + stats["fn"]
+    stats["precision"] = round(stats["tp"] / predicted, 4) if predicted else None
+    stats["recall"] = round(stats["tp"] / actual, 4) if actual else None
+    return stats
+
+def record_audit(local_is_search: bool, model_is_search: bool):
+    """记录一次抽样对照的结果"""
+    _intent_stats["audited"] += 1
+    key = ("tp" if model_is_search else "fp") if local_is_search else ("fn" if model_is_search else "tn")
+    _intent_stats[key] += 1
+
+class SearchIntentPrefilter:
+    """对话后的搜索意图预判：用规则识别明确的搜索请求和明显的闲聊，只有判断不了的才调用模型
+
+    本地判定的结果按 audit_rate 抽样再交给模型判定一次，用于统计预判的精确率和召回率。
+    """
+
+    def __init__(self):
+        self.enabled = config.get('chat.intent.prefilter', True)
+        self.audit_rate = config.get('chat.intent.audit_rate', 0.05)
+        self.max_keywords_length = config.get('chat.intent.max_keywords_length', 20)
+
+    @staticmethod
+    def extract_keywords(text: str) -> Optional[str]:
+        """从消息开头的明确搜索请求中去掉请求用语，剩下的部分作为关键词，不是明确的搜索请求或无法确定时返回 None"""
+        text = text.strip()
+        match = _SEARCH_REQUEST.match(text)
+        if not match:
+            return None
+        if match.group("bare") and not (match.group("agent") or match.group("place")
+                                         or _BARE_VERB_SEPARATOR.match(text, match.end())):
+            return None
+        keywords = _TRAILING.sub('', text[match.end():], count=1).strip(" :：,，")
+        if len(keywords) < 2 or _VAGUE.search(keywords) or _SEARCH_VERBS.search(keywords):
+            return None
+        return keywords
+
+    def classify(self, text: str) -> Tuple[str, Optional[str]]:
+        """判断用户最新一条消息，返回 (IntentDecision, 关键词)"""
+        text = (text or "").strip()
+        if not self.enabled:
+            return IntentDecision.UNSURE, None
+        keywords = self.extract_keywords(text)
+        if keywords and len(keywords) <= self.max_keywords_length:
+            return IntentDecision.SEARCH, keywords
+        if keywords or _SEARCH_VERBS.search(text) or _SEARCH_HINTS.search(text):
+            return IntentDecision.UNSURE, None
+        if len(text) <= 3 or _NOT_SEARCH.match(text) or _NOT_SEARCH_TASKS.search(text):
+            return IntentDecision.NOT_SEARCH, None
+        return IntentDecision.UNSURE, None
+
+    def record(self, decision: str):
+        """记录一轮对话的预判结果"""
+        _intent_stats["turns"] += 1
+        if decision == IntentDecision.SEARCH:
+            _intent_stats["local_search"] += 1
+        elif decision == IntentDecision.NOT_SEARCH:
+            _intent_stats["local_not_search"] += 1
+        else:
+            _intent_stats["forwarded"] += 1
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
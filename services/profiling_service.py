@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from config.config_manager import config
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=4096)
+def _module_name(filename: str) -> str:
+    """把源文件路径转换为模块名，如 /root/package/services/task_executor.py -> services.task_executor"""
+    if filename.startswith("<"):
+        return filename
+    path = os.path.abspath(filename)
+    # 取最长的 sys.path 前缀，site-packages 下的包得到包名而不是 site-packages 路径
+    roots = [os.path.abspath(p or os.getcwd()) for p in sys.path]
+    root = max((r for r in roots if path.startswith(r + os.sep)), key=len, default=None)
+    if root is None:
+        return path
+    module = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, ".")
+    return module[:-len(".__init__")] if module.endswith(".__init__") else module
+
+class SamplingProfiler:
+    """采样式 CPU 分析器：后台线程每隔 interval 秒读取所有线程的调用栈，统计折叠后的调用栈出现次数
+
+    结果为 flamegraph.pl / speedscope 可直接读取的折叠格式（每行 "线程;模块:函数;... 次数"）。
+    不需要以分析器模式重启进程，开销只与采样频率有关。
+    """
+
+    def __init__(self, interval: float, duration: float):
+        self.interval = interval
+        self.duration = duration
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{_module_name(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.stopped_at = time.time()
+
+    def result(self, top: int = 30) -> Dict[str, Any]:
+        # 按栈顶函数汇总自身耗时，便于不画火焰图时直接查看热点
+        self_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack.rsplit(";", 1)[-1]] += count
+        total = sum(self.stacks.values()) or 1
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "duration": round((self.stopped_at or time.time()) - self.started_at, 2),
+            "top_functions": [
+                {"function": name, "samples": count, "percent": round(count * 100 / total, 1)}
+                for name, count in self_counts.most_common(top)
+            ],
+            "folded": self.folded()
+        }
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+class ProfilingService:
+    """线上按需分析 CPU 和内存，不需要重启服务
+
+    - CPU：启动采样分析器运行一段时间，返回折叠格式的调用栈
+    - 内存：通过 tracemalloc 保存快照，按模块汇总两个快照之间的内存增长
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ProfilingService, cls).__new__(cls)
+            cls._instance._setup()
+        return cls._instance
+
+    def _setup(self):
+        self.default_interval = config.get('debug.profiler.interval', 0.01)
+        self.max_duration = config.get('debug.profiler.max_duration', 300)
+        self.memory_frames = config.get('debug.memory.frames', 1)
+        self.max_snapshots = config.get('debug.memory.max_snapshots', 5)
+        self.profiler: Optional[SamplingProfiler] = None
+        self._snapshots: 'OrderedDict[int, tracemalloc.Snapshot]' = OrderedDict()
+        self._snapshot_times: Dict[int, float] = {}
+        self._next_snapshot_id = 1
+
+    def start_cpu_profile(self, duration: float = 30, interval: Optional[float] = None) -> Dict[str, Any]:
+        """启动 CPU 采样，duration 秒后自动停止"""
+        if self.profiler and self.profiler.running:
+            return {"status": "error", "message": "CPU 分析已在进行中"}
+        duration = min(duration, self.max_duration)
+        self.profiler = SamplingProfiler(interval or self.default_interval, duration)
+        self.profiler.start()
+        logger.info(f"CPU profiler started for {duration}s, interval {self.profiler.interval}s")
+        return {"status": "success", "duration": duration, "interval": self.profiler.interval}
+
+    def stop_cpu_profile(self) -> Dict[str, Any]:
+        """停止 CPU 采样并返回结果"""
+        if not self.profiler:
+            return {"status": "error", "message": "没有进行过 CPU 分析"}
+        self.profiler.stop()
+        logger.info(f"CPU profiler stopped after {self.profiler.samples} samples")
+        return {"status": "success", **self.profiler.result()}
+
+    def get_cpu_profile(self) -> Dict[str, Any]:
+        """获取最近一次 CPU 分析的结果，仍在进行中时返回目前为止的结果"""
+        if not self.profiler:
+            return {"status": "error", "message": "没有进行过 CPU 分析"}
+        return {"status": "success", **self.profiler.result()}
+
+    @staticmethod
+    def _filter(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+        return snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+
+    @staticmethod
+    def _group_by_module(snapshot: tracemalloc.Snapshot) -> Dict[str, List[int]]:
+        """按模块汇总内存，返回 {模块: [字节数, 分配块数]}"""
+        modules: Dict[str, List[int]] = {}
+        for stat in snapshot.statistics("filename"):
+            module = modules.setdefault(_module_name(stat.traceback[0].filename), [0, 0])
+            module[0] += stat.size
+            module[1] += stat.count
+        return modules
+
+    def _capture(self) -> tracemalloc.Snapshot:
+        return self._filter(tracemalloc.take_snapshot())
+
+    async def _new_snapshot(self) -> Tuple[int, tracemalloc.Snapshot]:
+        """保存一个快照，超出 max_snapshots 时丢弃最早的快照"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+            logger.info(f"tracemalloc started with {self.memory_frames} frames")
+        # 遍历所有分配记录的耗时与内存占用成正比，放到线程中执行，不阻塞事件循环
+        snapshot = await asyncio.to_thread(self._capture)
+        snapshot_id = self._next_snapshot_id
+        self._next_snapshot_id += 1
+        self._snapshots[snapshot_id] = snapshot
+        self._snapshot_times[snapshot_id] = time.time()
+        while len(self._snapshots) > self.max_snapshots:
+            old_id, _ = self._snapshots.popitem(last=False)
+            self._snapshot_times.pop(old_id, None)
+        return snapshot_id, snapshot
+
+    async def take_snapshot(self, top: int = 20) -> Dict[str, Any]:
+        """保存一个内存快照。第一次调用时开始跟踪内存分配，之前分配的内存不会被统计"""
+        snapshot_id, snapshot = await self._new_snapshot()
+        modules = sorted((await asyncio.to_thread(self._group_by_module, snapshot)).items(),
+                         key=lambda item: -item[1][0])
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "status": "success",
+            "snapshot_id": snapshot_id,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "modules": [
+                {"module": name, "size_bytes": size, "count": count}
+                for name, (size, count) in modules[:top]
+            ]
+        }
+
+    async def diff_snapshots(self, base_id: int, target_id: Optional[int] = None, top: int = 20) -> Dict[str, Any]:
+        """按模块比较两个快照的内存变化，target_id 为空时与当前内存比较"""
+        base = self._snapshots.get(base_id)
+        if base is None:
+            return {"status": "error", "message": f"快照 {base_id} 不存在"}
+        # 与当前内存比较时新快照可能把 base 挤出快照列表，先取出 base 的时间
+        base_time = self._snapshot_times[base_id]
+        if target_id is None:
+            target_id, target = await self._new_snapshot()
+        else:
+            target = self._snapshots.get(target_id)
+            if target is None:
+                return {"status": "error", "message": f"快照 {target_id} 不存在"}
+        target_time = self._snapshot_times.get(target_id, time.time())
+
+        base_modules = await asyncio.to_thread(self._group_by_module, base)
+        target_modules = await asyncio.to_thread(self._group_by_module, target)
+        diffs = []
+        for name in set(base_modules) | set(target_modules):
+            size, count = target_modules.get(name, [0, 0])
+            base_size, base_count = base_modules.get(name, [0, 0])
+            if size != base_size or count != base_count:
+                diffs.append({
+                    "module": name,
+                    "size_bytes": size,
+                    "size_diff": size - base_size,
+                    "count_diff": count - base_count
+                })
+        diffs.sort(key=lambda d: -abs(d["size_diff"]))
+        return {
+            "status": "success",
+            "base_id": base_id,
+            "target_id": target_id,
+            "seconds": round(target_time - base_time, 1),
+            "total_diff": sum(d["size_diff"] for d in diffs),
+            "modules": diffs[:top]
+        }
+
+    def stop_memory_tracing(self) -> Dict[str, Any]:
+        """停止跟踪内存分配并丢弃快照"""
+        self._snapshots.clear()
+        self._snapshot_times.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("tracemalloc stopped")
+        return {"status": "success"}
@@ -0,0 +1,114 @@
+import logging
+from typing import Any, Dict, List, Optional
+from config.config_manager import config
+from models.ai_models import Message, MessageRole
+from models.output_schemas import OUTPUT_SCHEMAS
+from services.ai_service import AIService
+from tools.json_tools import parse_json_tolerant, validate_json
+
+logger = logging.getLogger(__name__)
+
+# 按模型统计结构化输出的解析情况，所有实例共享
+_parse_stats: Dict[str, Dict[str, int]] = {}
+
+def get_parse_stats() -> Dict[str, Dict[str, Any]]:
+    """返回每个模型的结构化输出统计和解析失败率"""
+    report = {}
+    for model, stats in _parse_stats.items():
+        requests = stats["requests"] or 1
+        report[model] = dict(stats)
+        report[model]["parse_failure_rate"] = round(stats["parse_failures"] / requests, 4)
+        report[model]["schema_failure_rate"] = round(stats["schema_failures"] / requests, 4)
+        report[model]["drop_rate"] = round(stats["dropped"] / requests, 4)
+    return report
+
+class StructuredOutputService:
+    """请求模型返回 JSON，按提示词类型的 schema 校验，并对缺失或无效的字段做针对性补全
+
+    模型输出无法解析时请求重新输出一次；只有部分字段可用时，只追问缺失或无效的字段，
+    而不是丢弃整个结果。
+    """
+
+    def __init__(self, ai_service: AIService):
+        self.ai_service = ai_service
+        self.repair_enabled = config.get('llm.structured_output.repair', True)
+        self.max_repairs = config.get('llm.structured_output.max_repairs', 1)
+
+    @staticmethod
+    def _stats(model: str) -> Dict[str, int]:
+        key = model or "default"
+        if key not in _parse_stats:
+            _parse_stats[key] = {
+                "requests": 0,
+                "parse_failures": 0,   # 首次输出无法解析为 JSON
+                "schema_failures": 0,  # 首次输出可解析但有字段缺失或无效
+                "truncated": 0,        # 首次输出被截断
+                "repairs": 0,          # 发出的补全请求数
+                "repaired": 0,         # 补全后通过校验
+                "dropped": 0,          # 最终没有可用结果
+            }
+        return _parse_stats[key]
+
+    async def generate_json(self, messages: List[Message], kind: str, model: str = None) -> Optional[Dict]:
+        """生成并校验结构化输出
+
+        Args:
+            messages: 请求消息，需包含 JSON 格式要求
+            kind: 提示词类型，对应 models.output_schemas.OUTPUT_SCHEMAS 中的 schema
+            model: 模型名称
+
+        Returns:
+            通过校验的 JSON 对象；部分字段仍无效时返回去掉无效字段后的对象；完全不可用时返回 None
+        """
+        schema = OUTPUT_SCHEMAS[kind]
+        stats = self._stats(model)
+        stats["requests"] += 1
+        json_mode = config.llm.get('support_json_mode')
+
+        response = await self.ai_service.generate_response(messages, model=model, json_mode=json_mode)
+        data, truncated = parse_json_tolerant(response)
+        if truncated:
+            stats["truncated"] += 1
+        invalid = validate_json(data, schema) if data is not None else ["$"]
+        if data is None:
+            stats["parse_failures"] += 1
+        elif invalid:
+            stats["schema_failures"] += 1
+
+        repairs = 0
+        while invalid and self.repair_enabled and repairs < self.max_repairs and response:
+            repairs += 1
+            stats["repairs"] += 1
+            if "$" in invalid:
+                # 整体不可用，请求按原格式重新输出
+                repair_prompt = "你上一次的回复不是符合要求的JSON。请按之前要求的格式重新返回完整的单个JSON对象，不要添加任何其他文字。"
+            else:
+                repair_prompt = (f"你上一次的回复中以下字段缺失或格式不正确：{', '.join(invalid)}。"
+                                 f"请只返回由这些字段组成的单个JSON对象，字段格式与之前的要求一致，不要返回其他字段和任何说明。")
+            repair_messages = messages + [
+                Message(role=MessageRole.assistant, content=response),
+                Message(role=MessageRole.user, content=repair_prompt)
+            ]
+            logger.info(f"Repairing {kind} output from {model}, invalid fields: {invalid}")
+            repair_response = await self.ai_service.generate_response(repair_messages, model=model, json_mode=json_mode)
+            patch, _ = parse_json_tolerant(repair_response)
+            if not isinstance(patch, dict):
+                continue
+            if "$" in invalid:
+                data, response = patch, repair_response
+            else:
+                data.update({key: value for key, value in patch.items() if key in invalid})
+            invalid = validate_json(data, schema)
+            if not invalid:
+                stats["repaired"] += 1
+
+        if data is None or invalid == ["$"]:
+            stats["dropped"] += 1
+            logger.warning(f"Dropping {kind} output from {model}, not usable: {response}")
+            return None
+        if invalid:
+            # 保留可用字段，去掉仍然无效的字段，调用方按缺省值处理
+            logger.warning(f"{kind} output from {model} still has invalid fields after repair: {invalid}")
+            for key in invalid:
+                data.pop(key, None)
+        return data
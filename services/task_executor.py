@@ -1,21 +1,77 @@
+import asyncio
+import contextlib
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from services.task_state import SearchTask, TaskState, TaskEvent
 from services.task_manager import TaskManager
+from services.task_scheduler import TaskScheduler
 from services.browser_service import BrowserService
-from services.ai_service import AIService
+from services.ai_service import AIService, TokenUsage, current_token_usage
+from services.triage_service import NoteTriageService, TriageDecision
+from services.structured_output_service import StructuredOutputService
+from services.trace_service import bind_trace, span
+from models.output_schemas import NOTE_OPINIONS
 from models.ai_models import Message, MessageRole
 from config.config_manager import config
 import json
 import re
-from tools.json_tools import extract_json_from_text, extract_first_number
+from datetime import datetime
+from tools.json_tools import extract_first_number, validate_json
+from tools.token_tools import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# 关键词分隔符：英文逗号、分号、中文逗号和顿号
+KEYWORD_SPLIT_CHARS = ',;，、'
+
+# 单篇笔记观点分析的返回格式
+NOTE_OPINION_SCHEMA = """{
+    "note_influence_score": "基于获赞、收藏、评论、分享等计算的影响力得分 0-100",
+    "main_opinion": {
+        "content": "主贴核心观点",
+        "confidence": "基于内容质量和影响力的可信度 0-100",
+        "keywords": ["关键词1", "关键词2"],
+        "support_metrics": {
+            "likes": "获赞数",
+            "collects": "收藏数",
+            "shares": "分享数",
+            "supporting_comments": "支持性评论数",
+            "opposing_comments": "反对性评论数"
+        }
+    },
+    "supporting_opinions": [
+        {
+            "content": "支持性观点",
+            "source": "主贴/评论",
+            "confidence": "基于点赞数和评论质量的可信度 0-100",
+            "keywords": ["关键词"],
+            "metrics": {
+                "likes": "获赞数",
+                "sub_comments": "子评论数"
+            }
+        }
+    ],
+    "opposing_opinions": [
+        {
+            "content": "反对性观点",
+            "source": "主贴/评论",
+            "confidence": "基于点赞数和评论质量的可信度 0-100",
+            "keywords": ["关键词"],
+            "metrics": {
+                "likes": "获赞数",
+                "sub_comments": "子评论数"
+            }
+        }
+    ]
+}"""
+
 class TaskExecutor:
     def __init__(self, task_manager: TaskManager, browser_service: BrowserService, 
-                 ai_service: AIService, ai_service_mm: AIService):
+                 ai_service: AIService, ai_service_mm: AIService,
+                 scheduler: Optional[TaskScheduler] = None):
         self.task_manager = task_manager
+        # 浏览器和模型请求的全局并发名额
+        self.scheduler = scheduler or TaskScheduler(task_manager)
         self.browser_service = browser_service
         self.ai_service = ai_service  # 文本模型服务
         self.ai_service_mm = ai_service_mm  # 多模态模型服务
@@ -23,13 +79,34 @@ class TaskExecutor:
         self.max_notes_per_batch = config.get('task.max_notes_per_batch', 3)
         self.max_keywords_per_batch = config.get('task.max_keywords_per_batch', 2)
         self.max_batches = config.get('task.max_batches', 3)
+        # 小笔记合并分析
+        self.batch_analysis_enabled = config.get('task.batch_analysis.enabled', True)
+        self.batch_analysis_small_note_tokens = config.get('task.batch_analysis.small_note_tokens', 800)
+        self.batch_analysis_max_tokens = config.get('task.batch_analysis.max_tokens', 3000)
+        self.batch_analysis_max_notes = config.get('task.batch_analysis.max_notes', 5)
+        # 笔记处理流水线各阶段的并发数和阶段间队列长度
+        self.pipeline_fetch_concurrency = config.get('task.pipeline.fetch_concurrency', 1)
+        self.pipeline_analyze_concurrency = config.get('task.pipeline.analyze_concurrency', 2)
+        self.pipeline_queue_size = config.get('task.pipeline.queue_size', 2)
+        # 无人值守模式：关键词并发搜索，不询问用户，按预算停止
+        self.unattended_keyword_concurrency = config.get('task.unattended.keyword_concurrency', 3)
+        # 结构化输出的解析、校验和补全
+        self.structured_output = StructuredOutputService(ai_service)
+        # 打开笔记前的相关性分流
+        self.triage_service = NoteTriageService(ai_service)
 
     async def execute_search_task(self, task: SearchTask):
         """执行搜索任务的具体逻辑"""
+        # 本次执行中记录的 span（包括子任务中的）都带上 task_id
+        bind_trace(task_id=task.task_id)
+        if task.context.get("unattended"):
+            return await self.execute_unattended_task(task)
+        
+        keyword_producer = None
         try:
             logger.debug(f"Starting search task: {task.task_id}, keywords: {task.keywords}")
             
-            # 如果是首次执行，生成关键词并保存到context中
+            # 如果是首次执行，边生成关键词边搜索
             if "all_keywords" not in task.context:
                 # 发送开始搜索的消息
                 await self.task_manager.websocket_service.send_message(task.client_id, {
@@ -38,35 +115,46 @@ class TaskExecutor:
                     "message_type": "task_progress"
                 })
                 
-                # 1. 生成搜索关键词组合
-                all_keywords = await self._generate_search_keywords(task)
-                if not all_keywords:
-                    raise ValueError("Failed to generate search keywords")
+                # 保存用户原始主题，task.keywords 之后会被替换为全部关键词
+                task.context["query"] = task.keywords
                 
-                # 保存所有关键词到context
-                task.keywords = " ".join(all_keywords)
-                task.context["all_keywords"] = all_keywords
-                task.context["current_batch"] = 0
+                # 1. 用户原始关键词立即入队，AI 生成的关键词流式解析后陆续入队
+                keyword_queue = asyncio.Queue()
+                original_keywords = self._split_keywords(task.keywords)[:self.max_keywords_per_batch * self.max_batches]
+                for kw in original_keywords:
+                    keyword_queue.put_nowait(kw)
+                keyword_producer = asyncio.create_task(
+                    self._stream_search_keywords(task, original_keywords, keyword_queue)
+                )
                 
-                # 发送关键词生成完成的消息
-                await self.task_manager.websocket_service.send_message(task.client_id, {
-                    "type": "chat_response",
-                    "content": f"已生成搜索关键词：{', '.join(all_keywords)}",
-                    "message_type": "task_progress"
-                })
-            
-            # 获取当前批次和所有关键词
-            all_keywords = task.context["all_keywords"]
-            current_batch = task.context["current_batch"]
-            
-            # 处理当前批次的关键词，如果剩下最后一个关键词，合并到当前批次
-            batch_start = current_batch * self.max_keywords_per_batch
-            remaining_keywords = len(all_keywords) - batch_start
-            if remaining_keywords <= self.max_keywords_per_batch + 1:
-                # 如果剩余关键词数量小于等于正常批次大小+1，则一次性处理完
-                batch_keywords = all_keywords[batch_start:]
+                # 首批关键词直接从队列获取，不等待关键词全部生成
+                current_batch = 0
+                task.context["current_batch"] = current_batch
+                batch_start = 0
+                batch_keywords = await self._take_keywords(keyword_queue, self.max_keywords_per_batch)
+                if not batch_keywords:
+                    raise ValueError("Failed to generate search keywords")
+                keywords_total = max(task.progress.keywords_total, len(batch_keywords))
             else:
-                batch_keywords = all_keywords[batch_start:batch_start + self.max_keywords_per_batch]
+                # 获取当前批次和所有关键词
+                all_keywords = task.context["all_keywords"]
+                current_batch = task.context["current_batch"]
+                
+                # 处理当前批次的关键词，如果剩下最后一个关键词，合并到当前批次
+                batch_start = current_batch * self.max_keywords_per_batch
+                user_input = task.context.get("user_input")
+                if batch_start >= len(all_keywords) or (user_input and not user_input.get("continue_search")):
+                    # 从检查点恢复时搜索已经结束，只差综合分析
+                    await self._analyze_all_opinions(task)
+                    await self._complete_task(task)
+                    return
+                remaining_keywords = len(all_keywords) - batch_start
+                if remaining_keywords <= self.max_keywords_per_batch + 1:
+                    # 如果剩余关键词数量小于等于正常批次大小+1，则一次性处理完
+                    batch_keywords = all_keywords[batch_start:]
+                else:
+                    batch_keywords = all_keywords[batch_start:batch_start + self.max_keywords_per_batch]
+                keywords_total = len(all_keywords)
             
             logger.debug(f"Processing batch {current_batch + 1}, keywords: {batch_keywords}")
             
@@ -75,7 +163,7 @@ class TaskExecutor:
             await self._notify_progress(task, f"正在搜索关键词组合：{combined_keywords}")
             
             # 更新进度信息，累加之前的结果
-            task.progress.keywords_total = len(all_keywords)
+            task.progress.keywords_total = keywords_total
             task.progress.keywords_completed = batch_start + len(batch_keywords)
             task.progress.notes_total = task.progress.notes_total or 0  # 保留之前的总数
             task.progress.notes_processed = task.progress.notes_processed or 0  # 保留之前的处理数
@@ -83,24 +171,39 @@ class TaskExecutor:
             task.progress.comments_processed = task.progress.comments_processed or 0  # 保留之前的处理数
             
             # 发送更新的任务状态到前端
-            await self.task_manager.websocket_service.send_message(task.client_id, {
-                "type": "search_task_update",
-                "action": "progress",
-                "task": task.to_dict()
-            })
+            await self.task_manager.publish_task_update(task, "progress")
             
             # 执行搜索
-            search_result = await self.browser_service.search_xiaohongshu(combined_keywords)
+            async with self._browser():
+                with span("browser.search", keyword=combined_keywords):
+                    search_result = await self.browser_service.search_xiaohongshu(combined_keywords)
             if search_result["status"] == "success":
                 notes = search_result["results"][:self.max_notes_per_batch]
-                task.progress.notes_total += len(notes)
+                # 从检查点恢复时，本批次的笔记数不重复累加，已完成的笔记不再重复处理
+                task.context.setdefault("batch_notes_base", task.progress.notes_total)
+                task.progress.notes_total = task.context["batch_notes_base"] + len(notes)
+                done_note_ids = set(task.context.get("done_note_ids", []))
+                if done_note_ids:
+                    notes = [note for note in notes if note.get("id") not in done_note_ids]
+                    logger.info(f"Resuming batch {current_batch + 1} of task {task.task_id}, "
+                                f"{len(done_note_ids)} notes already done, {len(notes)} left")
                 await self._process_notes(task, notes, combined_keywords)
             
+            # 首批搜索完成后，收集全部生成的关键词并保存到context中
+            if keyword_producer:
+                all_keywords = await keyword_producer
+                keyword_producer = None
+                task.keywords = " ".join(all_keywords)
+                task.context["all_keywords"] = all_keywords
+                task.progress.keywords_total = len(all_keywords)
+            
             # 发送批次完成的消息
             batch_summary = (
                 f"完成第 {current_batch + 1} 批搜索（关键词：{combined_keywords}），"
                 f"累计处理 {task.progress.notes_processed} 篇笔记，"
-                f"获取 {task.progress.comments_processed} 条评论。"
+                f"获取 {task.progress.comments_processed} 条评论"
+                + (f"，跳过 {task.progress.notes_skipped} 篇低相关笔记" if task.progress.notes_skipped else "")
+                + "。"
             )
             await self.task_manager.websocket_service.send_message(task.client_id, {
                 "type": "chat_response",
@@ -108,8 +211,11 @@ class TaskExecutor:
                 "message_type": "task_progress"
             })
 
-            # 更新当前批次
+            # 更新当前批次，清除本批次的断点信息
             task.context["current_batch"] = current_batch + 1
+            task.context.pop("done_note_ids", None)
+            task.context.pop("batch_notes_base", None)
+            await self.task_manager.checkpoint(task)
             
             # 检查是否还有下一批
             remaining_keywords = task.progress.keywords_total - task.progress.keywords_completed
@@ -142,9 +248,222 @@ class TaskExecutor:
                 TaskEvent.FAIL,
                 str(e)
             )
+        finally:
+            # 出错或任务被取消时停止关键词生成
+            if keyword_producer and not keyword_producer.done():
+                keyword_producer.cancel()
+
+    async def execute_unattended_task(self, task: SearchTask):
+        """无人值守模式：关键词边生成边并发搜索，每个关键词单独推送进度，
+        全部关键词完成或达到 task.context["budget"] 中的预算上限后直接进行综合分析，中途不询问用户"""
+        keyword_producer = None
+        workers = set()
+        # 本任务及其子任务中的模型请求都计入这个计数器，从检查点恢复时接着之前的用量累计
+        usage = TokenUsage(completion_tokens=task.progress.tokens_used)
+        current_token_usage.set(usage)
+        try:
+            logger.debug(f"Starting unattended search task: {task.task_id}, keywords: {task.keywords}, "
+                         f"budget: {task.context.get('budget')}")
+            if "query" not in task.context:
+                await self.task_manager.websocket_service.send_message(task.client_id, {
+                    "type": "chat_response",
+                    "content": f"开始无人值守搜索「{task.keywords}」相关内容...",
+                    "message_type": "task_progress"
+                })
+                task.context["query"] = task.keywords
+            
+            keyword_queue = asyncio.Queue()
+            if "all_keywords" in task.context:
+                # 从检查点恢复，关键词已经生成过
+                for kw in task.context["all_keywords"]:
+                    keyword_queue.put_nowait(kw)
+                keyword_queue.put_nowait(None)
+            else:
+                original_keywords = self._split_keywords(task.context["query"])[:self.max_keywords_per_batch * self.max_batches]
+                for kw in original_keywords:
+                    keyword_queue.put_nowait(kw)
+                keyword_producer = asyncio.create_task(
+                    self._stream_search_keywords(task, original_keywords, keyword_queue)
+                )
+            
+            # 每个关键词一个 worker，最多同时 keyword_concurrency 个；浏览器操作仍通过 browser 名额串行，
+            # 一个关键词的模型分析和另一个关键词的页面加载可以同时进行
+            slots = asyncio.Semaphore(self.unattended_keyword_concurrency)
+            done_keywords = task.context.setdefault("done_keywords", [])
+            stop_reason = None
+            while True:
+                keyword = await keyword_queue.get()
+                if keyword is None:
+                    break
+                if keyword in done_keywords:
+                    continue
+                await slots.acquire()
+                stop_reason = self._budget_exceeded(task)
+                if stop_reason:
+                    slots.release()
+                    break
+                worker = asyncio.create_task(self._run_keyword(task, keyword, slots))
+                workers.add(worker)
+                worker.add_done_callback(workers.discard)
+            if workers:
+                await asyncio.gather(*workers)
+            stop_reason = stop_reason or self._budget_exceeded(task)
+            
+            if keyword_producer and not stop_reason:
+                all_keywords = await keyword_producer
+                keyword_producer = None
+                task.keywords = " ".join(all_keywords)
+                task.context["all_keywords"] = all_keywords
+            
+            task.progress.tokens_used = usage.total_tokens
+            if stop_reason:
+                logger.info(f"Unattended task {task.task_id} stopped by {stop_reason} budget")
+                await self.task_manager.websocket_service.send_message(task.client_id, {
+                    "type": "chat_response",
+                    "content": f"已达到{stop_reason}预算上限，停止搜索，"
+                               f"共完成 {task.progress.keywords_completed} 个关键词、{task.progress.notes_processed} 篇笔记。",
+                    "message_type": "task_progress"
+                })
+            
+            logger.info(f"Unattended task {task.task_id} completed with {len(task.results)} results, "
+                        f"{usage.total_tokens} tokens")
+            await self._analyze_all_opinions(task)
+            task.progress.tokens_used = usage.total_tokens
+            await self._complete_task(task)
+        
+        except Exception as e:
+            logger.error(f"Error in unattended search task: {e}")
+            await self.task_manager.websocket_service.send_message(task.client_id, {
+                "type": "chat_response",
+                "content": f"搜索任务执行出错：{str(e)}",
+                "message_type": "task_progress"
+            })
+            await self.task_manager.update_task_state(
+                task.task_id,
+                TaskState.FAILED,
+                TaskEvent.FAIL,
+                str(e)
+            )
+        finally:
+            if keyword_producer and not keyword_producer.done():
+                keyword_producer.cancel()
+            for worker in workers:
+                worker.cancel()
+
+    async def _run_keyword(self, task: SearchTask, keyword: str, slots: asyncio.Semaphore):
+        """无人值守模式下搜索并处理单个关键词"""
+        task.progress.update_keyword_state(keyword)
+        try:
+            await self._notify_keyword_progress(task, keyword)
+            async with self._browser():
+                with span("browser.search", keyword=keyword):
+                    search_result = await self.browser_service.search_xiaohongshu(keyword)
+            if search_result["status"] == "success":
+                # 不同关键词可能搜到同一篇笔记，已处理过的不再重复处理
+                done_note_ids = set(task.context.get("done_note_ids", []))
+                notes = [note for note in search_result["results"][:self.max_notes_per_batch]
+                         if note.get("id") not in done_note_ids]
+                task.progress.update_keyword_state(keyword, state="analyzing", notes_total=len(notes))
+                task.progress.notes_total += len(notes)
+                await self._notify_keyword_progress(task, keyword)
+                await self._process_notes(task, notes, keyword)
+            task.progress.update_keyword_state(keyword, state="done")
+            task.context["done_keywords"].append(keyword)
+            task.progress.keywords_completed += 1
+            await self.task_manager.checkpoint(task)
+        except Exception as e:
+            logger.error(f"Error searching keyword {keyword}: {e}")
+            task.progress.update_keyword_state(keyword, state="failed")
+        finally:
+            slots.release()
+        await self._notify_keyword_progress(task, keyword)
+
+    async def _notify_keyword_progress(self, task: SearchTask, keyword: str):
+        """推送单个关键词的进度"""
+        usage = current_token_usage.get()
+        if usage:
+            task.progress.tokens_used = usage.total_tokens
+        await self.task_manager.publish_task_update(task, "keyword_progress")
+
+    def _budget_exceeded(self, task: SearchTask) -> Optional[str]:
+        """检查无人值守任务的预算，超出时返回预算类型"""
+        budget = task.context.get("budget")
+        if not budget:
+            return None
+        if budget.get("max_notes") and task.context.get("notes_opened", 0) >= budget["max_notes"]:
+            return "笔记数"
+        if budget.get("max_seconds") and (datetime.now() - task.start_time).total_seconds() >= budget["max_seconds"]:
+            return "时间"
+        usage = current_token_usage.get()
+        if budget.get("max_tokens") and usage and usage.total_tokens >= budget["max_tokens"]:
+            return "token"
+        return None
+
+    @contextlib.asynccontextmanager
+    async def _browser(self):
+        """获取浏览器名额；任务在浏览器操作中被取消时中止页面加载，避免影响下一个任务"""
+        async with self.scheduler.slot("browser"):
+            try:
+                yield
+            except asyncio.CancelledError:
+                await self.browser_service.reset_page()
+                raise
+
+    @staticmethod
+    def _clean_keyword(kw: str) -> Optional[str]:
+        """清理单个关键词，无效时返回 None"""
+        kw = kw.strip(" \n\r\t,.。，、;；")
+        # 过滤无效关键词
+        if (len(kw) > 0 and len(kw) <= 30 and 
+            '\n' not in kw and '\r' not in kw):
+            return kw
+        return None
+
+    @classmethod
+    def _split_keywords(cls, text: str) -> List[str]:
+        """使用 ,; 中文逗号和顿号分割关键词，清理并去重"""
+        keywords = []
+        for kw in re.split(f'[{KEYWORD_SPLIT_CHARS}]', text):
+            kw = cls._clean_keyword(kw)
+            if kw:
+                keywords.append(kw)
+        return list(dict.fromkeys(keywords))
+
+    @staticmethod
+    async def _take_keywords(keyword_queue: asyncio.Queue, count: int) -> List[str]:
+        """从关键词队列中取出最多 count 个关键词，遇到结束标记 None 时提前返回"""
+        keywords = []
+        while len(keywords) < count:
+            kw = await keyword_queue.get()
+            if kw is None:
+                # 把结束标记放回去，后续读取者同样能感知到结束
+                keyword_queue.put_nowait(None)
+                break
+            keywords.append(kw)
+        return keywords
+
+    async def _stream_search_keywords(self, task: SearchTask, original_keywords: List[str],
+                                      keyword_queue: asyncio.Queue) -> List[str]:
+        """流式生成搜索关键词，每解析出一个完整关键词就放入搜索队列
+
+        Args:
+            task: 搜索任务
+            original_keywords: 用户原始关键词，调用前已放入队列
+            keyword_queue: 搜索关键词队列，生成结束后放入 None 作为结束标记
+
+        Returns:
+            按入队顺序排列的全部关键词
+        """
+        max_keywords = self.max_keywords_per_batch * self.max_batches
+        keywords = list(original_keywords)
+
+        def queue_keyword(kw: str):
+            kw = self._clean_keyword(kw)
+            if kw and kw not in keywords and len(keywords) < max_keywords:
+                keywords.append(kw)
+                keyword_queue.put_nowait(kw)
+                logger.debug(f"Keyword queued: {kw}")
 
-    async def _generate_search_keywords(self, task: SearchTask) -> List[str]:
-        """Generate search keywords using AI"""
         try:
             prompt = f"""Based on the topic "{task.keywords}", generate 3-5 related search keyword combinations.
 Requirements:
@@ -162,163 +481,79 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
                 Message(role=MessageRole.user, content=prompt)
             ]
             
-            logger.debug(f"starting generate_search_keywords: {task.keywords}")
-            response = await self.ai_service.generate_response(messages, model=config.llm.get('model'))
-            if not response:
-                return [task.keywords]
-                
-            # 处理响应，分割关键词并清理，使用 ,; 中文逗号和顿号分割
-            split_chars = ',;，、'
-            keywords = []
-            all_kw = re.split(f'[{split_chars}]', task.keywords) + re.split(f'[{split_chars}]', response)
-            for kw in all_kw:
-                kw = kw.strip(" \n\r\t,.。，、;；")
-                # 过滤无效关键词
-                if (len(kw) > 0 and len(kw) <= 30 and 
-                    '\n' not in kw and '\r' not in kw):
-                    keywords.append(kw)
-            
-            keywords = list(dict.fromkeys(keywords))
+            logger.debug(f"starting stream_search_keywords: {task.keywords}")
+            pending = ""
+            stream = self.ai_service.generate_response_stream(
+                messages, model=config.llm.get('model'), raise_errors=True
+            )
+            # 提前结束时立即关闭上游的流式请求
+            with span("task.keywords") as attrs:
+                async with self.scheduler.slot("llm"), contextlib.aclosing(stream):
+                    async for chunk in stream:
+                        pending += chunk
+                        # 最后一段可能还没生成完整，留到下一个分片
+                        parts = re.split(f'[{KEYWORD_SPLIT_CHARS}]', pending)
+                        pending = parts.pop()
+                        for part in parts:
+                            queue_keyword(part)
+                        if len(keywords) >= max_keywords:
+                            break
+                    else:
+                        queue_keyword(pending)
+                attrs["keywords"] = len(keywords)
+            
             logger.info(f"generated keywords: {keywords}")
-            return keywords[:self.max_keywords_per_batch * self.max_batches]
             
         except Exception as e:
-            logger.warning(f"Error generating keywords: {e}, return original keywords")
-            return [task.keywords]  # 出错时返回原始关键词
+            logger.warning(f"Error generating keywords: {e}, use keywords generated so far: {keywords}")
+        finally:
+            keyword_queue.put_nowait(None)
+        
+        task.progress.keywords_total = len(keywords)
+        # 发送关键词生成完成的消息
+        await self.task_manager.websocket_service.send_message(task.client_id, {
+            "type": "chat_response",
+            "content": f"已生成搜索关键词：{', '.join(keywords)}",
+            "message_type": "task_progress"
+        })
+        return keywords
 
     async def _process_notes(self, task: SearchTask, notes: List[Dict], keyword: str):
         """处理笔记列表"""
         logger.debug(f"Processing {len(notes)} notes for keyword: {keyword}")
-        await self.task_manager.websocket_service.send_message(task.client_id, {
-            "type": "search_task_update",
-            "action": "progress",
-            "task": task.to_dict()
-        })
+        await self.task_manager.publish_task_update(task, "progress")
+        
+        # 打开笔记前先按相关性分流，跳过明显无关的笔记
+        async with self.scheduler.slot("llm"):
+            with span("task.triage", keyword=keyword, notes=len(notes)):
+                triaged_notes = await self.triage_service.triage(
+                    task.context.get("query", task.keywords), keyword, notes
+                )
         
         # 存储当前批次的观点分析结果
         batch_opinions = []
         
-        for j, note in enumerate(notes, 1):
-            if task.state == TaskState.CANCELLED:
-                break
-                
-            try:
-                note_id = note.get("id", "unknown")
-                note_title = note.get("title", "无标题")
-                logger.debug(f"Processing note {j}/{len(notes)}: {note_id} - {note_title}")
-                
-                note_detail = await self.browser_service.open_note(
-                    note["id"], 
-                    note.get("xsec_token")
-                )
-                
-                if note_detail["status"] == "success":
-                    # 更新进度统计
-                    task.progress.notes_processed += 1
-                    comments = note_detail.get("comments_data", [])
-                    task.progress.comments_total += len(comments)
-                    task.progress.comments_processed += len(comments)
-                    
-                    # 分析观点
-                    opinions = await self._analyze_note_opinions(
-                        note_detail["note_data"],
-                        comments
-                    )
-                    
-                    if opinions and isinstance(opinions, dict): 
-                        # 添加当前关键词信息
-                        opinions["search_keyword"] = keyword
-                        
-                        # 将观点添加到当前批次
-                        batch_opinions.append({
-                            "keyword": keyword,
-                            "note_id": note_id,
-                            "note_title": note_title,
-                            "opinions": opinions
-                        })
-                        
-                        # 将观点添加到所有观点列表
-                        if "all_opinions" not in task.context:
-                            task.context["all_opinions"] = []
-                        task.context["all_opinions"].append(opinions)
-                        
-                        try:
-                            main_opinion = opinions.get('main_opinion', {})
-                            supporting_opinions = opinions.get('supporting_opinions', [])
-                            opposing_opinions = opinions.get('opposing_opinions', [])
-                            
-                            # 生成并发送单篇笔记的摘要
-                            note_summary = [f"### {note_title}\n"]
-                            
-                            # 添加主要观点
-                            if isinstance(main_opinion, dict):
-                                note_summary.extend([
-                                    f"**主要观点**：{main_opinion.get('content', '无')}\n",
-                                    f"**可信度**：{main_opinion.get('confidence', 0)}/100\n"
-                                ])
-                            
-                            # 添加支持观点
-                            note_summary.append("\n**支持观点**：")
-                            if isinstance(supporting_opinions, list) and supporting_opinions:
-                                for op in supporting_opinions[:3]:  # 最多显示3个支持观点
-                                    if isinstance(op, dict):
-                                        note_summary.append(
-                                            f"- {op.get('content', '无')} "
-                                            f"(点赞：{op.get('metrics', {}).get('likes', 0)})"
-                                        )
-                            else:
-                                note_summary.append("- 无支持观点")
-                            
-                            # 添加反对观点
-                            note_summary.append("\n**反对观点**：")
-                            if isinstance(opposing_opinions, list) and opposing_opinions:
-                                for op in opposing_opinions[:3]:  # 最多显示3个反对观点
-                                    if isinstance(op, dict):
-                                        note_summary.append(
-                                            f"- {op.get('content', '无')} "
-                                            f"(点赞：{op.get('metrics', {}).get('likes', 0)})"
-                                        )
-                            else:
-                                note_summary.append("- 无反对观点")
-                            
-                            # 将列表转换为字符串
-                            note_summary = "\n".join(note_summary)
-                            
-                            await self.task_manager.websocket_service.send_message(task.client_id, {
-                                "type": "chat_response",
-                                "content": {
-                                    "summary": note_summary,
-                                    "note_id": note_id,
-                                    "xsec_token": note.get("xsec_token"),
-                                    "title": note_title
-                                },
-                                "message_type": "task_note_summary"
-                            })
-                            logger.debug(f"Sent note summary message for {note_id} - {note_title}")
-                            
-                        except Exception as e:
-                            logger.error(f"Error generating note summary: {e}")
-                            continue
-                    
-                    # 保存原始数据
-                    task.results.append({
-                        "keyword": keyword,
-                        "note": note,
-                        "detail": note_detail["note_data"],
-                        "comments": comments,
-                        "opinions": opinions
-                    })
-                    
-                    logger.info(f"Note {note_id} - {note_title} processed with {len(comments)} comments and opinions analyzed")
-                    
-            except Exception as e:
-                logger.error(f"Error processing note {note.get('id', 'unknown')}: {e}")
+        # 笔记处理拆分为 打开笔记 -> 分析 -> 发布 三个阶段，通过有界队列连接：
+        # 模型分析上一篇笔记时浏览器已经在打开下一篇，下游处理不过来时上游在队列上等待
+        fetch_queue = asyncio.Queue()
+        for j, (note, decision) in enumerate(triaged_notes, 1):
+            if decision == TriageDecision.SKIP:
+                task.progress.notes_skipped += 1
+                task.context.setdefault("done_note_ids", []).append(note.get("id"))
+                logger.info(f"Skipping low relevance note {note.get('id', 'unknown')} - {note.get('title', '无标题')}")
                 continue
-            await self.task_manager.websocket_service.send_message(task.client_id, {
-                "type": "search_task_update",
-                "action": "progress",
-                "task": task.to_dict()
-            })
+            if decision == TriageDecision.DOWNGRADE:
+                task.progress.notes_downgraded += 1
+            fetch_queue.put_nowait((j, note, decision))
+        analyze_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        publish_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        await self.task_manager.checkpoint(task)
+        
+        await asyncio.gather(
+            self._fetch_stage(task, fetch_queue, analyze_queue, len(notes)),
+            self._analyze_stage(task, analyze_queue, publish_queue),
+            self._publish_stage(task, publish_queue, keyword, batch_opinions)
+        )
         
         # 如果有观点分析结果，生成批次总结
         if batch_opinions:
@@ -332,6 +567,238 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
 
         logger.info(f"Completed processing notes for keyword {keyword}, processed {task.progress.notes_processed} notes")
 
+    async def _fetch_stage(self, task: SearchTask, fetch_queue: asyncio.Queue,
+                           analyze_queue: asyncio.Queue, notes_count: int):
+        """打开笔记阶段：多个 worker 从 fetch_queue 取笔记，详情放入 analyze_queue，结束后放入 None"""
+        async def worker():
+            while not fetch_queue.empty() and task.state != TaskState.CANCELLED and not self._budget_exceeded(task):
+                j, note, decision = fetch_queue.get_nowait()
+                # 笔记数预算按已打开的笔记计算，分析中的笔记也占用预算
+                task.context["notes_opened"] = task.context.get("notes_opened", 0) + 1
+                try:
+                    logger.debug(f"Opening note {j}/{notes_count}: {note.get('id', 'unknown')} - "
+                                 f"{note.get('title', '无标题')}, triage: {decision}")
+                    async with self._browser():
+                        with span("browser.open_note", note_id=note["id"]):
+                            note_detail = await self.browser_service.open_note(
+                                note["id"], 
+                                note.get("xsec_token")
+                            )
+                    if note_detail["status"] != "success":
+                        continue
+                    await analyze_queue.put((note, decision, note_detail["note_data"], note_detail.get("comments_data", [])))
+                except Exception as e:
+                    logger.error(f"Error opening note {note.get('id', 'unknown')}: {e}")
+        
+        try:
+            await asyncio.gather(*[worker() for _ in range(self.pipeline_fetch_concurrency)])
+        except asyncio.CancelledError:
+            # 任务被取消时下游阶段同时被取消，不需要结束标记
+            raise
+        except Exception as e:
+            logger.error(f"Error in fetch stage: {e}")
+        await analyze_queue.put(None)
+
+    async def _analyze_stage(self, task: SearchTask, analyze_queue: asyncio.Queue, publish_queue: asyncio.Queue):
+        """分析阶段：小笔记和降级笔记攒成一组合并分析，其余单独分析，最多同时进行 analyze_concurrency 个分析，
+        分析结果 (note, note_data, comments, opinions) 放入 publish_queue，结束后放入 None"""
+        slots = asyncio.Semaphore(self.pipeline_analyze_concurrency)
+        running = set()
+        
+        async def analyze(pack: List[Tuple[Dict, Dict, List[Dict]]]):
+            try:
+                with span("task.analyze", note_ids=[note.get("id") for note, _, _ in pack]):
+                    results = await self._analyze_note_pack(pack)
+                for result in results:
+                    await publish_queue.put(result)
+            except Exception as e:
+                logger.error(f"Error analyzing notes {[note.get('id') for note, _, _ in pack]}: {e}")
+            finally:
+                slots.release()
+        
+        async def submit(pack: List[Tuple[Dict, Dict, List[Dict]]]):
+            # 分析名额用完时不再从队列取笔记，压力传回打开笔记阶段
+            await slots.acquire()
+            job = asyncio.create_task(analyze(pack))
+            running.add(job)
+            job.add_done_callback(running.discard)
+        
+        # 等待合并分析的小笔记 [(note, note_data, comments)]
+        pending_pack = []
+        pending_tokens = 0
+        try:
+            while True:
+                item = await analyze_queue.get()
+                if item is None:
+                    break
+                note, decision, note_data, comments = item
+                note_tokens = self._estimate_note_tokens(note_data, comments)
+                if self.batch_analysis_enabled and (note_tokens <= self.batch_analysis_small_note_tokens
+                                                    or decision == TriageDecision.DOWNGRADE):
+                    # 小笔记和降级笔记先缓存，超出 token 预算或数量上限时合并分析已缓存的笔记
+                    if pending_pack and (pending_tokens + note_tokens > self.batch_analysis_max_tokens
+                                         or len(pending_pack) >= self.batch_analysis_max_notes):
+                        await submit(pending_pack)
+                        pending_pack, pending_tokens = [], 0
+                    pending_pack.append((note, note_data, comments))
+                    pending_tokens += note_tokens
+                    logger.debug(f"Note {note.get('id')} ({note_tokens} tokens) queued for batch analysis, "
+                                 f"pack size: {len(pending_pack)}, pack tokens: {pending_tokens}")
+                else:
+                    await submit([(note, note_data, comments)])
+            
+            # 分析剩余的小笔记
+            if pending_pack and task.state != TaskState.CANCELLED:
+                await submit(pending_pack)
+            if running:
+                await asyncio.gather(*running)
+        except asyncio.CancelledError:
+            # 任务被取消，停止正在进行的分析请求
+            for job in running:
+                job.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Error in analyze stage: {e}")
+        await publish_queue.put(None)
+
+    async def _publish_stage(self, task: SearchTask, publish_queue: asyncio.Queue,
+                             keyword: str, batch_opinions: List[Dict]):
+        """发布阶段：按分析完成的顺序保存结果、发送笔记摘要和任务进度"""
+        while True:
+            item = await publish_queue.get()
+            if item is None:
+                break
+            note, note_data, comments, opinions = item
+            # 进度统计在发布时更新，与检查点中已完成的笔记保持一致
+            task.progress.notes_processed += 1
+            if keyword in task.progress.keyword_states:
+                state = task.progress.keyword_states[keyword]
+                task.progress.update_keyword_state(keyword, notes_processed=state["notes_processed"] + 1)
+            task.progress.comments_total += len(comments)
+            task.progress.comments_processed += len(comments)
+            try:
+                await self._publish_note_result(task, note, note_data, comments, opinions, keyword, batch_opinions)
+                task.context.setdefault("done_note_ids", []).append(note.get("id"))
+                await self.task_manager.checkpoint(task)
+            except Exception as e:
+                logger.error(f"Error publishing note {note.get('id', 'unknown')}: {e}")
+            # 发布阶段异常退出时上游会一直阻塞在有界队列上，推送失败只记录日志
+            try:
+                await self.task_manager.publish_task_update(task, "progress")
+            except Exception as e:
+                logger.error(f"Error publishing progress for task {task.task_id}: {e}")
+
+    async def _analyze_note_pack(self, pack: List[Tuple[Dict, Dict, List[Dict]]]) -> List[Tuple[Dict, Dict, List[Dict], Optional[Dict]]]:
+        """分析一组笔记，多篇时合并分析再把结果拆分回每篇笔记"""
+        if len(pack) == 1:
+            note, note_data, comments = pack[0]
+            return [(note, note_data, comments, await self._analyze_note_opinions(note_data, comments))]
+        
+        pack_results = await self._analyze_notes_opinions_batch([
+            (note.get("id") or str(i), note_data, comments)
+            for i, (note, note_data, comments) in enumerate(pack)
+        ])
+        results = []
+        for i, (note, note_data, comments) in enumerate(pack):
+            opinions = pack_results.get(note.get("id") or str(i))
+            if opinions is None:
+                # 合并结果中缺失或无效的笔记，单独再分析一次
+                logger.info(f"Note {note.get('id')} missing from batch analysis, analyzing individually")
+                opinions = await self._analyze_note_opinions(note_data, comments)
+            results.append((note, note_data, comments, opinions))
+        return results
+
+    async def _publish_note_result(self, task: SearchTask, note: Dict, note_data: Dict, comments: List[Dict],
+                                   opinions: Optional[Dict], keyword: str, batch_opinions: List[Dict]):
+        """保存单篇笔记的分析结果，并发送笔记摘要"""
+        note_id = note.get("id", "unknown")
+        note_title = note.get("title", "无标题")
+        
+        if opinions and isinstance(opinions, dict): 
+            # 添加当前关键词信息
+            opinions["search_keyword"] = keyword
+            
+            # 将观点添加到当前批次
+            batch_opinions.append({
+                "keyword": keyword,
+                "note_id": note_id,
+                "note_title": note_title,
+                "opinions": opinions
+            })
+            
+            # 将观点添加到所有观点列表
+            if "all_opinions" not in task.context:
+                task.context["all_opinions"] = []
+            task.context["all_opinions"].append(opinions)
+            
+            try:
+                main_opinion = opinions.get('main_opinion', {})
+                supporting_opinions = opinions.get('supporting_opinions', [])
+                opposing_opinions = opinions.get('opposing_opinions', [])
+                
+                # 生成并发送单篇笔记的摘要
+                note_summary = [f"### {note_title}\n"]
+                
+                # 添加主要观点
+                if isinstance(main_opinion, dict):
+                    note_summary.extend([
+                        f"**主要观点**：{main_opinion.get('content', '无')}\n",
+                        f"**可信度**：{main_opinion.get('confidence', 0)}/100\n"
+                    ])
+                
+                # 添加支持观点
+                note_summary.append("\n**支持观点**：")
+                if isinstance(supporting_opinions, list) and supporting_opinions:
+                    for op in supporting_opinions[:3]:  # 最多显示3个支持观点
+                        if isinstance(op, dict):
+                            note_summary.append(
+                                f"- {op.get('content', '无')} "
+                                f"(点赞：{op.get('metrics', {}).get('likes', 0)})"
+                            )
+                else:
+                    note_summary.append("- 无支持观点")
+                
+                # 添加反对观点
+                note_summary.append("\n**反对观点**：")
+                if isinstance(opposing_opinions, list) and opposing_opinions:
+                    for op in opposing_opinions[:3]:  # 最多显示3个反对观点
+                        if isinstance(op, dict):
+                            note_summary.append(
+                                f"- {op.get('content', '无')} "
+                                f"(点赞：{op.get('metrics', {}).get('likes', 0)})"
+                            )
+                else:
+                    note_summary.append("- 无反对观点")
+                
+                # 将列表转换为字符串
+                note_summary = "\n".join(note_summary)
+                
+                await self.task_manager.websocket_service.send_message(task.client_id, {
+                    "type": "chat_response",
+                    "content": {
+                        "summary": note_summary,
+                        "note_id": note_id,
+                        "xsec_token": note.get("xsec_token"),
+                        "title": note_title
+                    },
+                    "message_type": "task_note_summary"
+                })
+                logger.debug(f"Sent note summary message for {note_id} - {note_title}")
+                
+            except Exception as e:
+                logger.error(f"Error generating note summary: {e}")
+        
+        # 保存原始数据
+        task.results.append({
+            "keyword": keyword,
+            "note": note,
+            "detail": note_data,
+            "comments": comments,
+            "opinions": opinions
+        })
+        
+        logger.info(f"Note {note_id} - {note_title} processed with {len(comments)} comments and opinions analyzed")
+
     async def _complete_task(self, task: SearchTask):
         """完成任务并生成可视化总结"""
         if task.state == TaskState.RUNNING:
@@ -383,35 +850,56 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
             message
         )
 
+    @staticmethod
+    def _prepare_note_content(note: Dict, comments: List[Dict]) -> Tuple[Dict, List[Dict]]:
+        """整理笔记正文、影响力指标和评论，供单篇和合并分析共用"""
+        # 计算笔记的影响力分数
+        interact_info = note.get("interact_info", {})
+        note_influence = {
+            "liked_count": interact_info.get("liked_count", 0),
+            "collected_count": interact_info.get("collected_count", 0),
+            "comment_count": interact_info.get("comment_count", 0),
+            "share_count": interact_info.get("share_count", 0)
+        }
+        
+        note_content = {
+            "title": note.get("title", ""),
+            "desc": note.get("desc", ""),
+            "influence": note_influence
+        }
+        
+        # 处理评论，包含点赞数和时间信息
+        processed_comments = [
+            {
+                "content": comment.get("content", ""),
+                "like_count": comment.get("like_count", 0),
+                "time": comment.get("create_time", ""),  # 如果API提供的话
+                "sub_comments_count": len(comment.get("sub_comments", []))
+            }
+            for comment in comments
+        ]
+        return note_content, processed_comments
+
+    def _estimate_note_tokens(self, note: Dict, comments: List[Dict]) -> int:
+        """估算单篇笔记放入分析提示后的 token 数"""
+        note_content, processed_comments = self._prepare_note_content(note, comments)
+        return estimate_tokens(note_content) + estimate_tokens(processed_comments)
+
+    @staticmethod
+    def _attach_note_metadata(analysis_result: Dict, note: Dict, note_content: Dict):
+        """添加笔记的元信息"""
+        analysis_result["note_metadata"] = {
+            "id": note.get("id"),
+            "title": note_content["title"],
+            "influence": note_content["influence"],
+            "create_time": note.get("create_time")
+        }
+
     async def _analyze_note_opinions(self, note: Dict, comments: List[Dict]) -> Dict:
         """分析笔记和评论中的观点"""
         try:
-            # 计算笔记的影响力分数
-            interact_info = note.get("interact_info", {})
-            note_influence = {
-                "liked_count": interact_info.get("liked_count", 0),
-                "collected_count": interact_info.get("collected_count", 0),
-                "comment_count": interact_info.get("comment_count", 0),
-                "share_count": interact_info.get("share_count", 0)
-            }
-            
-            # 构建分析提示
-            note_content = {
-                "title": note.get("title", ""),
-                "desc": note.get("desc", ""),
-                "influence": note_influence
-            }
-            
-            # 处理评论，包含点赞数和时间信息
-            processed_comments = [
-                {
-                    "content": comment.get("content", ""),
-                    "like_count": comment.get("like_count", 0),
-                    "time": comment.get("create_time", ""),  # 如果API提供的话
-                    "sub_comments_count": len(comment.get("sub_comments", []))
-                }
-                for comment in comments
-            ]
+            note_content, processed_comments = self._prepare_note_content(note, comments)
+            note_influence = note_content["influence"]
 
             prompt = f"""分析以下小红书笔记及其评论中的观点，考虑内容的影响力:
 
@@ -428,45 +916,7 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
 {json.dumps(processed_comments, ensure_ascii=False, indent=2)}
 
 请提取并分析所有观点，返回单个JSON格式(请不要添加破坏json格式的注释):
-{{
-    "note_influence_score": "基于获赞、收藏、评论、分享等计算的影响力得分 0-100",
-    "main_opinion": {{
-        "content": "主贴核心观点",
-        "confidence": "基于内容质量和影响力的可信度 0-100",
-        "keywords": ["关键词1", "关键词2"],
-        "support_metrics": {{
-            "likes": "获赞数",
-            "collects": "收藏数",
-            "shares": "分享数",
-            "supporting_comments": "支持性评论数",
-            "opposing_comments": "反对性评论数"
-        }}
-    }},
-    "supporting_opinions": [
-        {{
-            "content": "支持性观点",
-            "source": "主贴/评论",
-            "confidence": "基于点赞数和评论质量的可信度 0-100",
-            "keywords": ["关键词"],
-            "metrics": {{
-                "likes": "获赞数",
-                "sub_comments": "子评论数"
-            }}
-        }}
-    ],
-    "opposing_opinions": [
-        {{
-            "content": "反对性观点",
-            "source": "主贴/评论",
-            "confidence": "基于点赞数和评论质量的可信度 0-100",
-            "keywords": ["关键词"],
-            "metrics": {{
-                "likes": "获赞数",
-                "sub_comments": "子评论数"
-            }}
-        }}
-    ]
-}}"""
+{NOTE_OPINION_SCHEMA}"""
 
             messages = [
                 Message(role=MessageRole.system, content="你是一个专业的观点分析专家，善于从文本中提取观点并分析观点的倾向性。"),
@@ -474,20 +924,14 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
             ]
             
             logger.debug(f"start analyze_note_opinions: {note_content['title']}")
-            response = await self.ai_service.generate_response(messages, model=config.llm.get('model'), json_mode=config.llm.get('support_json_mode'))
-            # 使用 extract_json_from_text 处理 AI 返回的文本
-            analysis_result = extract_json_from_text(response)
+            # 按 schema 校验，缺失或无效的字段会单独追问补全
+            async with self.scheduler.slot("llm"):
+                analysis_result = await self.structured_output.generate_json(messages, "note_opinions", model=config.llm.get('model'))
             if not analysis_result:
-                logger.warning(f"Failed to extract JSON from AI response: {response}")
+                logger.warning(f"Failed to get opinion analysis for note {note_content['title']}")
                 return None
             
-            # 添加笔记的元信息
-            analysis_result["note_metadata"] = {
-                "id": note.get("id"),
-                "title": note_content["title"],
-                "influence": note_influence,
-                "create_time": note.get("create_time")
-            }
+            self._attach_note_metadata(analysis_result, note, note_content)
             
             logger.info(f"Opinion analysis completed for note {note_content['title']} with influence score {analysis_result.get('note_influence_score')}")
             return analysis_result
@@ -496,6 +940,82 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
             logger.error(f"Error analyzing opinions: {e}")
             return None
 
+    async def _analyze_notes_opinions_batch(self, notes: List[Tuple[str, Dict, List[Dict]]]) -> Dict[str, Dict]:
+        """在一次请求中合并分析多篇小笔记的观点
+
+        Args:
+            notes: [(note_key, note_data, comments)]，note_key 用于在返回结果中对应笔记
+
+        Returns:
+            note_key -> 单篇笔记的观点分析结果，解析失败的笔记不包含在内
+        """
+        try:
+            notes_payload = []
+            note_contents = {}
+            for note_key, note, comments in notes:
+                note_content, processed_comments = self._prepare_note_content(note, comments)
+                note_contents[note_key] = (note, note_content)
+                notes_payload.append({
+                    "note_id": note_key,
+                    "title": note_content["title"],
+                    "desc": note_content["desc"],
+                    "influence": note_content["influence"],
+                    "comments": processed_comments
+                })
+
+            prompt = f"""分析以下 {len(notes_payload)} 篇小红书笔记及其评论中的观点，每篇笔记单独分析，考虑内容的影响力:
+
+笔记列表:
+{json.dumps(notes_payload, ensure_ascii=False, indent=2)}
+
+请对每篇笔记分别提取并分析所有观点，返回单个JSON格式(请不要添加破坏json格式的注释)，results 中每篇笔记对应一项:
+{{
+    "results": [
+        {{
+            "note_id": "输入中的 note_id，原样返回",
+            "analysis": "该笔记的观点分析对象"
+        }}
+    ]
+}}
+
+其中每个 analysis 的格式为:
+{NOTE_OPINION_SCHEMA}"""
+
+            messages = [
+                Message(role=MessageRole.system, content="你是一个专业的观点分析专家，善于从文本中提取观点并分析观点的倾向性。"),
+                Message(role=MessageRole.user, content=prompt)
+            ]
+            
+            logger.debug(f"start analyze_notes_opinions_batch: {len(notes_payload)} notes")
+            async with self.scheduler.slot("llm"):
+                batch_result = await self.structured_output.generate_json(messages, "note_opinions_batch", model=config.llm.get('model'))
+            if not batch_result or not isinstance(batch_result.get("results"), list):
+                logger.warning(f"Failed to get batch opinion analysis for {len(notes_payload)} notes")
+                return {}
+            
+            # 按 note_id 拆分回单篇笔记的分析结果
+            results = {}
+            for item in batch_result["results"]:
+                if not isinstance(item, dict):
+                    continue
+                note_key = str(item.get("note_id", ""))
+                analysis_result = item.get("analysis")
+                if note_key not in note_contents or not isinstance(analysis_result, dict):
+                    continue
+                # 不完整的单篇结果交给单篇分析，在那里做针对性补全
+                if validate_json(analysis_result, NOTE_OPINIONS):
+                    continue
+                note, note_content = note_contents[note_key]
+                self._attach_note_metadata(analysis_result, note, note_content)
+                results[note_key] = analysis_result
+            
+            logger.info(f"Batch opinion analysis completed for {len(results)}/{len(notes_payload)} notes")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error analyzing batch opinions: {e}")
+            return {}
+
     async def _summarize_batch_opinions(self, batch_opinions: List[Dict]) -> str:
         """汇总分析一批笔记的观点"""
         try:
@@ -517,7 +1037,8 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
             ]
             
             logger.debug(f"start summarize_batch_opinions")
-            summary = await self.ai_service.generate_response(messages, model=config.llm.get('model'))
+            async with self.scheduler.slot("llm"):
+                summary = await self.ai_service.generate_response(messages, model=config.llm.get('model'))
             return summary
             
         except Exception as e:
@@ -589,9 +1110,8 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
             ]
             
             logger.debug(f"start analyze_all_opinions")
-            summary = await self.ai_service.generate_response(messages, model=config.llm.get('model'), json_mode=config.llm.get('support_json_mode'))
-            # 使用 extract_json_from_text 处理 AI 返回的文本
-            analysis_result = extract_json_from_text(summary)
+            async with self.scheduler.slot("llm"):
+                analysis_result = await self.structured_output.generate_json(messages, "all_opinions", model=config.llm.get('model'))
             if not analysis_result:
                 logger.warning(f"Failed to get valid JSON from response")
                 return "观点综合分析失败"
@@ -650,10 +1170,11 @@ Output example: 遛狗技巧,狗狗训练,遛狗装备,遛狗注意事项"""
             ]
             
             logger.debug(f"start generate_user_summary")
-            text_summary = await self.ai_service.generate_response(
-                messages, 
-                model=config.llm.get('model')
-            )
+            async with self.scheduler.slot("llm"):
+                text_summary = await self.ai_service.generate_response(
+                    messages, 
+                    model=config.llm.get('model')
+                )
             logger.debug(f"text_summary: {text_summary}")
             
             # 使用实际的统计数据
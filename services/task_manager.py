@@ -1,29 +1,49 @@
 from typing import Dict, List, Optional, Any
+from datetime import datetime
 from .task_state import SearchTask, TaskState, TaskEvent
+from services.task_store import TaskStore
 from services.websocket_service import WebsocketService
+from config.config_manager import config
 import logging
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
 class TaskManager:
-    def __init__(self, websocket_service: WebsocketService):
-        self.tasks: Dict[str, SearchTask] = {}
+    def __init__(self, websocket_service: WebsocketService, task_store: Optional[TaskStore] = None):
+        self.tasks: Dict[str, SearchTask] = {}  # 未结束或刚结束的任务
         self.client_tasks: Dict[str, List[str]] = {}  # client_id -> [task_id]
+        self.task_summaries: Dict[str, Dict[str, Any]] = {}  # 已移出内存的任务 task_id -> 摘要
         self.websocket_service = websocket_service
         
+        # 已结束的任务在 archive_after 秒后写入存储并移出内存，只保留摘要
+        store_path = config.get('task.store.path', 'data/tasks.db')
+        self.task_store = task_store or (TaskStore(store_path) if store_path else None)
+        self.archive_after = config.get('task.store.archive_after', 60)
+        self.archive_interval = config.get('task.store.archive_interval', 30)
+        self.pending_ttl = config.get('task.store.pending_ttl', 86400)
+        self.retention_days = config.get('task.store.retention_days', 30)
+        self.max_summaries_per_client = config.get('task.store.max_summaries_per_client', 20)
+        self.max_listed_per_client = config.get('task.store.max_listed_per_client', 50)
+        # 未结束任务在每篇笔记、每个批次和每次状态变化后写入检查点，重启后从检查点恢复
+        self.checkpoint_enabled = config.get('task.checkpoint.enabled', True)
+        self._checkpoint_lock = asyncio.Lock()  # 保证检查点按顺序写入
+        self._last_purge = 0.0
+        self._archive_loop_task: Optional[asyncio.Task] = None
+        # 客户端发现任务更新的序号不连续时请求完整快照
+        self.websocket_service.register_handler("task_resync", self._handle_task_resync)
+        
     async def create_task(self, keywords: str, client_id: str, task_id: Optional[str] = None) -> SearchTask:
         """创建新任务，如果提供task_id则使用该ID"""
         # 标准化关键词
         normalized_keywords = keywords.strip()
         
         # 检查是否存在相同关键词的运行中任务
-        for existing_task in self.tasks.values():
-            if (existing_task.client_id == client_id and 
-                existing_task.keywords.strip() == normalized_keywords and 
-                existing_task.state == TaskState.RUNNING):
-                logger.info(f"Found duplicate running task for keywords: {normalized_keywords}")
-                return existing_task
+        existing_task = self.find_running_task(normalized_keywords, client_id)
+        if existing_task:
+            logger.info(f"Found duplicate running task for keywords: {normalized_keywords}")
+            return existing_task
 
         # 如果提供了task_id，检查是否存在且状态是否为pending
         if task_id:
@@ -44,23 +64,127 @@ class TaskManager:
         if client_id not in self.client_tasks:
             self.client_tasks[client_id] = []
         self.client_tasks[client_id].append(task.task_id)
-        
-        await self._notify_task_update(task, TaskEvent.START)
+
+        # 与从待定任务启动一致，新任务直接进入 RUNNING：执行器只推进 RUNNING 状态的任务
+        # （_complete_task 等），停在 PENDING 的任务永远不会完成；无人值守模式不经过待定任务
+        await self.update_task_state(task.task_id, TaskState.RUNNING, TaskEvent.START)
         return task
 
+    def find_running_task(self, keywords: str, client_id: str) -> Optional[SearchTask]:
+        """查找客户端相同关键词的运行中任务"""
+        keywords = keywords.strip()
+        for task in self.tasks.values():
+            if (task.client_id == client_id and task.keywords.strip() == keywords and
+                    task.state == TaskState.RUNNING):
+                return task
+        return None
+
     async def get_client_tasks(self, client_id: str) -> List[Dict[str, Any]]:
-        """获取客户端的所有任务"""
-        if client_id not in self.client_tasks:
-            return []
-            
+        """获取客户端的任务，按创建顺序排列
+
+        内存中已不保留摘要的较早任务从存储中读取，最多返回 max_listed_per_client 条
+        """
         tasks = []
-        for task_id in self.client_tasks[client_id]:
+        for task_id in self.client_tasks.get(client_id, []):
             if task_id in self.tasks:  # 确保任务仍然存在
                 task = self.tasks[task_id]
                 tasks.append(task.to_dict())
-                
+            elif task_id in self.task_summaries:
+                tasks.append(self.task_summaries[task_id])
+
+        if self.task_store and len(tasks) < self.max_listed_per_client:
+            listed = {task["task_id"] for task in tasks}
+            # 存储中也有内存中的任务（检查点和已归档的摘要），多取这些条数
+            stored = await asyncio.to_thread(self.task_store.list_summaries, client_id,
+                                             self.max_listed_per_client + len(listed))
+            older = [summary for summary in stored if summary["task_id"] not in listed]
+            # 存储按更新时间倒序返回，取最近的若干条后按时间顺序放在内存中的任务之前
+            tasks = older[:self.max_listed_per_client - len(tasks)][::-1] + tasks
         return tasks
 
+    async def get_task(self, task_id: str) -> Optional[SearchTask]:
+        """获取任务，已移出内存的任务从存储中加载（不会重新放回内存）"""
+        if task_id in self.tasks:
+            return self.tasks[task_id]
+        if self.task_store:
+            return await asyncio.to_thread(self.task_store.load, task_id)
+        return None
+
+    def start_archiving(self):
+        """启动后台归档循环，需要在事件循环中调用"""
+        if self._archive_loop_task is None or self._archive_loop_task.done():
+            self._archive_loop_task = asyncio.create_task(self._archive_loop())
+
+    async def _archive_loop(self):
+        while True:
+            await asyncio.sleep(self.archive_interval)
+            try:
+                await self.archive_finished_tasks()
+            except Exception as e:
+                logger.error(f"Error archiving finished tasks: {e}")
+
+    async def archive_finished_tasks(self):
+        """把结束超过 archive_after 秒的任务移出内存，并清理过期的待定任务和存储"""
+        now = datetime.now()
+        for task in list(self.tasks.values()):
+            if task.state == TaskState.PENDING and (now - task.start_time).total_seconds() > self.pending_ttl:
+                # 用户一直没有启动的待定任务
+                task.update_state(TaskState.CANCELLED, TaskEvent.CANCEL, "待定任务已过期")
+            if task.is_finished() and task.end_time and (now - task.end_time).total_seconds() >= self.archive_after:
+                await self._archive_task(task)
+
+        if self.task_store and time.monotonic() - self._last_purge > 3600:
+            self._last_purge = time.monotonic()
+            await asyncio.to_thread(self.task_store.purge_older_than, self.retention_days)
+
+    async def checkpoint(self, task: SearchTask):
+        """写入任务检查点，失败时只记录日志，不影响任务执行"""
+        if not self.task_store or not self.checkpoint_enabled:
+            return
+        try:
+            async with self._checkpoint_lock:
+                # 事件循环中只复制数据，整个任务的 JSON 序列化和写入都在线程中进行
+                snapshot = self.task_store.snapshot(task)
+                await asyncio.to_thread(self.task_store.write_snapshot, snapshot)
+        except Exception as e:
+            logger.error(f"Error writing checkpoint for task {task.task_id}: {e}")
+
+    async def recover_interrupted_tasks(self) -> List[SearchTask]:
+        """从检查点恢复上次进程退出时未结束的任务，返回需要继续执行的任务"""
+        if not self.task_store or not self.checkpoint_enabled:
+            return []
+        to_resume = []
+        recovered = 0
+        for task in await asyncio.to_thread(self.task_store.list_unfinished):
+            if task.task_id in self.tasks:
+                continue
+            recovered += 1
+            self.tasks[task.task_id] = task
+            self.client_tasks.setdefault(task.client_id, []).append(task.task_id)
+            if task.state in (TaskState.RUNNING, TaskState.ANALYZING, TaskState.WAITING_BROWSER):
+                task.update_state(TaskState.RUNNING, TaskEvent.RESUME, "从检查点恢复执行")
+                to_resume.append(task)
+        if recovered:
+            logger.info(f"Recovered {recovered} unfinished tasks from checkpoints, {len(to_resume)} to resume")
+        return to_resume
+
+    async def _archive_task(self, task: SearchTask):
+        if self.task_store:
+            snapshot = self.task_store.snapshot(task)
+            await asyncio.to_thread(self.task_store.write_snapshot, snapshot)
+        self.tasks.pop(task.task_id, None)
+        self.task_summaries[task.task_id] = task.to_dict()
+        logger.debug(f"Task {task.task_id} archived, {len(self.tasks)} tasks left in memory")
+
+        # 每个客户端只在内存中保留最近的若干条摘要
+        task_ids = self.client_tasks.get(task.client_id, [])
+        archived_ids = [tid for tid in task_ids if tid in self.task_summaries]
+        for tid in archived_ids[:max(0, len(archived_ids) - self.max_summaries_per_client)]:
+            self.task_summaries.pop(tid, None)
+            task_ids.remove(tid)
+        if not task_ids:
+            self.client_tasks.pop(task.client_id, None)
+
     def create_pending_task(self, keywords: str, client_id: str) -> str:
         """创建待定状态的任务，返回task_id"""
         task = SearchTask(keywords, client_id)
@@ -83,6 +207,7 @@ class TaskManager:
         task = self.tasks[task_id]
         task.update_state(new_state, event, message)
         await self._notify_task_update(task, event)
+        await self.checkpoint(task)
         
     async def request_user_input(self, task_id: str, input_request: Dict):
         """请求用户输入"""
@@ -111,11 +236,24 @@ class TaskManager:
         
     async def _notify_task_update(self, task: SearchTask, event: TaskEvent):
         """通知客户端任务更新"""
-        await self.websocket_service.send_message(task.client_id, {
-            "type": "search_task_update",
-            "action": event.value,
-            "task": task.to_dict()
-        }) 
+        await self.publish_task_update(task, event.value)
+
+    async def publish_task_update(self, task: SearchTask, action: str):
+        """推送任务更新：首次为完整快照，之后只推送变化的字段，没有变化时不推送"""
+        message = task.build_update(action)
+        if message is not None:
+            await self.websocket_service.send_message(task.client_id, message)
+
+    async def send_task_snapshot(self, task: SearchTask, action: str = "snapshot"):
+        """发送任务的完整快照，客户端之后从快照的序号继续应用 patch"""
+        await self.publish_task_update(task, "progress")
+        await self.websocket_service.send_message(task.client_id, task.build_snapshot(action))
+
+    async def _handle_task_resync(self, client_id: str, data: Dict[str, Any]):
+        task = self.tasks.get(data.get("task_id"))
+        if task is None or task.client_id != client_id:
+            return
+        await self.send_task_snapshot(task, "resync")
 
     async def cancel_task(self, task_id: str, client_id: str) -> dict:
         """取消任务"""
@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from config.config_manager import config
+from services.task_state import SearchTask, TaskEvent
+
+logger = logging.getLogger(__name__)
+
+class TaskPriority:
+    NORMAL = 0    # 新启动的任务
+    CONTINUE = 1  # 用户确认继续的任务，已经占用了用户的等待时间，优先执行
+
+class _QueuedRun:
+    def __init__(self, task: SearchTask, run: Callable[[], Awaitable], priority: int, seq: int):
+        self.task = task
+        self.run = run
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+class TaskScheduler:
+    """全局任务调度器
+
+    所有客户端的搜索任务（每次执行到等待用户输入或结束为止）都经过这里排队：
+    - 准入控制：全局排队数和每个客户端的排队数有上限，超出时拒绝
+    - 公平排队：每个客户端一个队列，同优先级下轮流从最久未被服务的客户端取任务
+    - 优先级：继续执行的任务优先于新任务
+    - 资源限制：浏览器和模型请求分别有全局并发上限，任务执行中通过 slot() 获取
+
+    排队中任务的位置和预计开始时间写回 SearchTask，随 to_dict() 推送给前端。
+    """
+
+    def __init__(self, task_manager):
+        self.task_manager = task_manager
+        self.max_running = config.get('task.scheduler.max_running', 2)
+        self.max_queue = config.get('task.scheduler.max_queue', 50)
+        self.max_queued_per_client = config.get('task.scheduler.max_queued_per_client', 3)
+        # 浏览器只有一个 driver，默认同一时间只允许一个任务操作
+        self._slots: Dict[str, asyncio.Semaphore] = {
+            "browser": asyncio.Semaphore(config.get('task.scheduler.browser_concurrency', 1)),
+            "llm": asyncio.Semaphore(config.get('task.scheduler.llm_concurrency', 4)),
+        }
+        # 单次执行耗时的滑动平均，用于估计排队任务的开始时间
+        self._avg_run_seconds = float(config.get('task.scheduler.default_run_seconds', 120))
+
+        self._queues: Dict[str, Deque[_QueuedRun]] = {}  # client_id -> 排队的执行
+        self._last_served: Dict[str, int] = {}  # client_id -> 最近一次被调度的序号
+        self._running: Dict[str, asyncio.Task] = {}  # task_id -> 正在执行的 asyncio 任务
+        self._running_started: Dict[str, float] = {}
+        self._cancel_requested: Dict[str, float] = {}  # task_id -> 请求取消的时间
+        self._seq = itertools.count()
+        self._served = itertools.count(1)
+
+    def is_running(self, task_id: str) -> bool:
+        return task_id in self._running
+
+    def is_queued(self, task_id: str) -> bool:
+        return any(entry.task.task_id == task_id for queue in self._queues.values() for entry in queue)
+
+    def check_admission(self, client_id: str) -> Optional[str]:
+        """检查是否还能接收该客户端的任务，不能时返回原因"""
+        queued = sum(len(queue) for queue in self._queues.values())
+        if queued >= self.max_queue:
+            return "当前排队的搜索任务过多，请稍后再试"
+        if len(self._queues.get(client_id, ())) >= self.max_queued_per_client:
+            return f"每个用户最多同时排队 {self.max_queued_per_client} 个搜索任务，请等待当前任务开始后再试"
+        return None
+
+    async def submit(self, task: SearchTask, run: Callable[[], Awaitable],
+                     priority: int = TaskPriority.NORMAL) -> bool:
+        """提交一次任务执行，同一任务已在排队时忽略；任务正在执行时排在本次执行结束之后
+
+        Raises:
+            ValueError: 超出准入限制
+        """
+        if self.is_queued(task.task_id):
+            logger.info(f"Task {task.task_id} is already scheduled, ignoring duplicate submission")
+            return False
+        reason = self.check_admission(task.client_id)
+        if reason:
+            raise ValueError(reason)
+
+        entry = _QueuedRun(task, run, priority, next(self._seq))
+        self._queues.setdefault(task.client_id, deque()).append(entry)
+        logger.debug(f"Task {task.task_id} queued for client {task.client_id}, priority {priority}")
+        self._dispatch()
+        await self._publish_queue_positions()
+        return True
+
+    async def discard(self, task_id: str):
+        """从队列中移除任务（如任务已取消），正在执行的不受影响"""
+        for client_id, queue in list(self._queues.items()):
+            for entry in list(queue):
+                if entry.task.task_id == task_id:
+                    queue.remove(entry)
+                    entry.task.queue_position = None
+                    entry.task.estimated_start = None
+            if not queue:
+                del self._queues[client_id]
+        await self._publish_queue_positions()
+
+    def cancel(self, task_id: str) -> bool:
+        """取消正在执行的任务：正在等待的浏览器操作和模型请求会在下一个等待点收到 CancelledError"""
+        running = self._running.get(task_id)
+        if not running or running.done():
+            return False
+        self._cancel_requested[task_id] = time.monotonic()
+        running.cancel()
+        return True
+
+    @asynccontextmanager
+    async def slot(self, resource: str):
+        """获取浏览器或模型请求的全局并发名额"""
+        async with self._slots[resource]:
+            yield
+
+    def _pick_next(self, queues: Dict[str, Deque[_QueuedRun]], last_served: Dict[str, int],
+                   running=()) -> Optional[_QueuedRun]:
+        """优先级最高的先执行，同优先级下选择最久未被服务的客户端，再按提交顺序
+
+        同一任务的上一次执行尚未结束时，该任务不能被选中
+        """
+        candidates = [queue[0] for queue in queues.values() if queue and queue[0].task.task_id not in running]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (-e.priority, last_served.get(e.task.client_id, 0), e.seq))
+
+    def _dispatch(self):
+        while len(self._running) < self.max_running:
+            entry = self._pick_next(self._queues, self._last_served, self._running)
+            if entry is None:
+                return
+            client_id = entry.task.client_id
+            self._queues[client_id].popleft()
+            if not self._queues[client_id]:
+                del self._queues[client_id]
+            if entry.task.is_finished():
+                # 排队期间已被取消
+                continue
+            self._last_served[client_id] = next(self._served)
+            entry.task.queue_position = None
+            entry.task.estimated_start = None
+            logger.info(f"Starting task {entry.task.task_id} for client {client_id} "
+                        f"after {time.monotonic() - entry.enqueued_at:.1f}s in queue")
+            self._running_started[entry.task.task_id] = time.monotonic()
+            # _dispatch 可能在上一次执行的 finally 或请求处理中调用，新任务在空白上下文中创建，
+            # 避免继承调用方的 contextvars（追踪属性、token 统计等）
+            self._running[entry.task.task_id] = contextvars.Context().run(
+                asyncio.create_task, self._execute(entry))
+
+    async def _execute(self, entry: _QueuedRun):
+        task_id = entry.task.task_id
+        try:
+            await entry.run()
+        except asyncio.CancelledError:
+            requested = self._cancel_requested.pop(task_id, None)
+            if requested is None:
+                raise
+            logger.info(f"Task {task_id} cancelled, resources released in {time.monotonic() - requested:.2f}s")
+        except Exception as e:
+            logger.error(f"Scheduled task {task_id} raised: {e}")
+        finally:
+            duration = time.monotonic() - self._running_started.pop(task_id)
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * duration
+            self._running.pop(task_id, None)
+            self._dispatch()
+            await self._publish_queue_positions()
+
+    async def _publish_queue_positions(self):
+        """按调度顺序模拟出队，计算每个排队任务的位置和预计开始时间，有变化时通知前端"""
+        queues = {client_id: deque(queue) for client_id, queue in self._queues.items()}
+        last_served = dict(self._last_served)
+        served = max(last_served.values(), default=0)
+        order: List[_QueuedRun] = []
+        while True:
+            entry = self._pick_next(queues, last_served)
+            if entry is None:
+                break
+            queues[entry.task.client_id].popleft()
+            served += 1
+            last_served[entry.task.client_id] = served
+            order.append(entry)
+
+        now = datetime.now()
+        free_slots = max(0, self.max_running - len(self._running))
+        for position, entry in enumerate(order, start=1):
+            # 前面还有 position - 1 个任务，每轮最多同时执行 max_running 个
+            waves = math.ceil(max(0, position - free_slots) / self.max_running)
+            estimated_start = now + timedelta(seconds=waves * self._avg_run_seconds)
+            task = entry.task
+            changed = task.queue_position != position
+            task.queue_position = position
+            task.estimated_start = estimated_start
+            if changed:
+                await self.task_manager.publish_task_update(task, TaskEvent.PROGRESS.value)
@@ -1,8 +1,12 @@
 from enum import Enum
 from typing import Optional, List, Dict, Any
 from datetime import datetime
+import itertools
 import uuid
 
+# 全局递增的版本号，对象被替换（如 task.progress = ...）后版本号也不会重复
+_versions = itertools.count(1)
+
 class TaskState(Enum):
     PENDING = "pending"
     RUNNING = "running"
@@ -25,16 +29,34 @@ class TaskEvent(Enum):
     FAIL = "fail"
     PROGRESS = "progress"
 
-class SearchProgress:
+class _Versioned:
+    """公开属性被赋值时更新版本号，用于缓存 to_dict() 的结果"""
+    _version: int = 0
+
+    def __setattr__(self, name: str, value: Any):
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            object.__setattr__(self, "_version", next(_versions))
+
+    def touch(self):
+        """嵌套字典、列表被原地修改后调用，标记为已变化"""
+        object.__setattr__(self, "_version", next(_versions))
+
+class SearchProgress(_Versioned):
     def __init__(self):
         self.current_keyword: str = ""
         self.keywords_total: int = 0
         self.keywords_completed: int = 0
         self.notes_total: int = 0
         self.notes_processed: int = 0
+        self.notes_skipped: int = 0  # 相关性分流中跳过的笔记
+        self.notes_downgraded: int = 0  # 相关性分流中降级的笔记
         self.comments_total: int = 0
         self.comments_processed: int = 0
         self.percentage: float = 0.0
+        self.tokens_used: int = 0  # 任务累计消耗的模型 token（无人值守模式统计）
+        # 无人值守模式下每个关键词的进度 keyword -> {state, notes_total, notes_processed}
+        self.keyword_states: Dict[str, Dict[str, Any]] = {}
         
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -43,12 +65,35 @@ class SearchProgress:
             "keywords_completed": self.keywords_completed,
             "notes_total": self.notes_total,
             "notes_processed": self.notes_processed,
+            "notes_skipped": self.notes_skipped,
+            "notes_downgraded": self.notes_downgraded,
             "comments_total": self.comments_total,
             "comments_processed": self.comments_processed,
-            "percentage": self.percentage
+            "percentage": self.percentage,
+            "tokens_used": self.tokens_used,
+            # 复制一份，原地修改后与已推送的快照比较时能发现变化
+            "keyword_states": {keyword: dict(state) for keyword, state in self.keyword_states.items()}
         }
 
-class SearchTask:
+    def update_keyword_state(self, keyword: str, **fields) -> Dict[str, Any]:
+        """更新单个关键词的进度，不存在时创建"""
+        state = self.keyword_states.setdefault(keyword, {"state": "searching", "notes_total": 0, "notes_processed": 0})
+        state.update(fields)
+        self.touch()
+        return state
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SearchProgress':
+        progress = cls()
+        for key, value in data.items():
+            if hasattr(progress, key):
+                setattr(progress, key, value)
+        return progress
+
+class SearchTask(_Versioned):
+    # 保留的状态变化记录条数，避免长时间运行的任务历史无限增长
+    max_state_history: int = 50
+
     def __init__(self, keywords: str, client_id: str):
         self.task_id: str = str(uuid.uuid4())
         self.keywords: str = keywords
@@ -68,6 +113,16 @@ class SearchTask:
         
         # 用于存储需要用户处理的数据
         self.user_input_required: Optional[Dict[str, Any]] = None
+
+        # 在调度器中排队时的位置（从 1 开始）和预计开始时间，不在排队时为 None
+        self.queue_position: Optional[int] = None
+        self.estimated_start: Optional[datetime] = None
+
+        # to_dict() 的缓存，以及推送给前端的最近一次快照和序号
+        self._dict_cache: Optional[Dict[str, Any]] = None
+        self._dict_cache_key: Optional[tuple] = None
+        self._published: Optional[Dict[str, Any]] = None
+        self._update_seq: int = 0
         
     def update_state(self, new_state: TaskState, event: TaskEvent, message: Optional[str] = None):
         """更新任务状态并记录历史"""
@@ -82,12 +137,22 @@ class SearchTask:
             "message": message
         }
         self.state_history.append(state_change)
+        if len(self.state_history) > self.max_state_history:
+            del self.state_history[:-self.max_state_history]
         
         if new_state in [TaskState.COMPLETED, TaskState.FAILED, TaskState.CANCELLED]:
             self.end_time = datetime.now()
             
     def to_dict(self) -> Dict[str, Any]:
-        """转换为可序列化的字典格式"""
+        """转换为可序列化的字典格式，任务没有变化时返回缓存的结果（调用方不应修改返回值）"""
+        # 结果和状态历史是原地追加的列表，长度也作为缓存键的一部分
+        key = (self._version, self.progress._version, len(self.results), len(self.state_history))
+        if key != self._dict_cache_key:
+            self._dict_cache = self._build_dict()
+            self._dict_cache_key = key
+        return self._dict_cache
+
+    def _build_dict(self) -> Dict[str, Any]:
         return {
             "task_id": self.task_id,
             "keywords": self.keywords,
@@ -99,5 +164,124 @@ class SearchTask:
             "error": self.error,
             "results_count": len(self.results),
             "user_input_required": self.user_input_required,
-            "last_message": self.state_history[-1]["message"] if self.state_history else None
-        }
\ No newline at end of file
+            "last_message": self.state_history[-1]["message"] if self.state_history else None,
+            "queue_position": self.queue_position,
+            "estimated_start": self.estimated_start.isoformat() if self.estimated_start else None
+        }
+
+    def is_finished(self) -> bool:
+        return self.state in [TaskState.COMPLETED, TaskState.FAILED, TaskState.CANCELLED]
+
+    def build_update(self, action: str) -> Optional[Dict[str, Any]]:
+        """生成推送给前端的任务更新
+
+        首次推送发送完整快照（task），之后只发送与上次推送相比变化的字段（patch），
+        base_seq 为该 patch 所基于的序号。没有变化时返回 None。
+        """
+        current = self.to_dict()
+        previous = self._published
+        if previous is not None:
+            patch = diff_task_dicts(previous, current)
+            if not patch:
+                return None
+        self._published = current
+        self._update_seq += 1
+        message = {"type": "search_task_update", "action": action, "task_id": self.task_id, "seq": self._update_seq}
+        if previous is None:
+            message["task"] = current
+        else:
+            message["base_seq"] = self._update_seq - 1
+            message["patch"] = patch
+        return message
+
+    def build_snapshot(self, action: str = "snapshot") -> Dict[str, Any]:
+        """生成最近一次推送的完整快照，用于客户端订阅或序号不连续时重新同步，不改变推送序号
+
+        应先用 build_update 推送尚未推送的变化，快照的内容才与 seq 对应。
+        """
+        if self._published is None:
+            self._published = self.to_dict()
+        return {"type": "search_task_update", "action": action, "task_id": self.task_id,
+                "seq": self._update_seq, "task": self._published}
+
+    def to_storage_dict(self) -> Dict[str, Any]:
+        """转换为包含全部结果和上下文的持久化格式"""
+        return {
+            "task_id": self.task_id,
+            "keywords": self.keywords,
+            "client_id": self.client_id,
+            "state": self.state.value,
+            "start_time": self.start_time.isoformat(),
+            "end_time": self.end_time.isoformat() if self.end_time else None,
+            "error": self.error,
+            "results": self.results,
+            "progress": self.progress.to_dict(),
+            "context": self.context,
+            "state_history": [
+                {
+                    "timestamp": change["timestamp"].isoformat(),
+                    "from_state": change["from_state"].value,
+                    "to_state": change["to_state"].value,
+                    "event": change["event"].value,
+                    "message": change["message"]
+                }
+                for change in self.state_history
+            ],
+            "user_input_required": self.user_input_required
+        }
+
+    @classmethod
+    def from_storage_dict(cls, data: Dict[str, Any]) -> 'SearchTask':
+        """从持久化格式恢复任务"""
+        task = cls(data["keywords"], data["client_id"])
+        task.task_id = data["task_id"]
+        task.state = TaskState(data["state"])
+        task.start_time = datetime.fromisoformat(data["start_time"])
+        task.end_time = datetime.fromisoformat(data["end_time"]) if data.get("end_time") else None
+        task.error = data.get("error")
+        task.results = data.get("results", [])
+        task.progress = SearchProgress.from_dict(data.get("progress", {}))
+        task.context = data.get("context", {})
+        task.state_history = [
+            {
+                "timestamp": datetime.fromisoformat(change["timestamp"]),
+                "from_state": TaskState(change["from_state"]),
+                "to_state": TaskState(change["to_state"]),
+                "event": TaskEvent(change["event"]),
+                "message": change.get("message")
+            }
+            for change in data.get("state_history", [])
+        ]
+        task.user_input_required = data.get("user_input_required")
+        return task
+
+def diff_task_dicts(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """比较两个 to_dict() 结果，返回变化的字段，progress 只包含其中变化的字段"""
+    patch = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if key == "progress" and isinstance(old, dict):
+            changed = {k: v for k, v in value.items() if old.get(k) != v}
+            if changed:
+                patch[key] = changed
+        elif old != value:
+            patch[key] = value
+    return patch
+
+def apply_task_patch(task: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """把 patch 应用到任务字典上，返回新的字典，不修改参数"""
+    result = {**task, **patch}
+    if "progress" in patch:
+        result["progress"] = {**task.get("progress", {}), **patch["progress"]}
+    return result
+
+def merge_task_updates(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """合并同一任务还没发送的两条更新消息，结果等价于依次应用两条消息"""
+    if "task" in newer:
+        return newer
+    if "task" in older:
+        merged = {k: v for k, v in newer.items() if k not in ("base_seq", "patch")}
+        merged["task"] = apply_task_patch(older["task"], newer["patch"])
+        return merged
+    return {**newer, "base_seq": older["base_seq"], "patch": apply_task_patch(older["patch"], newer["patch"])}
+
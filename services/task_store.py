@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from services.task_state import SearchTask
+
+logger = logging.getLogger(__name__)
+
+class TaskStore:
+    """基于 SQLite 的任务存储
+
+    已结束任务的完整数据（结果、上下文、状态历史）保存在 payload 中，
+    列表展示只读取体积很小的 summary。未结束任务的检查点也保存在这里，用于重启后恢复。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                client_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_client ON tasks (client_id, updated_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def snapshot(task: SearchTask) -> Tuple[str, str, str, str, Dict[str, Any], Dict[str, Any]]:
+        """复制任务当前的数据，需要在事件循环线程中调用
+
+        结果和上下文中的列表、字典只复制一层（任务执行中只会追加或替换其中的元素），
+        复制的开销与元素个数成正比，JSON 序列化留给 encode() 在其他线程中完成。
+        """
+        payload = task.to_storage_dict()
+        payload["results"] = list(task.results)
+        payload["context"] = {
+            key: list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value
+            for key, value in task.context.items()
+        }
+        if task.user_input_required is not None:
+            payload["user_input_required"] = dict(task.user_input_required)
+        return task.task_id, task.client_id, task.state.value, datetime.now().isoformat(), task.to_dict(), payload
+
+    @staticmethod
+    def encode(snapshot: Tuple[str, str, str, str, Dict[str, Any], Dict[str, Any]]) -> Tuple[str, str, str, str, str, str]:
+        """把 snapshot() 的结果序列化为一行数据，可以在任意线程中调用"""
+        task_id, client_id, state, updated_at, summary, payload = snapshot
+        return (task_id, client_id, state, updated_at, json.dumps(summary, ensure_ascii=False),
+                json.dumps(payload, ensure_ascii=False, default=str))
+
+    @classmethod
+    def serialize(cls, task: SearchTask) -> Tuple[str, str, str, str, str, str]:
+        """序列化为一行数据。任务仍在执行时需要在事件循环线程中调用，避免序列化过程中数据被修改"""
+        return cls.encode(cls.snapshot(task))
+
+    def write(self, row: Tuple[str, str, str, str, str, str]):
+        """写入 serialize() 生成的一行数据，已存在时覆盖"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, client_id, state, updated_at, summary, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                row
+            )
+            self._conn.commit()
+
+    def write_snapshot(self, snapshot: Tuple[str, str, str, str, Dict[str, Any], Dict[str, Any]]):
+        """序列化并写入 snapshot() 的结果，用于在其他线程中完成序列化和写入"""
+        self.write(self.encode(snapshot))
+
+    def save(self, task: SearchTask):
+        """保存任务的完整数据，已存在时覆盖"""
+        self.write(self.serialize(task))
+
+    def load(self, task_id: str) -> Optional[SearchTask]:
+        """加载任务的完整数据"""
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if not row:
+            return None
+        return SearchTask.from_storage_dict(json.loads(row[0]))
+
+    def list_unfinished(self) -> List[SearchTask]:
+        """加载所有未结束的任务（进程退出时仍在执行或等待中的任务）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM tasks WHERE state NOT IN ('completed', 'failed', 'cancelled') ORDER BY updated_at"
+            ).fetchall()
+        return [SearchTask.from_storage_dict(json.loads(row[0])) for row in rows]
+
+    def list_summaries(self, client_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """按更新时间倒序返回客户端任务的摘要"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT summary FROM tasks WHERE client_id = ? ORDER BY updated_at DESC LIMIT ?",
+                (client_id, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, task_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+            self._conn.commit()
+
+    def purge_older_than(self, days: float) -> int:
+        """删除超过保留期限的任务，返回删除数量"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM tasks WHERE updated_at < ?", (cutoff,))
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} tasks older than {days} days from {self.path}")
+        return cursor.rowcount
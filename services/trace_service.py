@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from config.config_manager import config
+
+logger = logging.getLogger(__name__)
+
+# 当前的父 span 和需要附加到所有 span 上的属性（如 task_id），随 asyncio 任务的上下文向下传递
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar('current_span', default=None)
+_trace_attrs: ContextVar[Dict[str, Any]] = ContextVar('trace_attrs', default={})
+
+class TraceService:
+    """按阶段记录耗时的 span，导出到 JSONL 文件，并在内存中保留最近任务的 span 用于瀑布图
+
+    span 之间通过 contextvars 形成父子关系，asyncio.create_task 创建的子任务会继承创建时的父 span
+    和 task_id 等属性。文件超过 max_bytes 后轮转，读写都在单独的线程中按提交顺序进行，不阻塞事件循环。
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(TraceService, cls).__new__(cls)
+            cls._instance._setup()
+        return cls._instance
+
+    def _setup(self):
+        self.enabled = config.get('trace.enabled', False)
+        self.path = config.get('trace.path', 'logs/trace.jsonl')
+        self.max_bytes = config.get('trace.max_bytes', 50 * 1024 * 1024)
+        self.backup_count = config.get('trace.backup_count', 3)
+        self.max_tasks = config.get('trace.max_tasks', 100)
+        self.max_spans_per_task = config.get('trace.max_spans_per_task', 5000)
+        self.flush_size = config.get('trace.flush_size', 100)
+        self.flush_interval = config.get('trace.flush_interval', 2.0)
+        self._task_spans: 'OrderedDict[str, List[Dict[str, Any]]]' = OrderedDict()
+        self._buffer: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-io")
+
+    def record(self, span: Dict[str, Any]):
+        task_id = span.get("task_id")
+        if task_id:
+            spans = self._task_spans.get(task_id)
+            if spans is None:
+                spans = self._task_spans[task_id] = []
+                while len(self._task_spans) > self.max_tasks:
+                    self._task_spans.popitem(last=False)
+            if len(spans) < self.max_spans_per_task:
+                spans.append(span)
+        if self.path:
+            self._buffer.append(span)
+            if len(self._buffer) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """把缓冲的 span 交给写入线程追加到 JSONL 文件，不等待写入完成"""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        spans, self._buffer = self._buffer, []
+        self._io.submit(self._write, spans)
+
+    def _write(self, spans: List[Dict[str, Any]]):
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._rotate()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for span in spans:
+                    f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing trace spans to {self.path}: {e}")
+
+    def _rotate(self):
+        """文件超过 max_bytes 时依次改名为 .1、.2 ...，最多保留 backup_count 个旧文件，max_bytes 为 0 时不轮转"""
+        if not self.max_bytes or not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes:
+            return
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def get_spans(self, task_id: str) -> List[Dict[str, Any]]:
+        """获取任务的全部 span，内存中没有时在写入线程中从 JSONL 文件（包括轮转的旧文件）中查找"""
+        if task_id in self._task_spans:
+            return list(self._task_spans[task_id])
+        if not self.path:
+            return []
+        self.flush()
+        # 与写入使用同一个线程，之前提交的写入完成后才开始读取
+        return await asyncio.get_running_loop().run_in_executor(self._io, self._read, task_id)
+
+    def _read(self, task_id: str) -> List[Dict[str, Any]]:
+        spans = []
+        paths = [f"{self.path}.{i}" for i in range(self.backup_count, 0, -1)] + [self.path]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if task_id in line:
+                        span = json.loads(line)
+                        if span.get("task_id") == task_id:
+                            spans.append(span)
+        return spans
+
+    async def waterfall(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """生成任务的瀑布图数据：按开始时间排序的 span（相对任务开始的偏移和层级）和各阶段的耗时汇总"""
+        spans = sorted(await self.get_spans(task_id), key=lambda s: s["start"])
+        if not spans:
+            return None
+        origin = spans[0]["start"]
+        end = max(s["start"] + s["duration_ms"] / 1000 for s in spans)
+        by_id = {s["span_id"]: s for s in spans}
+
+        def depth(span):
+            level, parent = 0, by_id.get(span.get("parent_id"))
+            while parent:
+                level += 1
+                parent = by_id.get(parent.get("parent_id"))
+            return level
+
+        stages: Dict[str, Dict[str, float]] = {}
+        for s in spans:
+            stage = stages.setdefault(s["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stage["count"] += 1
+            stage["total_ms"] = round(stage["total_ms"] + s["duration_ms"], 1)
+            stage["max_ms"] = max(stage["max_ms"], s["duration_ms"])
+
+        return {
+            "task_id": task_id,
+            "total_ms": round((end - origin) * 1000, 1),
+            "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["total_ms"])),
+            "spans": [
+                {
+                    "name": s["name"],
+                    "offset_ms": round((s["start"] - origin) * 1000, 1),
+                    "duration_ms": s["duration_ms"],
+                    "depth": depth(s),
+                    "status": s.get("status"),
+                    "attrs": s.get("attrs", {})
+                }
+                for s in spans
+            ]
+        }
+
+def bind_trace(**attrs):
+    """为当前上下文及之后创建的子任务设置附加到所有 span 上的属性，如 task_id"""
+    _trace_attrs.set({**_trace_attrs.get(), **attrs})
+
+def current_task_id() -> Optional[str]:
+    """当前上下文绑定的 task_id，用于在其他任务中记录属于该任务的 span"""
+    return _trace_attrs.get().get("task_id")
+
+def _new_span(name: str, attrs: Dict[str, Any]) -> Dict[str, Any]:
+    context = _trace_attrs.get()
+    parent = _current_span.get()
+    # attrs 中的 task_id 优先，用于在其他上下文中代为记录（如 WebSocket 发送任务）
+    task_id = attrs.pop("task_id", None) or context.get("task_id")
+    return {
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "task_id": task_id,
+        "name": name,
+        "start": time.time(),
+        "attrs": {**{k: v for k, v in context.items() if k != "task_id"}, **attrs}
+    }
+
+@contextmanager
+def span(name: str, **attrs):
+    """记录一个阶段的耗时，可在同步和异步代码中使用 with span(...)，返回的字典可以补充属性
+
+    Args:
+        name: 阶段名称，如 browser.open_note.navigate
+        attrs: 附加属性，如 note_id、model
+    """
+    tracer = TraceService()
+    if not tracer.enabled:
+        yield {}
+        return
+    record = _new_span(name, attrs)
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield record["attrs"]
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except Exception as e:
+        status = "error"
+        record["attrs"]["error"] = str(e)[:200]
+        raise
+    finally:
+        _current_span.reset(token)
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        record["status"] = status
+        tracer.record(record)
+
+def record_span(name: str, start: float, status: str = "ok", **attrs):
+    """记录一个已经结束的阶段，用于不能用 with 包住的场景（如异步生成器中跨 yield 的流式请求）
+
+    Args:
+        start: 开始时的 time.perf_counter()
+    """
+    tracer = TraceService()
+    if not tracer.enabled:
+        return
+    record = _new_span(name, attrs)
+    duration = time.perf_counter() - start
+    record["start"] -= duration
+    record["duration_ms"] = round(duration * 1000, 2)
+    record["status"] = status
+    tracer.record(record)
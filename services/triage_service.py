@@ -0,0 +1,161 @@
+import json
+import logging
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+from config.config_manager import config
+from models.ai_models import Message, MessageRole
+from services.ai_service import AIService
+from services.structured_output_service import StructuredOutputService
+from tools.json_tools import extract_first_number
+
+logger = logging.getLogger(__name__)
+
+class TriageDecision:
+    ANALYZE = "analyze"      # 正常打开并完整分析
+    DOWNGRADE = "downgrade"  # 排到批次末尾，走合并分析
+    SKIP = "skip"            # 不打开笔记
+
+class NoteTriageService:
+    """在打开笔记前，根据搜索结果字段（标题、类型、点赞数、作者）评估笔记相关性
+
+    先用本地打分器快速评分，分数不够明确的笔记再交给便宜的小模型统一打分一次；
+    没有配置 task.triage.model 时只用本地打分，不跳过笔记。
+    """
+
+    def __init__(self, ai_service: AIService):
+        self.ai_service = ai_service
+        self.structured_output = StructuredOutputService(ai_service)
+        self.enabled = config.get('task.triage.enabled', True)
+        # 低于 skip_score 跳过（仅模型打分时），低于 keep_score 降级
+        self.skip_score = config.get('task.triage.skip_score', 20)
+        self.keep_score = config.get('task.triage.keep_score', 50)
+        # 只在配置了便宜的小模型时做模型复核，不用主模型逐批复核
+        self.model = config.get('task.triage.model')
+        self.use_model = config.get('task.triage.use_model', True) and bool(self.model)
+
+    @staticmethod
+    def _parse_count(value) -> int:
+        """解析小红书的计数字段，如 "1.2万"、"10+"、"3k" """
+        if value is None:
+            return 0
+        text = str(value).strip().lower()
+        match = re.search(r'\d+(\.\d+)?', text)
+        if not match:
+            return 0
+        number = float(match.group())
+        if '万' in text or 'w' in text:
+            number *= 10000
+        elif 'k' in text:
+            number *= 1000
+        return int(number)
+
+    @staticmethod
+    def _ngrams(text: str) -> set:
+        """按字符二元组切分，单字词直接返回该字"""
+        text = re.sub(r'\s+', '', text.lower())
+        if len(text) <= 1:
+            return {text} if text else set()
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def local_score(self, query_terms: List[str], note: Dict) -> float:
+        """本地相关性打分 0-100：标题与查询词的字符重合度占 80 分，点赞热度占 20 分"""
+        title_grams = self._ngrams(note.get("title") or "")
+        overlap = 0.0
+        for term in query_terms:
+            term_grams = self._ngrams(term)
+            if term_grams and title_grams:
+                overlap = max(overlap, len(term_grams & title_grams) / len(term_grams))
+
+        # 点赞数按对数计分，10 万赞左右拿满
+        liked = self._parse_count(note.get("liked_count"))
+        popularity = min(1.0, math.log10(liked + 1) / 5)
+
+        return round(overlap * 80 + popularity * 20, 1)
+
+    async def _model_scores(self, query: str, notes: List[Dict]) -> Dict[str, int]:
+        """用小模型一次性给多篇笔记打相关性分，失败时返回空字典"""
+        candidates = [
+            {
+                "id": note.get("id"),
+                "title": note.get("title") or "",
+                "type": note.get("type") or "",
+                "liked_count": note.get("liked_count") or "0",
+                "nickname": note.get("nickname") or ""
+            }
+            for note in notes
+        ]
+        prompt = f"""用户的搜索主题是「{query}」。请判断以下小红书搜索结果与该主题的相关程度，只依据标题、类型、点赞数和作者昵称。
+
+搜索结果:
+{json.dumps(candidates, ensure_ascii=False, indent=2)}
+
+直接返回JSON格式(不要添加任何其他标记):
+{{
+    "scores": {{
+        "笔记id": "相关度 0-100"
+    }}
+}}"""
+        messages = [
+            Message(role=MessageRole.system, content="你是一个搜索结果相关性评估专家，只输出JSON。"),
+            Message(role=MessageRole.user, content=prompt)
+        ]
+        try:
+            logger.debug(f"start triage model scoring for {len(notes)} notes")
+            result = await self.structured_output.generate_json(messages, "triage", model=self.model)
+            if not result or not isinstance(result.get("scores"), dict):
+                logger.warning("Failed to get triage scores")
+                return {}
+            return {str(k): extract_first_number(str(v)) for k, v in result["scores"].items()}
+        except Exception as e:
+            logger.error(f"Error in triage model scoring: {e}")
+            return {}
+
+    async def triage(self, query: str, keyword: str, notes: List[Dict]) -> List[Tuple[Dict, str]]:
+        """评估一批笔记的相关性
+
+        Args:
+            query: 用户原始搜索主题
+            keyword: 当前批次的搜索关键词
+            notes: search_xiaohongshu 返回的笔记列表
+
+        Returns:
+            [(note, decision)]，需要分析的笔记在前，降级的笔记在后，跳过的笔记排在最后
+        """
+        if not self.enabled or not notes:
+            return [(note, TriageDecision.ANALYZE) for note in notes]
+
+        query_terms = [t for t in re.split(r'[\s,;，、；]+', f"{query} {keyword}") if t]
+        scores = {id(note): self.local_score(query_terms, note) for note in notes}
+
+        # 本地分数不够明确的笔记交给小模型复核
+        uncertain = [note for note in notes if scores[id(note)] < self.keep_score]
+        model_scores: Optional[Dict[str, int]] = None
+        if uncertain and self.use_model:
+            model_scores = await self._model_scores(query, uncertain)
+
+        decisions = []
+        for note in notes:
+            score = scores[id(note)]
+            if score >= self.keep_score:
+                decision = TriageDecision.ANALYZE
+            elif model_scores and str(note.get("id")) in model_scores:
+                model_score = model_scores[str(note.get("id"))]
+                if model_score < self.skip_score:
+                    decision = TriageDecision.SKIP
+                elif model_score < self.keep_score:
+                    decision = TriageDecision.DOWNGRADE
+                else:
+                    decision = TriageDecision.ANALYZE
+            else:
+                # 仅有本地分数时不直接跳过，本地打分器无法识别同义表达
+                decision = TriageDecision.DOWNGRADE if score < self.skip_score else TriageDecision.ANALYZE
+            logger.debug(f"Triage note {note.get('id')} - {note.get('title')}: local score {score}, decision {decision}")
+            decisions.append((note, decision))
+
+        order = {TriageDecision.ANALYZE: 0, TriageDecision.DOWNGRADE: 1, TriageDecision.SKIP: 2}
+        decisions.sort(key=lambda item: order[item[1]])
+        logger.info(f"Triage for {keyword}: " + ", ".join(
+            f"{d}={sum(1 for _, x in decisions if x == d)}" for d in order
+        ))
+        return decisions
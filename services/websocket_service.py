@@ -1,37 +1,483 @@
+import asyncio
+import bisect
+import json
 import logging
-from typing import Dict
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Type
 from fastapi import WebSocket
+from pydantic import BaseModel, ValidationError
+from config.config_manager import config
+from services.task_state import merge_task_updates
+from services.trace_service import current_task_id, span
 logger = logging.getLogger(__name__)
 
+try:
+    import msgpack
+except ImportError:
+    # 可选依赖，未安装时所有消息都以 JSON 文本发送
+    msgpack = None
+
+class _Frame:
+    """一条待发送的消息，序列化结果在第一次发送时生成，订阅同一客户端的所有连接共用"""
+    __slots__ = ("message", "key", "task_id", "_text", "_binary")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.key = _coalesce_key(message)
+        self.task_id = message.get("task_id")
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            # 与 WebSocket.send_json 的序列化方式相同
+            self._text = json.dumps(self.message, separators=(",", ":"), ensure_ascii=False)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(self.message, use_bin_type=True)
+        return self._binary
+
+class _Outgoing:
+    __slots__ = ("frame", "enqueued_at")
+
+    def __init__(self, frame: _Frame):
+        self.frame = frame
+        self.enqueued_at = time.monotonic()
+
+class _Outbox:
+    """单个连接的发送队列和发送任务
+
+    生产者只把消息放入队列，不等待网络；队列中同一任务的 search_task_update 合并为一条，
+    连续的聊天分片合并，每 chat_flush_interval 秒最多发送一次或攒够 chat_flush_chars 个字符时发送。
+    合并只替换本连接队列中的消息，不影响其他连接共用的 _Frame。
+    队列超过上限说明该连接接收太慢，只断开该连接。task_id 不为空时只接收该任务的消息。
+    binary 为 True 时（客户端声明支持 MessagePack）大消息以二进制帧发送。
+    """
+
+    def __init__(self, service: 'WebsocketService', client_id: str, websocket: WebSocket,
+                 task_id: Optional[str] = None, binary: bool = False):
+        self.service = service
+        self.client_id = client_id
+        self.websocket = websocket
+        self.task_id = task_id
+        self.binary = binary
+        self.queue: Deque[_Outgoing] = deque()
+        self._pending_keys: Dict[tuple, _Outgoing] = {}
+        self._wakeup = asyncio.Event()
+        self._last_chat_sent = 0.0
+        self._sender = asyncio.create_task(self._run())
+
+    def accepts(self, frame: _Frame) -> bool:
+        return self.task_id is None or frame.task_id == self.task_id or frame.message.get("type") == "resume"
+
+    def put(self, frame: _Frame) -> bool:
+        """放入队列，返回 False 表示队列已满"""
+        pending = self._pending_keys.get(frame.key) if frame.key else None
+        if pending is not None:
+            # 同一任务还没发送的状态更新合并为一条并移到队尾：合并后的消息带最新的 msg_seq，
+            # 留在原位置会先于序号更小的消息发出，客户端会把那些消息当作重复的丢弃
+            if self.queue[-1] is not pending:
+                self.queue.remove(pending)
+                self.queue.append(pending)
+            pending.frame = _Frame(merge_task_updates(pending.frame.message, frame.message))
+            self._wakeup.set()
+            return True
+        if frame.key is None and self._merge_chat_chunk(frame):
+            return True
+        if len(self.queue) >= self.service.max_queue:
+            return False
+        item = _Outgoing(frame)
+        self.queue.append(item)
+        if frame.key:
+            self._pending_keys[frame.key] = item
+        self._wakeup.set()
+        return True
+
+    def _merge_chat_chunk(self, frame: _Frame) -> bool:
+        """连续的聊天分片合并到队尾还没发送的分片中"""
+        message = frame.message
+        if not _is_chat_chunk(message) or not self.queue:
+            return False
+        last = self.queue[-1].frame.message
+        if not _is_chat_chunk(last) or len(last["content"]) >= self.service.chat_flush_chars:
+            return False
+        # 合并后的消息使用最新分片的 msg_seq，表示到它为止的内容都已包含
+        merged = {**message, "content": last["content"] + message["content"]}
+        self.queue[-1].frame = _Frame(merged)
+        if len(merged["content"]) >= self.service.chat_flush_chars:
+            self._wakeup.set()
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                head = self.queue[0]
+                if _is_chat_chunk(head.frame.message) and len(self.queue) == 1:
+                    # 距上一个聊天分片不到 chat_flush_interval 时等待，与后续分片合并后再发送，
+                    # 回复的第一个分片立即发送
+                    delay = self._last_chat_sent + self.service.chat_flush_interval - time.monotonic()
+                    if delay > 0 and len(head.frame.message["content"]) < self.service.chat_flush_chars:
+                        self._wakeup.clear()
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), delay)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                self.queue.popleft()
+                frame = head.frame
+                if frame.key:
+                    self._pending_keys.pop(frame.key, None)
+                message = frame.message
+                binary = self.binary and len(frame.text) >= self.service.binary_min_size
+                with span("ws.send", task_id=frame.task_id, client_id=self.client_id, type=message.get("type"),
+                          action=message.get("action"), binary=binary,
+                          queued_ms=round((time.monotonic() - head.enqueued_at) * 1000, 2)):
+                    if binary:
+                        await self.websocket.send_bytes(frame.binary)
+                    else:
+                        await self.websocket.send_text(frame.text)
+                if _is_chat_chunk(message):
+                    self._last_chat_sent = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message to client {self.client_id}: {e}")
+            self.service._drop(self)
+
+    def close(self):
+        self._sender.cancel()
+
+class _ReplayEntry:
+    __slots__ = ("seq", "message", "chunk_ends")
+
+    def __init__(self, seq: int, message: dict):
+        self.seq = seq
+        self.message = message
+        # 合并的聊天分片：[(msg_seq, 该分片结束时的内容长度)]，用于从中间位置补发
+        self.chunk_ends: Optional[List[Tuple[int, int]]] = [(seq, len(message["content"]))] if _is_chat_chunk(message) else None
+
+    def since(self, last_seq: int) -> dict:
+        """客户端已收到 last_seq 时还需要补发的内容"""
+        if self.chunk_ends is None or last_seq < self.chunk_ends[0][0]:
+            return self.message
+        index = bisect.bisect_right(self.chunk_ends, (last_seq, float("inf"))) - 1
+        return {**self.message, "content": self.message["content"][self.chunk_ends[index][1]:]}
+
+class _ReplayBuffer:
+    """单个客户端最近发出的消息，带连续的序号（msg_seq），断线重连后补发客户端没收到的部分
+
+    连续的聊天分片合并为一条保存。epoch 在缓冲区创建时生成，服务重启或缓冲区过期后变化，
+    客户端据此判断序号是否还能接上。
+    """
+
+    def __init__(self, max_messages: int):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.entries: Deque[_ReplayEntry] = deque(maxlen=max_messages)
+        self.last_seq = 0
+        self.disconnected_at: Optional[float] = time.monotonic()
+
+    def add(self, message: dict) -> dict:
+        """分配序号并保存，返回带 msg_seq 的消息"""
+        self.last_seq += 1
+        message = {**message, "msg_seq": self.last_seq}
+        last = self.entries[-1] if self.entries else None
+        if last is not None and last.chunk_ends is not None and _is_chat_chunk(message):
+            content = last.message["content"] + message["content"]
+            last.message = {**message, "content": content}
+            last.seq = self.last_seq
+            last.chunk_ends.append((self.last_seq, len(content)))
+        else:
+            self.entries.append(_ReplayEntry(self.last_seq, message))
+        return message
+
+    def since(self, last_seq: int) -> Tuple[List[dict], bool]:
+        """last_seq 之后的消息，以及它们是否完整（较早的消息已被淘汰时为 False）"""
+        if not self.entries:
+            return [], True
+        first = self.entries[0]
+        first_seq = first.chunk_ends[0][0] if first.chunk_ends else first.seq
+        complete = last_seq >= first_seq - 1
+        return [entry.since(last_seq) for entry in self.entries if entry.seq > last_seq], complete
+
+class _CommandState:
+    """单个客户端正在执行的命令和最近的应答，重复的请求ID（如重连后重发）直接返回之前的应答"""
+    __slots__ = ("in_flight", "recent_acks")
+
+    def __init__(self):
+        self.in_flight: Dict[str, str] = {}  # 请求ID -> 命令名
+        self.recent_acks: "OrderedDict[str, dict]" = OrderedDict()
+
+def _is_chat_chunk(message: dict) -> bool:
+    return message.get("type") == "chat_response" and message.get("message_type") == "chat"
+
+def _coalesce_key(message: dict) -> Optional[tuple]:
+    """可以与后续消息合并的消息的键：同一任务的状态更新（完整快照或带序号的 patch）"""
+    if message.get("type") == "search_task_update" and "seq" in message:
+        return ("search_task_update", message["task_id"])
+    return None
+
 class WebsocketService:
+    """WebSocket 连接管理：同一个 client_id 可以有多个连接（如电脑和手机同时查看），
+    每条消息只序列化一次，放入每个订阅连接的发送队列"""
     _instance = None
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(WebsocketService, cls).__new__(cls)
-            active_connections: Dict[str, WebSocket] = dict()
-            cls._instance.active_connections = active_connections
+            # client_id -> 订阅该客户端消息的连接（按连接时间排序）
+            cls._instance._outboxes: Dict[str, List[_Outbox]] = {}
+            cls._instance.max_queue = config.get('websocket.outbound.max_queue', 1000)
+            cls._instance.chat_flush_interval = config.get('websocket.outbound.chat_flush_interval', 0.05)
+            cls._instance.chat_flush_chars = config.get('websocket.outbound.chat_flush_chars', 200)
+            cls._instance.max_connections_per_client = config.get('websocket.max_connections_per_client', 8)
+            # 超过 min_size 个字符的消息对声明支持 MessagePack 的连接以二进制帧发送；
+            # 已协商 permessage-deflate 的连接压缩后与 JSON 大小相当，仍发送 JSON 文本
+            cls._instance.binary_enabled = config.get('websocket.binary.enabled', True) and msgpack is not None
+            cls._instance.binary_min_size = config.get('websocket.binary.min_size', 4096)
+            cls._instance._handlers: Dict[str, Callable[[str, Dict[str, Any]], Awaitable[None]]] = {}
+            # 每个客户端的补发缓冲区，断开超过 ttl 秒后丢弃
+            cls._instance._replays: Dict[str, _ReplayBuffer] = {}
+            cls._instance.replay_enabled = config.get('websocket.replay.enabled', True)
+            cls._instance.replay_max_messages = config.get('websocket.replay.max_messages', 500)
+            cls._instance.replay_ttl = config.get('websocket.replay.ttl', 600)
+            cls._instance._last_replay_sweep = time.monotonic()
+            # 客户端通过 WebSocket 发送的命令：命令名 -> (参数模型, 处理函数)
+            cls._instance._commands: Dict[str, Tuple[Type[BaseModel], Callable[[str, BaseModel], Awaitable[dict]]]] = {}
+            cls._instance._command_states: Dict[str, _CommandState] = {}
+            cls._instance.max_commands_in_flight = config.get('websocket.commands.max_in_flight', 4)
+            cls._instance.busy_queue_size = config.get('websocket.commands.busy_queue_size', 200)
+            cls._instance.busy_retry_after = config.get('websocket.commands.retry_after', 1.0)
+            cls._instance.register_handler("command", cls._instance._handle_command)
         return cls._instance
-        
-    async def connect(self, client_id: str, websocket: WebSocket):
+
+    def register_handler(self, message_type: str, handler: Callable[[str, Dict[str, Any]], Awaitable[None]]):
+        """注册客户端发来的某类消息的处理函数 handler(client_id, data)"""
+        self._handlers[message_type] = handler
+
+    async def dispatch(self, client_id: str, data: Dict[str, Any]):
+        """把客户端发来的消息交给对应的处理函数"""
+        handler = self._handlers.get(data.get("type"))
+        if handler is None:
+            logger.debug(f"No handler for message type {data.get('type')} from client {client_id}")
+            return
+        try:
+            await handler(client_id, data)
+        except Exception as e:
+            logger.error(f"Error handling {data.get('type')} message from client {client_id}: {e}")
+
+    def register_command(self, name: str, args_model: Type[BaseModel],
+                         handler: Callable[[str, BaseModel], Awaitable[dict]]):
+        """注册命令，handler(client_id, args) 返回带 status 的结果字典，作为应答的 result"""
+        self._commands[name] = (args_model, handler)
+
+    async def _handle_command(self, client_id: str, data: Dict[str, Any]):
+        """校验命令并在后台执行，接收循环不等待命令完成
+
+        同一客户端同时执行的命令超过 max_in_flight，或发送队列积压超过 busy_queue_size 时
+        （客户端接收跟不上），应答 busy，由客户端稍后重试。
+        """
+        request_id, name = data.get("id"), data.get("command")
+        if not isinstance(request_id, str) or not request_id:
+            logger.warning(f"Command without id from client {client_id}: {name}")
+            return
+        state = self._command_states.setdefault(client_id, _CommandState())
+        if request_id in state.recent_acks:
+            await self.send_message(client_id, {**state.recent_acks[request_id], "duplicate": True})
+            return
+        if request_id in state.in_flight:
+            return
+        if name not in self._commands:
+            await self._ack(client_id, request_id, name, {"status": "error", "message": f"Unknown command: {name}"})
+            return
+        args_model, handler = self._commands[name]
+        try:
+            args = args_model(**(data.get("args") or {}))
+        except (ValidationError, TypeError) as e:
+            await self._ack(client_id, request_id, name, {"status": "error", "message": f"Invalid arguments: {e}"})
+            return
+        if len(state.in_flight) >= self.max_commands_in_flight or self.queue_size(client_id) >= self.busy_queue_size:
+            # busy 应答不缓存，客户端用同一请求ID重试
+            await self.send_message(client_id, {
+                "type": "ack", "id": request_id, "command": name, "status": "busy",
+                "retry_after": self.busy_retry_after,
+                "result": {"status": "error", "message": "请求过于频繁，请稍后重试"}
+            })
+            return
+        state.in_flight[request_id] = name
+        asyncio.create_task(self._run_command(client_id, request_id, name, handler, args))
+
+    async def _run_command(self, client_id: str, request_id: str, name: str,
+                           handler: Callable[[str, BaseModel], Awaitable[dict]], args: BaseModel):
+        try:
+            result = await handler(client_id, args)
+        except Exception as e:
+            logger.error(f"Error executing command {name} from client {client_id}: {e}")
+            result = {"status": "error", "message": str(e)}
+        finally:
+            self._command_states[client_id].in_flight.pop(request_id, None)
+        await self._ack(client_id, request_id, name, result)
+
+    async def _ack(self, client_id: str, request_id: str, name: Optional[str], result: dict):
+        ack = {"type": "ack", "id": request_id, "command": name, "status": result.get("status", "success"),
+               "result": result}
+        recent = self._command_states.setdefault(client_id, _CommandState()).recent_acks
+        recent[request_id] = ack
+        while len(recent) > 100:
+            recent.popitem(last=False)
+        await self.send_message(client_id, ack)
+
+    async def connect(self, client_id: str, websocket: WebSocket, last_seq: Optional[int] = None,
+                      epoch: Optional[str] = None, task_id: Optional[str] = None,
+                      encoding: Optional[str] = None):
+        """建立连接并订阅该客户端的消息，指定 task_id 时只订阅该任务的消息
+
+        重连的客户端带上最后收到的 msg_seq 和 epoch，先补发断线期间的消息。
+        encoding 为 msgpack 且连接没有压缩时大消息以 MessagePack 二进制帧发送，其他客户端仍收到 JSON 文本。
+        """
         await websocket.accept()
-        self.active_connections[client_id] = websocket
-        logging.info(f"Client {client_id} connected. Total connections: {len(self.active_connections)}")
-        
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            logging.info(f"Client {client_id} disconnected. Remaining connections: {len(self.active_connections)}")
-            
-    async def send_message(self, client_id: str, message: dict):
-        """发送消息到指定客户端"""
-        logger.debug(f"Sending message to client {client_id}: {message}")
-        if client_id in self.active_connections:
-            try:
-                await self.active_connections[client_id].send_json(message)
-                logger.debug(f"Message sent successfully to client {client_id}")
-            except Exception as e:
-                logger.error(f"Error sending message to client {client_id}: {e}")
-                self.disconnect(client_id)
+        binary = self.binary_enabled and encoding == "msgpack" and not await self._is_compressed(websocket)
+        outboxes = self._outboxes.setdefault(client_id, [])
+        # 超过单个客户端的连接数上限时断开最早的连接，上限为 0 时不限制
+        while outboxes and 0 < self.max_connections_per_client <= len(outboxes):
+            self._drop(outboxes[0])
+        outbox = _Outbox(self, client_id, websocket, task_id, binary=binary)
+        self._outboxes.setdefault(client_id, []).append(outbox)
+        logging.info(f"Client {client_id} connected{f' to task {task_id}' if task_id else ''}. "
+                     f"Connections of client: {self.connection_count(client_id)}")
+        if self.replay_enabled:
+            self._resume(client_id, outbox, last_seq, epoch)
+
+    @staticmethod
+    async def _is_compressed(websocket: WebSocket) -> bool:
+        """连接是否实际协商了 permessage-deflate
+
+        Starlette 没有公开握手结果，从 uvicorn 的连接对象（receive 绑定的协议对象）读取生效的扩展。
+        客户端提供了扩展不代表协商成功（服务端关闭压缩或参数不兼容），取不到协商结果时
+        （如 wsproto 实现）按未压缩处理，按客户端的要求使用 MessagePack。
+        """
+        protocol = getattr(getattr(websocket, "_receive", None), "__self__", None)
+        if protocol is None:
+            return False
+        handshake = getattr(protocol, "handshake_completed_event", None)
+        if isinstance(handshake, asyncio.Event):
+            # websockets 旧版实现在 accept 之后才完成握手
+            await handshake.wait()
+        for holder in (getattr(protocol, "conn", None), protocol):
+            extensions = getattr(holder, "extensions", None)
+            if isinstance(extensions, list):
+                return any(getattr(extension, "name", None) == "permessage-deflate" for extension in extensions)
+        return False
+
+    def _resume(self, client_id: str, outbox: _Outbox, last_seq: Optional[int], epoch: Optional[str]):
+        """发送 resume 消息，status 为 ok（已补发全部缺失消息）、reset（序号无法接上，客户端需重新加载状态）
+        或 new（首次连接）"""
+        self._sweep_replays()
+        replay = self._replays.get(client_id)
+        if replay is None:
+            replay = self._replays[client_id] = _ReplayBuffer(self.replay_max_messages)
+        replay.disconnected_at = None
+        if last_seq is None:
+            messages, status = [], "new"
+        elif epoch != replay.epoch:
+            # 服务重启或缓冲区已过期，之前的序号没有意义，补发缓冲区中的全部消息
+            messages, status = replay.since(0)[0], "reset"
         else:
-            logger.warning(f"Client {client_id} not found in active connections")
\ No newline at end of file
+            messages, complete = replay.since(last_seq)
+            status = "ok" if complete else "reset"
+        frames = [frame for frame in map(_Frame, messages) if outbox.accepts(frame)]
+        outbox.put(_Frame({"type": "resume", "status": status, "epoch": replay.epoch, "last_seq": replay.last_seq,
+                           "replayed": len(frames)}))
+        for frame in frames:
+            outbox.put(frame)
+        if last_seq is not None:
+            logger.info(f"Client {client_id} resumed from {last_seq}: {status}, replayed {len(frames)} messages")
+
+    def _sweep_replays(self):
+        """丢弃断开超过 ttl 的客户端的补发缓冲区，最多每分钟检查一次"""
+        now = time.monotonic()
+        if now - self._last_replay_sweep < 60:
+            return
+        self._last_replay_sweep = now
+        for client_id, replay in list(self._replays.items()):
+            if replay.disconnected_at is not None and now - replay.disconnected_at > self.replay_ttl:
+                del self._replays[client_id]
+        for client_id in list(self._command_states):
+            state = self._command_states[client_id]
+            if client_id not in self._replays and client_id not in self._outboxes and not state.in_flight:
+                del self._command_states[client_id]
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        """断开该客户端的指定连接，不指定 websocket 时断开该客户端的全部连接"""
+        outboxes = self._outboxes.get(client_id)
+        if not outboxes:
+            return
+        removed = [outbox for outbox in outboxes if websocket is None or outbox.websocket is websocket]
+        if not removed:
+            return
+        for outbox in removed:
+            outboxes.remove(outbox)
+            outbox.close()
+        if not outboxes:
+            del self._outboxes[client_id]
+            replay = self._replays.get(client_id)
+            if replay:
+                replay.disconnected_at = time.monotonic()
+        logging.info(f"Client {client_id} disconnected. Connections of client: {self.connection_count(client_id)}")
+
+    def _drop(self, outbox: _Outbox):
+        """发送失败或接收太慢的连接，关闭并移除，同一客户端的其他连接不受影响"""
+        self.disconnect(outbox.client_id, outbox.websocket)
+        asyncio.create_task(self._close_quietly(outbox.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    async def send_message(self, client_id: str, message: dict):
+        """发送消息到指定客户端的所有连接：放入各连接的发送队列后立即返回，不等待网络
+
+        在任务中发送的消息带上 task_id，供只订阅单个任务的连接过滤。
+        消息同时保存到补发缓冲区，客户端不在线时只保存，重连后补发。
+        """
+        logger.debug(f"Queueing message to client {client_id}: {message}")
+        if "task_id" not in message and current_task_id():
+            message = {**message, "task_id": current_task_id()}
+        if self.replay_enabled:
+            replay = self._replays.get(client_id)
+            if replay is None:
+                self._sweep_replays()
+                replay = self._replays[client_id] = _ReplayBuffer(self.replay_max_messages)
+            message = replay.add(message)
+        outboxes = self._outboxes.get(client_id)
+        if not outboxes:
+            if self.replay_enabled:
+                logger.debug(f"Client {client_id} not connected, message kept for replay")
+            else:
+                logger.warning(f"Client {client_id} not found in active connections")
+            return
+        frame = _Frame(message)
+        for outbox in list(outboxes):
+            if outbox.accepts(frame) and not outbox.put(frame):
+                logger.warning(f"Outbound queue of a connection of client {client_id} is full ({self.max_queue}), "
+                               f"dropping slow connection")
+                self._drop(outbox)
+
+    def connection_count(self, client_id: str) -> int:
+        return len(self._outboxes.get(client_id, []))
+
+    def queue_size(self, client_id: str) -> int:
+        """该客户端各连接中最长的发送队列长度"""
+        return max((len(outbox.queue) for outbox in self._outboxes.get(client_id, [])), default=0)
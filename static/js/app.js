@@ -1,7 +1,7 @@
 // 全局应用状态和初始化
 const App = {
-	// 全局状态
-	clientId: Date.now().toString(),
+	// 全局状态，页面地址带 client_id 参数时（如在手机上打开电脑端的链接）与对应页面接收相同的消息
+	clientId: new URLSearchParams(window.location.search).get('client_id') || Date.now().toString(),
 	ws: null,
 
 	// 初始化应用
@@ -61,18 +61,19 @@ const App = {
 	// 发送消息到服务器
 	async sendMessage(message) {
 		try {
-			const response = await fetch('/ai/chat', {
-				method: 'POST',
-				headers: {
-					'Content-Type': 'application/json',
-				},
-				body: JSON.stringify({
-					message: message,
-					client_id: this.clientId
-				})
+			const data = await WebSocket.command('chat', { message: message }, async () => {
+				const response = await fetch('/ai/chat', {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+					},
+					body: JSON.stringify({
+						message: message,
+						client_id: this.clientId
+					})
+				});
+				return response.json();
 			});
-
-			const data = await response.json();
 			if (data.status === 'error') {
 				Chat.addMessage('ai', 'Error: ' + data.message);
 			}
@@ -41,18 +41,19 @@ const Chat = {
 	// 发送消息到服务器
 	async sendMessage(message) {
 		try {
-			const response = await fetch('/ai/chat', {
-				method: 'POST',
-				headers: {
-					'Content-Type': 'application/json',
-				},
-				body: JSON.stringify({
-					message: message,
-					client_id: App.clientId
-				})
+			const data = await WebSocket.command('chat', { message: message }, async () => {
+				const response = await fetch('/ai/chat', {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+					},
+					body: JSON.stringify({
+						message: message,
+						client_id: App.clientId
+					})
+				});
+				return response.json();
 			});
-
-			const data = await response.json();
 			if (data.status === 'error') {
 				this.addMessage('ai', 'Error: ' + data.message);
 			}
@@ -153,7 +154,14 @@ const Chat = {
 		console.log('Appending to last AI message:', { content, shouldMerge });
 
 		const chatHistory = document.getElementById('chatHistory');
-		const lastMessage = chatHistory.querySelector('.ai-message:last-child');
+		let lastMessage = chatHistory.lastElementChild;
+		// 搜索意图可能在回复输出过程中到达，回复的后续内容追加到卡片之前的 AI 消息
+		if (lastMessage && lastMessage.classList.contains('search-intent-message')) {
+			lastMessage = lastMessage.previousElementSibling;
+		}
+		if (lastMessage && !lastMessage.classList.contains('ai-message')) {
+			lastMessage = null;
+		}
 
 		if (shouldMerge && lastMessage) {
 			const contentDiv = lastMessage.querySelector('.message-content');
@@ -189,7 +197,7 @@ const Chat = {
 	// 处理搜索意图
 	handleSearchIntent(keywords, taskId) {
 		const confirmDiv = document.createElement('div');
-		confirmDiv.className = 'message ai-message';
+		confirmDiv.className = 'message ai-message search-intent-message';
 		confirmDiv.innerHTML = `
             <div class="message-content">
                 <div class="search-interaction">
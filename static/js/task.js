@@ -1,4 +1,7 @@
 const Task = {
+	// 各任务已应用到的更新序号和完整状态 task_id -> {seq, task, resyncing}
+	taskStates: {},
+
 	// 初始化
 	init() {
 		this.loadExistingTasks();
@@ -23,19 +26,17 @@ const Task = {
 		console.log('Starting search for keywords:', normalizedKeywords, 'taskId:', taskId);
 
 		try {
-			const response = await fetch('/ai/start_auto_search', {
-				method: 'POST',
-				headers: {
-					'Content-Type': 'application/json',
-				},
-				body: JSON.stringify({
-					keywords: normalizedKeywords,
-					client_id: App.clientId,
-					task_id: taskId
-				})
+			const args = { keywords: normalizedKeywords, task_id: taskId };
+			const data = await WebSocket.command('start_search', args, async () => {
+				const response = await fetch('/ai/start_auto_search', {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+					},
+					body: JSON.stringify({ ...args, client_id: App.clientId })
+				});
+				return response.json();
 			});
-
-			const data = await response.json();
 			if (data.status === 'success') {
 				Chat.addMessage('ai', '已开始智能搜索任务，我会持续为您分析相关信息...');
 			} else {
@@ -50,18 +51,19 @@ const Task = {
 	// 取消自动搜索
 	async cancelAutoSearch(taskId) {
 		try {
-			const response = await fetch('/ai/cancel_auto_search', {
-				method: 'POST',
-				headers: {
-					'Content-Type': 'application/json',
-				},
-				body: JSON.stringify({
-					task_id: taskId,
-					client_id: App.clientId
-				})
+			const data = await WebSocket.command('cancel_search', { task_id: taskId }, async () => {
+				const response = await fetch('/ai/cancel_auto_search', {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+					},
+					body: JSON.stringify({
+						task_id: taskId,
+						client_id: App.clientId
+					})
+				});
+				return response.json();
 			});
-
-			const data = await response.json();
 			if (data.status === 'error') {
 				Chat.addMessage('ai', '取消任务失败：' + data.message);
 			} else {
@@ -80,21 +82,17 @@ const Task = {
 	// 提交用户输入
 	async submitUserInput(taskId, continueSearch) {
 		try {
-			const response = await fetch('/ai/submit_user_input', {
-				method: 'POST',
-				headers: {
-					'Content-Type': 'application/json',
-				},
-				body: JSON.stringify({
-					task_id: taskId,
-					client_id: App.clientId,
-					input: {
-						continue_search: continueSearch
-					}
-				})
+			const args = { task_id: taskId, input: { continue_search: continueSearch } };
+			const data = await WebSocket.command('user_input', args, async () => {
+				const response = await fetch('/ai/submit_user_input', {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+					},
+					body: JSON.stringify({ ...args, client_id: App.clientId })
+				});
+				return response.json();
 			});
-
-			const data = await response.json();
 			if (data.status === 'success') {
 				// Chat.addMessage('user', `选择：${continueSearch ? '继续搜索' : '查看结果'}`);
 			} else {
@@ -106,6 +104,34 @@ const Task = {
 		}
 	},
 
+	// 处理任务更新：完整快照直接替换，patch 的 base_seq 与当前序号一致时应用，否则请求完整快照
+	handleTaskUpdate(data) {
+		const current = this.taskStates[data.task_id];
+		if (data.task) {
+			if (current && !current.resyncing && data.seq < current.seq) {
+				return;
+			}
+			this.taskStates[data.task_id] = { seq: data.seq, task: data.task, resyncing: false };
+		} else if (current && !current.resyncing && data.base_seq === current.seq) {
+			const task = { ...current.task, ...data.patch };
+			if (data.patch.progress) {
+				task.progress = { ...current.task.progress, ...data.patch.progress };
+			}
+			this.taskStates[data.task_id] = { seq: data.seq, task: task, resyncing: false };
+		} else {
+			if (current && !current.resyncing && data.seq <= current.seq) {
+				return;
+			}
+			// 漏掉了中间的更新（如断线重连），请求完整快照，收到之前忽略后续 patch
+			if (!current || !current.resyncing) {
+				this.taskStates[data.task_id] = { ...(current || { seq: 0, task: null }), resyncing: true };
+				WebSocket.send({ type: 'task_resync', task_id: data.task_id });
+			}
+			return;
+		}
+		this.updateTaskUI(this.taskStates[data.task_id].task);
+	},
+
 	// 更新任务UI
 	updateTaskUI(task) {
 		console.log('Updating task UI:', task);
@@ -174,8 +200,18 @@ const Task = {
                     <div class="progress-stats">
                         <span>关键词：${progress.keywords_completed || 0}/${progress.keywords_total || 0}</span>
                         <span>笔记：${progress.notes_processed || 0}/${progress.notes_total || 0}</span>
+                        ${progress.notes_skipped ? `<span>跳过：${progress.notes_skipped}</span>` : ''}
                         <span>评论：${progress.comments_processed || 0}</span>
                     </div>
+                    ${task.queue_position ?
+				`<div class="task-queue">排队中：第 ${task.queue_position} 位，预计 ${new Date(task.estimated_start).toLocaleTimeString()} 开始</div>` :
+				''
+			}
+                    ${Object.keys(progress.keyword_states || {}).length ?
+				`<div class="keyword-progress">${Object.entries(progress.keyword_states).map(([keyword, state]) =>
+					`<div>${keyword}：${state.state} ${state.notes_processed}/${state.notes_total}</div>`).join('')}</div>` :
+				''
+			}
                     <div class="task-message">${lastMessage}</div>
                 </div>
             </div>
@@ -8,11 +8,37 @@ const WebSocket = {
 	maxReconnectAttempts: 5,
 	reconnectDelay: 1000,
 
+	// 最后收到的消息序号和服务端缓冲区标识，重连时带上，服务端补发断线期间的消息
+	lastSeq: null,
+	epoch: null,
+
+	// 已发送、等待应答的命令 id -> {message, resolve, reject, timer, retries}
+	pendingCommands: {},
+	commandTimeout: 300000,
+	maxCommandRetries: 3,
+	nextCommandId: 0,
+
 	// 建立连接
 	connect(clientId) {
 		console.log('Attempting to connect WebSocket...');
 
-		this.connection = new window.WebSocket(`ws://${window.location.host}/ws/${clientId}`);
+		const params = new URLSearchParams();
+		if (this.lastSeq !== null) {
+			params.set('last_seq', this.lastSeq);
+			params.set('epoch', this.epoch || '');
+		}
+		// 支持时大消息以 MessagePack 二进制帧接收，否则服务端全部发送 JSON 文本
+		if (MsgPack.supported) {
+			params.set('encoding', 'msgpack');
+		}
+		// 页面地址带 task_id 参数时只接收该任务的消息
+		const taskId = new URLSearchParams(window.location.search).get('task_id');
+		if (taskId) {
+			params.set('task_id', taskId);
+		}
+		const query = params.toString();
+		this.connection = new window.WebSocket(`ws://${window.location.host}/ws/${clientId}${query ? '?' + query : ''}`);
+		this.connection.binaryType = 'arraybuffer';
 
 		// 绑定事件处理器
 		this.connection.onopen = this.handleOpen.bind(this);
@@ -27,15 +53,65 @@ const WebSocket = {
 	handleOpen() {
 		console.log('WebSocket connection opened');
 		this.reconnectAttempts = 0;
+		// 断线前发出但没收到应答的命令用原来的 id 重发，服务端对已执行的命令直接返回之前的应答
+		Object.values(this.pendingCommands).forEach(pending => this.send(pending.message));
+	},
+
+	// 连接是否可用
+	isOpen() {
+		return Boolean(this.connection && this.connection.readyState === window.WebSocket.OPEN);
+	},
+
+	// 通过 WebSocket 发送命令，返回与对应 HTTP 接口相同的结果；连接不可用时调用 fallback（HTTP 请求）
+	command(name, args, fallback) {
+		if (!this.isOpen()) {
+			return fallback();
+		}
+		const id = `${App.clientId}-${Date.now()}-${this.nextCommandId++}`;
+		const message = { type: 'command', id: id, command: name, args: args };
+		return new Promise((resolve, reject) => {
+			const timer = setTimeout(() => {
+				delete this.pendingCommands[id];
+				reject(new Error(`Command ${name} timed out`));
+			}, this.commandTimeout);
+			this.pendingCommands[id] = { message, resolve, reject, timer, retries: 0 };
+			this.send(message);
+		});
+	},
+
+	// 处理命令应答，busy 时等待 retry_after 秒后用同一 id 重试
+	handleAck(data) {
+		const pending = this.pendingCommands[data.id];
+		if (!pending) {
+			return;
+		}
+		if (data.status === 'busy' && pending.retries < this.maxCommandRetries) {
+			pending.retries++;
+			setTimeout(() => this.send(pending.message), (data.retry_after || 1) * 1000);
+			return;
+		}
+		clearTimeout(pending.timer);
+		delete this.pendingCommands[data.id];
+		pending.resolve(data.result);
 	},
 
 	// 接收消息的处理
 	handleMessage(event) {
 		console.log('WebSocket message received:', event.data);
 		try {
-			const data = JSON.parse(event.data);
+			const data = typeof event.data === 'string' ?
+				JSON.parse(event.data) :
+				MsgPack.decode(new Uint8Array(event.data));
 			this.log('Parsed WebSocket message:', data);
 
+			if (data.msg_seq !== undefined) {
+				// 补发的消息可能与已收到的重复
+				if (this.lastSeq !== null && data.msg_seq <= this.lastSeq) {
+					return;
+				}
+				this.lastSeq = data.msg_seq;
+			}
+
 			switch (data.type) {
 				case 'chat_response':
 					this.log('Processing chat_response:', {
@@ -57,10 +133,21 @@ const WebSocket = {
 				case 'search_task_update':
 					this.log('Processing search_task_update:', {
 						action: data.action,
-						task_state: data.task.state,
-						user_input_required: data.task.user_input_required
+						task_id: data.task_id,
+						seq: data.seq,
+						full: Boolean(data.task)
 					});
-					Task.updateTaskUI(data.task);
+					Task.handleTaskUpdate(data);
+					break;
+
+				case 'ack':
+					this.log('Processing ack:', data);
+					this.handleAck(data);
+					break;
+
+				case 'resume':
+					this.log('Processing resume:', data);
+					this.handleResume(data);
 					break;
 
 				case 'search_result':
@@ -81,6 +168,20 @@ const WebSocket = {
 		}
 	},
 
+	// 处理服务端的补发结果：序号接不上时（服务重启、缓冲区过期）重新加载任务状态
+	handleResume(data) {
+		const epochChanged = this.epoch !== null && this.epoch !== data.epoch;
+		this.epoch = data.epoch;
+		if (epochChanged || this.lastSeq === null) {
+			// 新的缓冲区序号从头开始
+			this.lastSeq = 0;
+		}
+		if (data.status === 'reset') {
+			Task.taskStates = {};
+			Task.loadExistingTasks();
+		}
+	},
+
 	// 连接关闭时的处理
 	handleClose(clientId, event) {
 		console.log('WebSocket connection closed:', event);
@@ -102,7 +203,7 @@ const WebSocket = {
 
 	// 发送消息
 	send(message) {
-		if (this.connection && this.connection.readyState === WebSocket.OPEN) {
+		if (this.connection && this.connection.readyState === window.WebSocket.OPEN) {
 			this.connection.send(JSON.stringify(message));
 		} else {
 			console.error('WebSocket is not connected');
@@ -0,0 +1,177 @@
+import asyncio
+import contextlib
+import copy
+import inspect
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# 测试使用仓库自带的默认配置，不受本地 config.yaml 影响
+os.environ.setdefault("CONFIG_FILE", str(ROOT / "config" / "config.yaml.default"))
+
+from benchmarks.fake_browser import FakeBrowserService
+from benchmarks.mock_llm_server import CANNED_RESPONSES, MockLLMConfig, MockLLMServer, detect_prompt_kind
+from config.config_manager import config
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """async def 的测试用例在新的事件循环中运行"""
+    if inspect.iscoroutinefunction(pyfuncitem.obj):
+        funcargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+        asyncio.run(pyfuncitem.obj(**funcargs))
+        return True
+    return None
+
+def _reset_singletons():
+    from services.profiling_service import ProfilingService
+    from services.trace_service import TraceService
+    from services.websocket_service import WebsocketService
+    for cls in (WebsocketService, TraceService, ProfilingService):
+        cls._instance = None
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """每个测试在临时目录中运行（SQLite、日志等相对路径都写到这里），配置和单例在测试之间互不影响"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "_config", copy.deepcopy(config._config))
+    _reset_singletons()
+    yield
+    _reset_singletons()
+
+@pytest.fixture
+def set_config():
+    """修改当前测试的配置项：set_config('task.batch_analysis.max_notes', 2)，需要在创建服务之前调用"""
+    def setter(key: str, value):
+        node = config._config
+        *parents, last = key.split('.')
+        for name in parents:
+            node = node.setdefault(name, {})
+        node[last] = value
+    return setter
+
+class FakeAIService:
+    """按提示词类型返回 benchmarks.mock_llm_server 的预置响应，不走网络，记录每次请求的提示词类型"""
+
+    def __init__(self, responses=None, delay: float = 0.0):
+        self.responses = dict(responses or {})
+        self.delay = delay
+        self.calls = []
+
+    def _render(self, messages) -> str:
+        dicts = [message.to_dict() for message in messages]
+        kind = detect_prompt_kind(dicts)
+        self.calls.append(kind)
+        prompt = "\n".join(m["content"] if isinstance(m["content"], str) else "" for m in dicts)
+        canned = self.responses.get(kind, CANNED_RESPONSES.get(kind, CANNED_RESPONSES["chat"]))
+        result = canned(prompt) if callable(canned) else canned
+        return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+
+    async def generate_response(self, messages, model=None, json_mode=False) -> str:
+        text = self._render(messages)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return text
+
+    async def generate_response_stream(self, messages, model=None, **kwargs):
+        text = self._render(messages)
+        for i in range(0, len(text), 8):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield text[i:i + 8]
+
+    def count(self, kind: str) -> int:
+        return self.calls.count(kind)
+
+class _FakeServerProtocol:
+    """uvicorn 的 WebSocket 协议对象，conn.extensions 为握手后生效的扩展"""
+
+    def __init__(self, extensions):
+        self.conn = SimpleNamespace(extensions=[SimpleNamespace(name=name) for name in extensions])
+
+    async def receive(self):
+        return {"type": "websocket.disconnect"}
+
+class FakeWebSocket:
+    """记录发送内容的 WebSocket，send_text 的内容解析后保存在 messages 中
+
+    extensions 为握手后生效的扩展名列表，如 ["permessage-deflate"]，为 None 时取不到协商结果
+    """
+
+    def __init__(self, headers=None, extensions=None):
+        self.headers = headers or {}
+        self.scope = {"type": "websocket", "headers": []}
+        if extensions is not None:
+            self._receive = _FakeServerProtocol(extensions).receive
+        self.messages = []
+        self.binary_frames = []
+        self.accepted = False
+        self.closed = False
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_text(self, text: str):
+        self.messages.append(json.loads(text))
+
+    async def send_bytes(self, data: bytes):
+        self.binary_frames.append(data)
+
+    async def close(self):
+        self.closed = True
+
+@pytest.fixture
+def fake_ai():
+    return FakeAIService
+
+@pytest.fixture
+def fake_ws():
+    return FakeWebSocket
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def mock_llm():
+    """启动本地模拟模型服务：async with mock_llm(latency=0.1) as server: server.base_url"""
+    @contextlib.asynccontextmanager
+    async def start(**kwargs):
+        kwargs.setdefault("latency", 0.0)
+        kwargs.setdefault("latency_jitter", 0.0)
+        kwargs.setdefault("token_rate", 0)
+        server = MockLLMServer(MockLLMConfig(**kwargs), port=_free_port())
+        await server.start()
+        try:
+            yield server
+        finally:
+            await server.stop()
+    return start
+
+@pytest.fixture
+def make_executor():
+    """创建使用模拟浏览器和 FakeAIService 的 TaskExecutor，需要在事件循环中调用"""
+    def factory(ai=None, browser=None):
+        from services.task_executor import TaskExecutor
+        from services.task_manager import TaskManager
+        from services.websocket_service import WebsocketService
+        ai = ai or FakeAIService()
+        browser = browser or FakeBrowserService(search_latency=0, open_note_latency=0, latency_jitter=0, seed=1)
+        return TaskExecutor(TaskManager(WebsocketService()), browser, ai, ai)
+    return factory
+
+@pytest.fixture
+def make_chat_service():
+    """创建使用模拟浏览器和 FakeAIService 的 ChatService，需要在事件循环中调用"""
+    async def factory(ai=None, browser=None):
+        from services.chat_service import ChatService
+        ai = ai or FakeAIService()
+        browser = browser or FakeBrowserService(search_latency=0, open_note_latency=0, latency_jitter=0, seed=1)
+        return await ChatService.create(browser_service=browser, ai_service=ai, ai_service_mm=ai)
+    return factory
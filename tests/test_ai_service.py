@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from config.config_manager import config
+from services.ai_service import AIService
+
+def make_service(set_config, hedge_delay: float = 0.05) -> AIService:
+    set_config("llm.hedging.initial_delay", hedge_delay)
+    set_config("llm.hedging.min_delay", hedge_delay)
+    return AIService(base_url="http://primary.invalid/v1", api_key="k", fallback_endpoints=[
+        {"base_url": "http://fallback.invalid/v1", "api_key": "k", "model": "fallback-model"}
+    ])
+
+async def test_failover_uses_the_fallback_endpoints_own_model(set_config):
+    service = make_service(set_config)
+    models = []
+
+    async def call(endpoint):
+        models.append(endpoint.model or "requested-model")
+        if endpoint.base_url.startswith("http://primary"):
+            raise RuntimeError("primary down")
+        return "ok"
+
+    assert await service._hedged_call(call, ("m", False, 0)) == "ok"
+    assert models == ["requested-model", "fallback-model"]
+
+async def test_slow_request_is_hedged_and_loser_cancelled(set_config):
+    service = make_service(set_config)
+    cancelled = []
+
+    async def call(endpoint):
+        try:
+            await asyncio.sleep(5 if endpoint.base_url.startswith("http://primary") else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(endpoint.base_url)
+            raise
+        return endpoint.base_url
+
+    assert await service._hedged_call(call, ("m", False, 0)) == "http://fallback.invalid/v1"
+    await asyncio.sleep(0)
+    assert cancelled == ["http://primary.invalid/v1"]
+
+async def test_results_of_every_non_winner_are_discarded(set_config):
+    service = make_service(set_config)
+    release = asyncio.Event()
+    discarded = []
+
+    async def call(endpoint):
+        # 两个请求同时返回，落在同一个 done 集合中
+        await release.wait()
+        return endpoint.base_url
+
+    async def discard(result):
+        discarded.append(result)
+
+    attempt = asyncio.create_task(service._hedged_call(call, ("m", True, 0), discard=discard))
+    await asyncio.sleep(0.2)
+    release.set()
+    winner = await attempt
+
+    assert len(discarded) == 1
+    assert discarded[0] != winner
+
+async def test_circuit_breaker_skips_failing_endpoint(set_config):
+    set_config("llm.circuit_breaker.failure_threshold", 2)
+    service = make_service(set_config)
+    calls = []
+
+    async def call(endpoint):
+        calls.append(endpoint.base_url)
+        if endpoint.base_url.startswith("http://primary"):
+            raise RuntimeError("primary down")
+        return "ok"
+
+    for _ in range(3):
+        await service._hedged_call(call, ("m", False, 0))
+    # 前两次先尝试主端点，熔断后直接使用备用端点
+    assert calls.count("http://primary.invalid/v1") == 2
+
+def test_chat_service_fallbacks_use_their_own_models(monkeypatch):
+    from services.chat_service import ChatService
+    monkeypatch.setenv(config.llm.get('openai_custom_key_envname'), "k")
+    monkeypatch.setenv(config.llm.get('openai_custom_key_envname_mm'), "k")
+    service = ChatService()
+
+    assert service.ai_service._endpoints[0].model is None
+    assert service.ai_service._endpoints[1].model == config.llm.get('openai_custom_mm_model')
+    assert service.ai_service_mm._endpoints[1].model == config.llm.get('model')
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import socket
+import openai
+import pytest
+from benchmarks.bench_e2e import percentile, run_benchmark
+from benchmarks.mock_llm_server import add_mock_arguments, detect_prompt_kind
+from config.config_manager import config
+from models.ai_models import Message, MessageRole
+from services.ai_service import AIService
+from services.task_state import SearchTask, TaskEvent, TaskState
+from services.task_store import TaskStore
+
+def test_percentile_uses_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([3.0], 50) == 3.0
+    assert percentile([], 95) == 0.0
+
+def test_detect_prompt_kind():
+    assert detect_prompt_kind([{"role": "user", "content": "判断用户是否在寻求信息搜索"}]) == "search_intent"
+    assert detect_prompt_kind([{"role": "user", "content": "分析以下 3 篇小红书笔记及其评论"}]) == "note_opinions_batch"
+    assert detect_prompt_kind([{"role": "user", "content": "你好"}]) == "chat"
+
+async def test_mock_server_streams_and_returns_canned_json(mock_llm):
+    async with mock_llm(responses={"chat": "第一句。第二句。"}) as server:
+        ai = AIService(base_url=server.base_url, api_key="mock")
+        chunks = [chunk async for chunk in ai.generate_response_stream([Message(role=MessageRole.user, content="你好")])]
+        assert "".join(chunk for chunk in chunks if chunk) == "第一句。第二句。"
+
+        text = await ai.generate_response([Message(role=MessageRole.user, content="判断用户是否在寻求信息搜索")])
+        assert json.loads(text)["is_search"] is True
+
+async def test_mock_server_injects_failures(mock_llm, set_config):
+    set_config("llm.max_retries", 0)
+    async with mock_llm(failure_rate=1.0) as server:
+        ai = AIService(base_url=server.base_url, api_key="mock")
+        # generate_response 记录错误后返回空字符串，流式接口可以选择抛出
+        assert await ai.generate_response([Message(role=MessageRole.user, content="你好")]) == ""
+        with pytest.raises(openai.InternalServerError):
+            async for _ in ai.generate_response_stream([Message(role=MessageRole.user, content="你好")],
+                                                       raise_errors=True):
+                pass
+
+async def test_e2e_benchmark_completes_a_task():
+    parser = argparse.ArgumentParser()
+    add_mock_arguments(parser)
+    args = parser.parse_args(["--latency", "0", "--latency-jitter", "0", "--token-rate", "0", "--seed", "1"])
+    args.clients = 1
+    args.message = "帮我搜一下遛狗技巧"
+    args.keywords = "遛狗"
+    args.timeout = 30.0
+    args.intent_timeout = 5.0
+    args.search_latency = 0.0
+    args.open_note_latency = 0.0
+    args.mock_url = None
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        args.mock_port = sock.getsockname()[1]
+
+    # 正式数据中有一个中断的任务，测试不应恢复它，也不应写入正式数据
+    store = TaskStore("data/tasks.db")
+    interrupted = SearchTask("钓鱼", "user")
+    interrupted.update_state(TaskState.RUNNING, TaskEvent.START)
+    store.save(interrupted)
+
+    report = await run_benchmark(args)
+
+    assert report["completed_tasks"] == 1
+    assert report["stages"]["llm.generate_response"]["count"] > 0
+    assert "client.task_total" in report["stages"]
+    assert store.load(interrupted.task_id).to_storage_dict() == interrupted.to_storage_dict()
+    assert [task.task_id for task in store.list_unfinished()] == [interrupted.task_id]
+    assert store.list_summaries("bench-0") == []
+    assert not os.path.exists("data/chat_sessions.db")
+    assert config.get("task.store.path") == "data/tasks.db"
+
+def test_every_microbenchmark_case_runs_and_has_a_baseline():
+    from benchmarks import bench_micro
+    cases = bench_micro.build_cases()
+    baseline = bench_micro.load_baseline(bench_micro.BASELINE_PATH)
+    for name, func in cases.items():
+        func()
+        assert name in baseline["cases"], name
+
+def test_microbenchmark_compare_flags_regressions(tmp_path):
+    from benchmarks import bench_micro
+    baseline = {"cases": {"fast": {"relative": 1.0}, "strict": {"relative": 1.0, "threshold": 0.05}}}
+    results = {name: {"best_us": 1.0, "median_us": 1.0, "relative": 1.1} for name in ("fast", "strict", "new")}
+    assert bench_micro.compare(results, baseline, threshold=0.3) == ["strict"]
+
+    path = str(tmp_path / "baseline.json")
+    bench_micro.save_baseline(path, results, baseline)
+    saved = bench_micro.load_baseline(path)["cases"]
+    assert saved["strict"] == {"relative": 1.1, "best_us": 1.0, "threshold": 0.05}
+    assert set(saved) == {"fast", "strict", "new"}
+
+def test_microbenchmark_main_writes_results(tmp_path):
+    from benchmarks import bench_micro
+    output = tmp_path / "micro.json"
+    bench_micro.main(["--filter", "progress", "--min-time", "0.001", "--repeat", "1", "--output", str(output)])
+    assert output.exists() and json.loads(output.read_text(encoding="utf-8"))
@@ -0,0 +1,77 @@
+import asyncio
+import time
+import pytest
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from services.browser_service import BrowserService
+
+class SlowDriver:
+    """页面元素在 appear_after 秒后才出现的 WebDriver，为 None 时一直不出现"""
+
+    def __init__(self, appear_after=None):
+        self.appear_at = None if appear_after is None else time.monotonic() + appear_after
+        self.current_url = "about:blank"
+        self.visited = []
+        self.visited_at = None
+        self.scripts = []
+
+    def get(self, url):
+        self.current_url = url
+        self.visited.append(url)
+        self.visited_at = time.monotonic()
+
+    def get_log(self, kind):
+        return []
+
+    def execute_script(self, script, *args):
+        self.scripts.append(script)
+
+    def find_element(self, by, value):
+        if self.appear_at is None or time.monotonic() < self.appear_at:
+            raise NoSuchElementException(value)
+        return object()
+
+@pytest.fixture
+def browser(set_config):
+    set_config("chrome.wait_poll_interval", 0.05)
+    BrowserService._instance = None
+    service = BrowserService()
+    yield service
+    BrowserService._instance = None
+
+async def test_wait_until_polls_without_blocking(browser):
+    browser.driver = SlowDriver(appear_after=0.2)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticking = asyncio.create_task(ticker())
+    element = await browser._wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".note-item")), 2)
+    ticking.cancel()
+    assert element is not None
+    assert ticks > 5
+
+    browser.driver = SlowDriver()
+    with pytest.raises(TimeoutException):
+        await browser._wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".note-item")), 0.1)
+
+async def test_cancel_takes_effect_during_a_page_wait(browser, make_chat_service):
+    browser.driver = SlowDriver()
+    service = await make_chat_service(browser=browser)
+    task_id = (await service.start_unattended_search("遛狗", "c1"))["task_id"]
+    deadline = time.monotonic() + 5
+    while not browser.driver.visited:
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+    # 搜索页等待结果的超时为 10 秒，等待期间事件循环不被阻塞，取消在一个检查间隔内生效
+    await service.cancel_auto_search(task_id, "c1")
+    while service.task_scheduler.is_running(task_id):
+        await asyncio.sleep(0.01)
+    assert time.monotonic() - browser.driver.visited_at < 1
+    assert "window.stop();" in browser.driver.scripts
@@ -0,0 +1,83 @@
+import asyncio
+from services.ai_service import AIService
+from services.task_state import TaskState
+
+async def wait_for(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+async def test_cancel_stops_in_flight_model_request(make_chat_service, fake_ai):
+    ai = fake_ai(delay=30)
+    service = await make_chat_service(ai)
+    llm_slots = service.task_scheduler._slots["llm"]._value
+
+    result = await service.start_unattended_search("遛狗", "c1")
+    task_id = result["task_id"]
+    await wait_for(lambda: ai.calls)
+    assert service.task_scheduler.is_running(task_id)
+
+    calls = len(ai.calls)
+    assert (await service.cancel_auto_search(task_id, "c1"))["status"] == "success"
+    await wait_for(lambda: not service.task_scheduler.is_running(task_id), timeout=0.5)
+
+    assert (await service.task_manager.get_task(task_id)).state == TaskState.CANCELLED
+    assert service.task_scheduler._slots["llm"]._value == llm_slots
+    await asyncio.sleep(0.1)
+    assert len(ai.calls) == calls
+
+async def test_unattended_task_runs_to_completion(make_chat_service, fake_ws, set_config):
+    set_config("task.unattended.budget.max_notes", 3)
+    service = await make_chat_service()
+    ws = fake_ws()
+    await service.websocket_service.connect("c1", ws)
+
+    result = await service.start_unattended_search("遛狗", "c1")
+    task = await service.task_manager.get_task(result["task_id"])
+    assert task.state == TaskState.RUNNING
+    await wait_for(lambda: not service.task_scheduler.is_running(task.task_id))
+    await asyncio.sleep(0.1)
+
+    assert task.state == TaskState.COMPLETED
+    assert [m for m in ws.messages if m.get("type") == "search_result"]
+
+async def test_new_and_pending_tasks_start_running(make_chat_service):
+    service = await make_chat_service()
+    manager = service.task_manager
+    task = await manager.create_task("遛狗", "c1")
+    assert task.state == TaskState.RUNNING
+    assert await manager.create_task(" 遛狗 ", "c1") is task
+
+    pending_id = manager.create_pending_task("钓鱼", "c1")
+    started = await manager.create_task("钓鱼", "c1", pending_id)
+    assert started.state == TaskState.RUNNING
+    # 重复启动返回正在执行的同一任务
+    assert await manager.create_task("钓鱼", "c1", pending_id) is started
+
+async def test_failed_reply_sends_no_search_intent(make_chat_service, fake_ws, mock_llm, set_config):
+    set_config("llm.max_retries", 0)
+    async with mock_llm(failure_rate=1.0) as server:
+        ai = AIService(base_url=server.base_url, api_key="mock")
+        service = await make_chat_service(ai)
+        ws = fake_ws()
+        await service.websocket_service.connect("c1", ws)
+
+        await service.process_chat("帮我搜 露营装备", "c1")
+        await wait_for(lambda: any(m.get("type") == "error" for m in ws.messages))
+        await asyncio.sleep(0.1)
+
+    assert [m["type"] for m in ws.messages if m.get("type") in ("chat_response", "error", "search_intent")] == ["error"]
+    assert (await service.sessions.get("c1")).history == []
+
+async def test_unattended_search_does_not_take_over_a_running_task(make_chat_service):
+    service = await make_chat_service()
+    # 从待定任务启动、执行器还没有写入 context 的普通任务
+    pending_id = service.task_manager.create_pending_task("遛狗", "c1")
+    attended = await service.task_manager.create_task("遛狗", "c1", pending_id)
+    assert attended.context == {}
+
+    result = await service.start_unattended_search("遛狗", "c1")
+    assert result["status"] == "error" and result["task_id"] == attended.task_id
+    assert "unattended" not in attended.context
+    assert not service.task_scheduler.is_running(attended.task_id)
@@ -0,0 +1,130 @@
+import asyncio
+from models.ai_models import Message, MessageRole, TextContent
+from services.chat_session import ChatSession, ChatSessionManager, message_tokens
+from tools.token_tools import estimate_tokens, truncate_to_tokens
+
+def user(text):
+    return Message(role=MessageRole.user, content=text)
+
+def assistant(text):
+    return Message(role=MessageRole.assistant, content=text)
+
+async def test_sessions_are_separate_per_client():
+    manager = ChatSessionManager()
+    first = await manager.get("c1")
+    await manager.record_turn(first, user("你好"), assistant("你好呀"))
+    assert (await manager.get("c2")).history == []
+    assert await manager.get("c1") is first
+
+async def test_least_recently_used_session_is_evicted_and_restored(set_config):
+    set_config("chat.session.max_sessions", 2)
+    manager = ChatSessionManager()
+    session = await manager.get("c1")
+    await manager.record_turn(session, user("记住我喜欢柯基"), assistant("好的"))
+    await manager.get("c2")
+    await manager.get("c1")
+    await manager.get("c3")
+
+    assert len(manager) == 2
+    assert "c2" not in manager._sessions
+    await manager.get("c2")
+    assert "c1" not in manager._sessions
+    restored = await manager.get("c1")
+    assert restored is not session
+    assert [m.content for m in restored.history] == ["记住我喜欢柯基", "好的"]
+
+async def test_sessions_survive_a_restart():
+    manager = ChatSessionManager()
+    session = await manager.get("c1")
+    await manager.record_turn(session, user("问题"), assistant("回答"))
+    session.record_intent(True, "遛狗", "local")
+    await manager.record_turn(session, user("第二个问题"), assistant("第二个回答"))
+
+    restored = await ChatSessionManager().get("c1")
+    assert [m.role for m in restored.history] == [MessageRole.user, MessageRole.assistant] * 2
+    assert restored.last_intent["keywords"] == "遛狗"
+    assert restored.intent_counts["search"] == 1
+
+async def test_idle_sessions_leave_memory(set_config):
+    set_config("chat.session.idle_timeout", 10)
+    manager = ChatSessionManager()
+    session = await manager.get("c1")
+    session.last_active -= 60
+    manager._last_sweep -= 120
+    await manager.get("c2")
+    assert "c1" not in manager._sessions
+
+async def test_memory_only_sessions_without_store(set_config):
+    set_config("chat.session.store_path", "")
+    manager = ChatSessionManager()
+    assert manager.store is None
+    session = await manager.get("c1")
+    await manager.record_turn(session, user("问题"), assistant("回答"))
+    assert (await ChatSessionManager().get("c1")).history == []
+
+def test_truncate_to_tokens():
+    text = "walking dogs in the park " * 20
+    truncated = truncate_to_tokens(text, 10)
+    assert estimate_tokens(truncated) <= 10
+    assert len(truncated) > 10 and truncated.endswith("…")
+    assert truncate_to_tokens("遛狗", 10) == "遛狗"
+    assert truncate_to_tokens("遛狗技巧", 0) == ""
+
+def test_recent_turns_stay_within_budget(set_config):
+    set_config("chat.history.token_budget", 50)
+    manager = ChatSessionManager()
+    session = ChatSession("c1")
+    for i in range(5):
+        session.history += [user(f"第{i}个问题" * 3), assistant(f"第{i}个回答" * 3)]
+    prompt = manager.build_prompt(session, Message(role=MessageRole.system, content="系统"), user("新问题"))
+    recent = prompt[1:-1]
+    assert 2 <= len(recent) < 10
+    assert sum(message_tokens(m) for m in recent) <= 50
+    assert recent[-1] is session.history[-1]
+
+def test_oversized_last_turn_is_truncated_to_budget(set_config):
+    set_config("chat.history.token_budget", 40)
+    manager = ChatSessionManager()
+    system = Message(role=MessageRole.system, content="系统")
+
+    session = ChatSession("c1", [user("问题"), assistant("回答" * 100)])
+    recent = manager.build_prompt(session, system, user("新问题"))[1:-1]
+    assert recent[0] is session.history[0]
+    assert sum(message_tokens(m) for m in recent) <= 40
+
+    # 多模态内容按文本项截断，超出预算的文本项不再放入
+    image = {"type": "image_url", "image_url": {"url": "http://example.com/a.jpg"}}
+    content = [TextContent(text="图片说明" * 5), image, TextContent(text="长回答" * 50), {"type": "text", "text": "结尾"}]
+    session = ChatSession("c2", [user("问题"), assistant(content)])
+    recent = manager.build_prompt(session, system, user("新问题"))[1:-1]
+    truncated = recent[1].content
+    assert sum(message_tokens(m) for m in recent) <= 40
+    assert truncated[:2] == content[:2]
+    assert len(truncated) == 3 and truncated[2].text.endswith("…")
+    assert session.history[1].content is content
+
+    # 上一条用户消息本身超出预算时也截断
+    session = ChatSession("c3", [user("问题" * 100), assistant("回答")])
+    recent = manager.build_prompt(session, system, user("新问题"))[1:-1]
+    assert sum(message_tokens(m) for m in recent) <= 40
+
+async def test_summary_is_capped_in_tokens(set_config):
+    set_config("chat.history.token_budget", 20)
+    set_config("chat.history.summary_max_tokens", 30)
+
+    async def summarizer(summary, older):
+        return "the user asked about walking dogs and parks " * 20
+
+    manager = ChatSessionManager(summarizer=summarizer)
+    session = await manager.get("c1")
+    await manager.record_turn(session, user("遛狗去哪个公园"), assistant("可以去附近的公园" * 3))
+    await manager.record_turn(session, user("周末呢"), assistant("周末人比较多"))
+    for _ in range(100):
+        if session.summary:
+            break
+        await asyncio.sleep(0.01)
+
+    # 英文按 4 个字符 1 个 token 估算，按字符截断会只剩 30 个字符
+    assert estimate_tokens(session.summary) <= 30
+    assert len(session.summary) > 30
+    assert session.summarized_messages == 2
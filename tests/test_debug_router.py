@@ -0,0 +1,33 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers.debug_router import router
+
+def make_client():
+    app = FastAPI()
+    app.include_router(router, prefix="/debug")
+    return TestClient(app)
+
+def test_debug_endpoints_are_closed_without_admin_token():
+    client = make_client()
+    assert client.get("/debug/trace/t1").status_code == 404
+    assert client.post("/debug/profile/memory/snapshot", headers={"X-Admin-Token": ""}).status_code == 404
+
+def test_debug_endpoints_require_matching_token(set_config):
+    set_config("debug.admin_token", "secret")
+    client = make_client()
+    assert client.get("/debug/trace/t1").status_code == 403
+    assert client.get("/debug/trace/t1", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.get("/debug/trace/t1", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "error"
+
+def test_memory_snapshot_and_diff_endpoints(set_config):
+    set_config("debug.admin_token", "secret")
+    client = make_client()
+    headers = {"X-Admin-Token": "secret"}
+    try:
+        base_id = client.post("/debug/profile/memory/snapshot", headers=headers).json()["snapshot_id"]
+        result = client.get("/debug/profile/memory/diff", params={"base_id": base_id}, headers=headers).json()
+        assert result["status"] == "success" and result["target_id"] == base_id + 1
+    finally:
+        client.post("/debug/profile/memory/stop", headers=headers)
@@ -0,0 +1,52 @@
+import pytest
+from services.intent_service import IntentDecision, SearchIntentPrefilter, get_intent_stats, record_audit
+
+@pytest.mark.parametrize("text, keywords", [
+    ("帮我搜一下杭州美食", "杭州美食"),
+    ("搜索遛狗技巧", "遛狗技巧"),
+    ("在小红书上找一下露营装备推荐", "露营装备推荐"),
+    ("能帮我搜索一下新手健身计划吗", "新手健身计划"),
+    ("查查北京好吃的烤鸭店", "北京好吃的烤鸭店"),
+    ("帮我找找适合油皮的防晒霜", "适合油皮的防晒霜"),
+    ("给我查北京烤鸭哪家好吃", "北京烤鸭哪家好吃"),
+    ("搜 露营装备", "露营装备"),
+    ("搜：遛狗技巧", "遛狗技巧"),
+])
+def test_explicit_search_requests_are_resolved_locally(text, keywords):
+    assert SearchIntentPrefilter().classify(text) == (IntentDecision.SEARCH, keywords)
+
+@pytest.mark.parametrize("text", [
+    "搜狗输入法怎么卸载",
+    "搜狐新闻上说的是真的吗",
+    "找找感觉",
+    "查询快递要多久",
+    "找工作好难",
+    "我想搜一下遛狗技巧",
+    "帮我搜一下这个",
+    "推荐几个适合情侣的约会地点",
+    "帮我搜一下" + "很长的关键词" * 5,
+])
+def test_ambiguous_messages_go_to_the_model(text):
+    assert SearchIntentPrefilter().classify(text) == (IntentDecision.UNSURE, None)
+
+@pytest.mark.parametrize("text", ["你好", "谢谢！", "ok", "帮我翻译一下 good morning", "1+1等于多少"])
+def test_small_talk_and_other_tasks_are_not_searches(text):
+    assert SearchIntentPrefilter().classify(text) == (IntentDecision.NOT_SEARCH, None)
+
+def test_disabled_prefilter_forwards_everything(set_config):
+    set_config("chat.intent.prefilter", False)
+    assert SearchIntentPrefilter().classify("帮我搜一下杭州美食") == (IntentDecision.UNSURE, None)
+
+def test_audit_stats(monkeypatch):
+    from services import intent_service
+    monkeypatch.setattr(intent_service, "_intent_stats", dict.fromkeys(intent_service._intent_stats, 0))
+    prefilter = SearchIntentPrefilter()
+    for decision in (IntentDecision.SEARCH, IntentDecision.NOT_SEARCH, IntentDecision.UNSURE, IntentDecision.UNSURE):
+        prefilter.record(decision)
+    record_audit(True, True)
+    record_audit(True, False)
+    record_audit(False, True)
+
+    stats = get_intent_stats()
+    assert stats["local_rate"] == 0.5
+    assert stats["precision"] == 0.5 and stats["recall"] == 0.5
@@ -0,0 +1,39 @@
+import pytest
+from tools.json_tools import extract_first_number, parse_json_tolerant, validate_json
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('```json\n{"a": 1}\n```', {"a": 1}),
+    ('结果如下：{"a": 1} 以上', {"a": 1}),
+    ('{"a": 1, // 注释\n "b": [1, 2,], /* 块注释 */}', {"a": 1, "b": [1, 2]}),
+    ('{"a": "含有 } 和 { 的字符串"}', {"a": "含有 } 和 { 的字符串"}),
+])
+def test_parse_tolerates_common_model_output(text, expected):
+    assert parse_json_tolerant(text) == (expected, False)
+
+def test_truncated_output_is_closed():
+    data, truncated = parse_json_tolerant('{"a": "完整", "b": ["x", "y", "未完')
+    assert truncated
+    assert data == {"a": "完整", "b": ["x", "y", "未完"]}
+
+def test_truncated_key_falls_back_to_last_complete_value():
+    data, truncated = parse_json_tolerant('```json\n{"a": 1, "b": {"c": 2}, "d')
+    assert truncated
+    assert data == {"a": 1, "b": {"c": 2}}
+
+def test_unparseable_output_returns_none():
+    assert parse_json_tolerant("没有 JSON") == (None, False)
+    assert parse_json_tolerant("") == (None, False)
+
+def test_validate_reports_invalid_top_level_fields():
+    schema = {"type": "object", "required": ["a", "b"],
+              "properties": {"a": {"type": "string"}, "c": {"type": "array", "items": {"type": "string"}}}}
+    assert validate_json({"a": 1, "c": ["x", 2]}, schema) == ["a", "c", "b"]
+    assert validate_json({"a": "x", "b": None}, schema) == []
+    assert validate_json([], schema) == ["$"]
+
+def test_booleans_are_not_numbers():
+    assert validate_json({"n": True}, {"type": "object", "properties": {"n": {"type": "number"}}}) == ["n"]
+
+def test_extract_first_number():
+    assert extract_first_number("综合可信度 50 左右") == 50
@@ -0,0 +1,32 @@
+from services.profiling_service import ProfilingService
+
+async def test_diff_against_the_oldest_snapshot_when_the_registry_is_full(set_config):
+    set_config("debug.memory.max_snapshots", 2)
+    service = ProfilingService()
+    try:
+        base_id = (await service.take_snapshot())["snapshot_id"]
+        await service.take_snapshot()
+        kept = [bytearray(1024) for _ in range(100)]
+
+        # 与当前内存比较时新快照会挤出 base，比较结果仍然基于 base
+        result = await service.diff_snapshots(base_id)
+        assert result["status"] == "success"
+        assert result["base_id"] == base_id and result["seconds"] >= 0
+        assert result["total_diff"] > 0
+        assert base_id not in service._snapshots and len(service._snapshots) == 2
+
+        assert (await service.diff_snapshots(base_id))["status"] == "error"
+        assert len(kept) == 100
+    finally:
+        service.stop_memory_tracing()
+
+async def test_diff_between_saved_snapshots():
+    service = ProfilingService()
+    try:
+        first = (await service.take_snapshot())["snapshot_id"]
+        second = (await service.take_snapshot())["snapshot_id"]
+        result = await service.diff_snapshots(first, second)
+        assert result["status"] == "success" and result["target_id"] == second
+        assert (await service.diff_snapshots(first, 99))["status"] == "error"
+    finally:
+        service.stop_memory_tracing()
@@ -0,0 +1,53 @@
+import json
+from models.output_schemas import OUTPUT_SCHEMAS
+from models.ai_models import Message, MessageRole
+from services.structured_output_service import StructuredOutputService, get_parse_stats
+
+class ScriptedAI:
+    """依次返回给定的回复，记录收到的请求"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def generate_response(self, messages, model=None, json_mode=False):
+        self.requests.append(messages)
+        return self.responses.pop(0) if self.responses else ""
+
+PROMPT = [Message(role=MessageRole.user, content="判断用户是否在寻求信息搜索")]
+
+async def test_valid_output_needs_no_repair():
+    ai = ScriptedAI('{"is_search": true, "keywords": "遛狗", "reason": "r"}')
+    result = await StructuredOutputService(ai).generate_json(PROMPT, "search_intent", model="m-valid")
+    assert result["keywords"] == "遛狗"
+    assert len(ai.requests) == 1
+
+async def test_only_invalid_fields_are_requested_again():
+    ai = ScriptedAI('{"is_search": "yes", "keywords": "遛狗", "reason": "r"}', '{"is_search": true}')
+    result = await StructuredOutputService(ai).generate_json(PROMPT, "search_intent", model="m-repair")
+
+    assert result["is_search"] is True and result["keywords"] == "遛狗"
+    assert "is_search" in ai.requests[1][-1].content
+    stats = get_parse_stats()["m-repair"]
+    assert stats["schema_failures"] == 1 and stats["repaired"] == 1
+
+async def test_unparseable_output_is_requested_in_full():
+    ai = ScriptedAI("抱歉，我无法回答", json.dumps({"is_search": False, "keywords": None, "reason": "r"}))
+    result = await StructuredOutputService(ai).generate_json(PROMPT, "search_intent", model="m-full")
+    assert result["is_search"] is False
+    assert get_parse_stats()["m-full"]["parse_failures"] == 1
+
+async def test_fields_still_invalid_after_repair_are_dropped():
+    ai = ScriptedAI('{"is_search": "yes", "keywords": "遛狗", "reason": "r"}', '{"is_search": "still yes"}')
+    result = await StructuredOutputService(ai).generate_json(PROMPT, "search_intent", model="m-drop")
+    assert "is_search" not in result and result["keywords"] == "遛狗"
+
+async def test_unusable_output_returns_none(set_config):
+    set_config("llm.structured_output.repair", False)
+    ai = ScriptedAI("不是 JSON")
+    assert await StructuredOutputService(ai).generate_json(PROMPT, "search_intent", model="m-none") is None
+    assert get_parse_stats()["m-none"]["dropped"] == 1
+
+def test_every_prompt_kind_has_a_schema():
+    for kind in ("note_opinions", "note_opinions_batch", "triage", "all_opinions", "search_intent"):
+        assert OUTPUT_SCHEMAS[kind]["type"] == "object"
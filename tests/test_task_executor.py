@@ -0,0 +1,161 @@
+import asyncio
+from services.triage_service import TriageDecision
+
+def make_note(note_id: str, desc_repeat: int = 2, comments: int = 2):
+    note = {"id": note_id, "title": f"笔记 {note_id}", "xsec_token": "t"}
+    note_data = {"title": f"笔记 {note_id}", "desc": "正文内容，" * desc_repeat,
+                 "interact_info": {"liked_count": "10", "collected_count": "2", "comment_count": str(comments),
+                                   "share_count": "1"}}
+    comment_list = [{"content": f"评论 {i}", "like_count": "1"} for i in range(comments)]
+    return note, note_data, comment_list
+
+async def run_analyze_stage(executor, items):
+    analyze_queue, publish_queue = asyncio.Queue(), asyncio.Queue()
+    for note, note_data, comments in items:
+        analyze_queue.put_nowait((note, TriageDecision.ANALYZE, note_data, comments))
+    analyze_queue.put_nowait(None)
+    task = await executor.task_manager.create_task("遛狗", "c1")
+    await executor._analyze_stage(task, analyze_queue, publish_queue)
+    results = []
+    while (item := publish_queue.get_nowait()) is not None:
+        results.append(item)
+    return results
+
+async def test_small_notes_share_one_request(make_executor, fake_ai):
+    ai = fake_ai()
+    executor = make_executor(ai)
+    pack = [make_note(f"n{i}") for i in range(3)]
+
+    results = await executor._analyze_note_pack(pack)
+
+    assert ai.count("note_opinions_batch") == 1
+    assert ai.count("note_opinions") == 0
+    assert [note["id"] for note, _, _, _ in results] == ["n0", "n1", "n2"]
+    assert [opinions["note_metadata"]["title"] for _, _, _, opinions in results] == ["笔记 n0", "笔记 n1", "笔记 n2"]
+
+async def test_notes_missing_from_batch_reply_are_analyzed_individually(make_executor, fake_ai):
+    from benchmarks.mock_llm_server import _note_opinion
+    ai = fake_ai(responses={"note_opinions_batch": {"results": [{"note_id": "n0", "analysis": _note_opinion("n0")}]}})
+    executor = make_executor(ai)
+
+    results = await executor._analyze_note_pack([make_note(f"n{i}") for i in range(3)])
+
+    assert ai.count("note_opinions_batch") == 1
+    assert ai.count("note_opinions") == 2
+    assert all(opinions for _, _, _, opinions in results)
+
+async def test_large_notes_keep_their_own_request(make_executor, fake_ai, set_config):
+    set_config("task.batch_analysis.small_note_tokens", 150)
+    ai = fake_ai()
+    executor = make_executor(ai)
+
+    results = await run_analyze_stage(executor, [make_note("big", desc_repeat=40), make_note("s1"), make_note("s2")])
+
+    assert sorted(note["id"] for note, _, _, _ in results) == ["big", "s1", "s2"]
+    assert ai.count("note_opinions") == 1
+    assert ai.count("note_opinions_batch") == 1
+
+async def test_packs_respect_note_count_limit(make_executor, fake_ai, set_config):
+    set_config("task.batch_analysis.max_notes", 2)
+    ai = fake_ai()
+    executor = make_executor(ai)
+
+    results = await run_analyze_stage(executor, [make_note(f"n{i}") for i in range(5)])
+
+    assert len(results) == 5
+    # 2 + 2 合并分析，剩下 1 篇单独分析
+    assert ai.count("note_opinions_batch") == 2
+    assert ai.count("note_opinions") == 1
+
+class ScriptedStream:
+    """按给定分片流式返回，可在某个分片后抛出异常，记录流是否被关闭"""
+
+    def __init__(self, chunks, delay: float = 0.0, fail_after: int = None):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail_after = fail_after
+        self.closed = False
+        self.served = 0
+
+    async def generate_response_stream(self, messages, model=None, **kwargs):
+        try:
+            for i, chunk in enumerate(self.chunks):
+                if self.fail_after is not None and i >= self.fail_after:
+                    raise RuntimeError("stream broken")
+                await asyncio.sleep(self.delay)
+                self.served += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+def drain(queue: asyncio.Queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+def test_split_keywords_cleans_and_deduplicates(make_executor):
+    from services.task_executor import TaskExecutor
+    assert TaskExecutor._split_keywords("遛狗技巧，狗狗训练、遛狗技巧; ,遛狗装备。") == ["遛狗技巧", "狗狗训练", "遛狗装备"]
+
+async def test_keywords_are_queued_while_streaming(make_executor):
+    executor = make_executor()
+    executor.ai_service = ScriptedStream(["遛狗技", "巧,狗狗", "训练,遛狗装备"], delay=0.05)
+    task = await executor.task_manager.create_task("遛狗", "c1")
+    queue = asyncio.Queue()
+
+    producer = asyncio.create_task(executor._stream_search_keywords(task, [], queue))
+    first = await asyncio.wait_for(queue.get(), 1)
+    assert first == "遛狗技巧"
+    assert not producer.done()
+
+    keywords = await producer
+    assert keywords == ["遛狗技巧", "狗狗训练", "遛狗装备"]
+    assert drain(queue) == ["狗狗训练", "遛狗装备", None]
+    assert task.progress.keywords_total == 3
+
+async def test_stream_is_closed_once_enough_keywords(make_executor, set_config):
+    set_config("task.max_keywords_per_batch", 1)
+    set_config("task.max_batches", 2)
+    executor = make_executor()
+    stream = ScriptedStream(["a1,", "a2,", "a3,", "a4,"])
+    executor.ai_service = stream
+    task = await executor.task_manager.create_task("a", "c1")
+    queue = asyncio.Queue()
+
+    keywords = await executor._stream_search_keywords(task, ["原始"], queue)
+
+    assert keywords == ["原始", "a1"]
+    assert stream.closed and stream.served < 4
+    assert drain(queue) == ["a1", None]
+
+async def test_stream_error_keeps_keywords_generated_so_far(make_executor):
+    executor = make_executor()
+    executor.ai_service = ScriptedStream(["遛狗技巧,", "狗狗", "训练"], fail_after=2)
+    task = await executor.task_manager.create_task("遛狗", "c1")
+    queue = asyncio.Queue()
+
+    keywords = await executor._stream_search_keywords(task, [], queue)
+
+    # 流中断时最后一段不完整，不作为关键词
+    assert keywords == ["遛狗技巧"]
+    assert drain(queue) == ["遛狗技巧", None]
+
+async def test_pipeline_finishes_when_progress_push_fails(make_executor, set_config):
+    set_config("task.pipeline.queue_size", 1)
+    set_config("task.triage.enabled", False)
+    executor = make_executor()
+    task = await executor.task_manager.create_task("遛狗", "c1")
+    notes = [{"id": f"n{i}", "title": f"笔记 {i}", "xsec_token": "t"} for i in range(5)]
+    calls = []
+
+    async def failing_update(task, action):
+        calls.append(action)
+        if len(calls) > 1:
+            raise RuntimeError("push failed")
+
+    executor.task_manager.publish_task_update = failing_update
+    await asyncio.wait_for(executor._process_notes(task, notes, "遛狗"), timeout=5)
+
+    assert task.progress.notes_processed == 5
+    assert len(task.context["done_note_ids"]) == 5
@@ -0,0 +1,119 @@
+import asyncio
+from contextvars import ContextVar
+import pytest
+from services.task_scheduler import TaskPriority, TaskScheduler
+from services.task_state import SearchTask
+
+class StubTaskManager:
+    def __init__(self):
+        self.notified = []
+
+    async def publish_task_update(self, task, action):
+        self.notified.append((task.task_id, task.queue_position))
+
+def make_scheduler(set_config, max_running=1, **limits):
+    set_config("task.scheduler.max_running", max_running)
+    for key, value in limits.items():
+        set_config(f"task.scheduler.{key}", value)
+    return TaskScheduler(StubTaskManager())
+
+def recorder(order, name, gate=None):
+    async def run():
+        if gate:
+            await gate.wait()
+        order.append(name)
+    return run
+
+async def wait_idle(scheduler):
+    while scheduler._running or scheduler._queues:
+        await asyncio.sleep(0)
+
+async def test_clients_are_served_in_turn(set_config):
+    scheduler = make_scheduler(set_config)
+    gate = asyncio.Event()
+    order = []
+    await scheduler.submit(SearchTask("x", "blocker"), recorder(order, "blocker", gate))
+    for name in ("a1", "a2", "a3"):
+        await scheduler.submit(SearchTask(name, "a"), recorder(order, name))
+    await scheduler.submit(SearchTask("b1", "b"), recorder(order, "b1"))
+    gate.set()
+    await wait_idle(scheduler)
+    assert order == ["blocker", "a1", "b1", "a2", "a3"]
+
+async def test_continued_tasks_go_first(set_config):
+    scheduler = make_scheduler(set_config)
+    gate = asyncio.Event()
+    order = []
+    await scheduler.submit(SearchTask("x", "blocker"), recorder(order, "blocker", gate))
+    await scheduler.submit(SearchTask("new", "a"), recorder(order, "new"))
+    await scheduler.submit(SearchTask("continue", "b"), recorder(order, "continue"), TaskPriority.CONTINUE)
+    gate.set()
+    await wait_idle(scheduler)
+    assert order == ["blocker", "continue", "new"]
+
+async def test_queue_positions_are_published(set_config):
+    scheduler = make_scheduler(set_config, default_run_seconds=10)
+    gate = asyncio.Event()
+    await scheduler.submit(SearchTask("x", "blocker"), recorder([], "blocker", gate))
+    first, second = SearchTask("a", "a"), SearchTask("b", "b")
+    await scheduler.submit(first, recorder([], "a"))
+    await scheduler.submit(second, recorder([], "b"))
+    assert (first.queue_position, second.queue_position) == (1, 2)
+    assert second.estimated_start > first.estimated_start
+    gate.set()
+    await wait_idle(scheduler)
+    assert first.queue_position is None and second.queue_position is None
+
+async def test_admission_limits(set_config):
+    scheduler = make_scheduler(set_config, max_queue=3, max_queued_per_client=2)
+    gate = asyncio.Event()
+    await scheduler.submit(SearchTask("x", "blocker"), recorder([], "x", gate))
+    task = SearchTask("a1", "a")
+    await scheduler.submit(task, recorder([], "a1"))
+    assert not await scheduler.submit(task, recorder([], "a1"))
+    await scheduler.submit(SearchTask("a2", "a"), recorder([], "a2"))
+    with pytest.raises(ValueError):
+        await scheduler.submit(SearchTask("a3", "a"), recorder([], "a3"))
+    await scheduler.submit(SearchTask("b1", "b"), recorder([], "b1"))
+    with pytest.raises(ValueError):
+        await scheduler.submit(SearchTask("c1", "c"), recorder([], "c1"))
+    gate.set()
+    await wait_idle(scheduler)
+
+async def test_cancel_stops_running_task(set_config):
+    scheduler = make_scheduler(set_config)
+    task = SearchTask("x", "a")
+    cancelled = asyncio.Event()
+
+    async def run():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    await scheduler.submit(task, run)
+    await asyncio.sleep(0)
+    assert scheduler.cancel(task.task_id)
+    await wait_idle(scheduler)
+    assert cancelled.is_set() and not scheduler.is_running(task.task_id)
+
+async def test_next_run_does_not_inherit_previous_context(set_config):
+    scheduler = make_scheduler(set_config)
+    marker: ContextVar = ContextVar("marker", default=None)
+    gate = asyncio.Event()
+    seen = []
+
+    async def first():
+        marker.set("first")
+        await gate.wait()
+
+    async def second():
+        seen.append(marker.get())
+
+    marker.set("submitter")
+    await scheduler.submit(SearchTask("a", "a"), first)
+    await scheduler.submit(SearchTask("b", "b"), second)
+    gate.set()
+    await wait_idle(scheduler)
+    assert seen == [None]
@@ -0,0 +1,91 @@
+import asyncio
+from services.task_manager import TaskManager
+from services.task_state import (SearchTask, TaskEvent, TaskState, apply_task_patch, diff_task_dicts,
+                                 merge_task_updates)
+from services.websocket_service import WebsocketService
+
+def replay(messages):
+    """按客户端的方式应用更新消息，返回最终的任务字典"""
+    state, seq = None, None
+    for message in messages:
+        if "task" in message:
+            state, seq = message["task"], message["seq"]
+        else:
+            assert message["base_seq"] == seq
+            state, seq = apply_task_patch(state, message["patch"]), message["seq"]
+    return state
+
+def test_diff_contains_only_changed_fields():
+    previous = {"state": "running", "error": None, "progress": {"notes_processed": 1, "notes_total": 5}}
+    current = {"state": "running", "error": "x", "progress": {"notes_processed": 2, "notes_total": 5}}
+    patch = diff_task_dicts(previous, current)
+    assert patch == {"error": "x", "progress": {"notes_processed": 2}}
+    assert apply_task_patch(previous, patch) == current
+    assert previous["progress"]["notes_processed"] == 1
+
+def test_updates_are_patches_after_the_first_snapshot():
+    task = SearchTask("遛狗", "c1")
+    first = task.build_update("start")
+    assert "task" in first and first["seq"] == 1
+    assert task.build_update("progress") is None
+
+    task.progress.notes_processed = 3
+    task.progress.update_keyword_state("遛狗", notes_total=5)
+    second = task.build_update("progress")
+    assert second["base_seq"] == 1 and second["seq"] == 2
+    assert set(second["patch"]) == {"progress"}
+    assert replay([first, second]) == task.to_dict()
+
+def test_merged_updates_equal_applying_them_in_order():
+    task = SearchTask("遛狗", "c1")
+    messages = [task.build_update("start")]
+    for i in range(3):
+        task.progress.notes_processed = i + 1
+        task.update_state(TaskState.RUNNING, TaskEvent.PROGRESS, f"第 {i} 篇")
+        messages.append(task.build_update("progress"))
+
+    merged = messages[0]
+    for message in messages[1:]:
+        merged = merge_task_updates(merged, message)
+    assert merged["seq"] == 4 and "task" in merged
+    assert merged["task"] == task.to_dict()
+
+    patches = merge_task_updates(messages[2], messages[3])
+    assert patches["base_seq"] == 2 and patches["seq"] == 4
+    assert replay([messages[0], messages[1], patches]) == task.to_dict()
+
+def test_snapshot_keeps_the_published_sequence():
+    task = SearchTask("遛狗", "c1")
+    task.build_update("start")
+    task.progress.notes_processed = 1
+    task.build_update("progress")
+    snapshot = task.build_snapshot("resync")
+    assert snapshot["seq"] == 2 and snapshot["task"]["progress"]["notes_processed"] == 1
+
+def test_to_dict_is_cached_until_the_task_changes():
+    task = SearchTask("遛狗", "c1")
+    first = task.to_dict()
+    assert task.to_dict() is first
+    task.results.append({"note_id": "n1"})
+    assert task.to_dict()["results_count"] == 1
+    task.progress.keyword_states["遛狗"] = {"state": "searching"}
+    task.progress.touch()
+    assert task.to_dict()["progress"]["keyword_states"] == {"遛狗": {"state": "searching"}}
+
+async def test_resync_sends_a_snapshot_with_pending_changes(fake_ws):
+    websocket_service = WebsocketService()
+    manager = TaskManager(websocket_service)
+    task = await manager.create_task("遛狗", "c1")
+    ws = fake_ws()
+    await websocket_service.connect("c1", ws)
+    task.progress.notes_processed = 2
+
+    await websocket_service.dispatch("c1", {"type": "task_resync", "task_id": task.task_id})
+    await websocket_service.dispatch("c2", {"type": "task_resync", "task_id": task.task_id})
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    resync = [m for m in ws.messages if m.get("action") == "resync"]
+    assert len(resync) == 1
+    assert resync[0]["task"]["progress"]["notes_processed"] == 2
+    assert resync[0]["seq"] == task._update_seq
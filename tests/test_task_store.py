@@ -0,0 +1,167 @@
+import json
+import os
+from datetime import datetime, timedelta
+from services.task_manager import TaskManager
+from services.task_state import SearchTask, TaskEvent, TaskState
+from services.task_store import TaskStore
+from services.websocket_service import WebsocketService
+
+def make_finished_task(keywords="遛狗", client_id="c1"):
+    task = SearchTask(keywords, client_id)
+    task.update_state(TaskState.RUNNING, TaskEvent.START)
+    task.results.append({"note_id": "n1", "title": "标题", "opinions": ["观点"]})
+    task.context["keywords_done"] = [keywords]
+    task.update_state(TaskState.COMPLETED, TaskEvent.COMPLETE, "完成")
+    return task
+
+def test_save_and_load_round_trip(tmp_path):
+    store = TaskStore(str(tmp_path / "store" / "tasks.db"))
+    task = make_finished_task()
+    store.save(task)
+
+    loaded = TaskStore(store.path).load(task.task_id)
+    assert loaded.to_storage_dict() == task.to_storage_dict()
+    assert loaded.state_history[-1]["event"] == TaskEvent.COMPLETE
+    assert store.load("missing") is None
+
+def test_unfinished_tasks_and_summaries(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.db"))
+    finished = make_finished_task("a")
+    running = SearchTask("b", "c1")
+    running.update_state(TaskState.RUNNING, TaskEvent.START)
+    store.save(finished)
+    store.save(running)
+
+    assert [task.task_id for task in store.list_unfinished()] == [running.task_id]
+    summaries = store.list_summaries("c1")
+    assert [summary["keywords"] for summary in summaries] == ["b", "a"]
+    assert "results" not in summaries[0]
+    assert store.list_summaries("c1", limit=1)[0]["keywords"] == "b"
+
+def test_purge_removes_expired_tasks(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.db"))
+    old = make_finished_task("old")
+    task_id, client_id, state, _, summary, payload = store.serialize(old)
+    store.write((task_id, client_id, state, (datetime.now() - timedelta(days=40)).isoformat(), summary, payload))
+    store.save(make_finished_task("new"))
+
+    assert store.purge_older_than(30) == 1
+    assert store.load(task_id) is None
+    assert len(store.list_summaries("c1")) == 1
+
+async def test_archived_task_leaves_memory_and_loads_from_store(set_config):
+    set_config("task.store.archive_after", 0)
+    manager = TaskManager(WebsocketService())
+    task = make_finished_task()
+    manager.tasks[task.task_id] = task
+    manager.client_tasks["c1"] = [task.task_id]
+
+    await manager.archive_finished_tasks()
+
+    assert task.task_id not in manager.tasks
+    assert os.path.exists("data/tasks.db")
+    assert (await manager.get_client_tasks("c1"))[0]["results_count"] == 1
+    loaded = await manager.get_task(task.task_id)
+    assert loaded.results == task.results
+    assert task.task_id not in manager.tasks
+
+async def test_only_recent_summaries_are_kept_in_memory(set_config):
+    set_config("task.store.archive_after", 0)
+    set_config("task.store.max_summaries_per_client", 2)
+    manager = TaskManager(WebsocketService())
+    tasks = [make_finished_task(str(i)) for i in range(3)]
+    for task in tasks:
+        manager.tasks[task.task_id] = task
+        manager.client_tasks.setdefault("c1", []).append(task.task_id)
+
+    await manager.archive_finished_tasks()
+
+    assert [manager.task_summaries[tid]["keywords"] for tid in manager.client_tasks["c1"]] == ["1", "2"]
+    assert (await manager.get_task(tasks[0].task_id)).keywords == "0"
+    # 移出内存的摘要仍从存储中列出
+    assert [summary["keywords"] for summary in await manager.get_client_tasks("c1")] == ["0", "1", "2"]
+
+async def test_task_list_is_limited_and_falls_back_to_the_store(set_config):
+    set_config("task.store.archive_after", 0)
+    set_config("task.store.max_summaries_per_client", 1)
+    set_config("task.store.max_listed_per_client", 3)
+    manager = TaskManager(WebsocketService())
+    for i in range(4):
+        task = make_finished_task(str(i))
+        manager.tasks[task.task_id] = task
+        manager.client_tasks.setdefault("c1", []).append(task.task_id)
+        await manager.archive_finished_tasks()
+    running = await manager.create_task("遛狗", "c1")
+
+    assert len(manager.task_summaries) == 1
+    listed = await manager.get_client_tasks("c1")
+    assert [summary["keywords"] for summary in listed] == ["2", "3", "遛狗"]
+    assert listed[-1]["task_id"] == running.task_id
+    assert await manager.get_client_tasks("c2") == []
+
+async def test_expired_pending_task_is_cancelled(set_config):
+    set_config("task.store.pending_ttl", 10)
+    manager = TaskManager(WebsocketService())
+    task_id = manager.create_pending_task("遛狗", "c1")
+    manager.tasks[task_id].start_time -= timedelta(seconds=60)
+
+    await manager.archive_finished_tasks()
+
+    assert manager.tasks[task_id].state == TaskState.CANCELLED
+
+def test_snapshot_is_not_affected_by_later_changes():
+    task = SearchTask("遛狗", "c1")
+    task.update_state(TaskState.RUNNING, TaskEvent.START)
+    task.results.append({"note_id": "n1"})
+    task.context["done_note_ids"] = ["n1"]
+    snapshot = TaskStore.snapshot(task)
+
+    task.results.append({"note_id": "n2"})
+    task.context["done_note_ids"].append("n2")
+    task.progress.notes_processed = 2
+
+    row = TaskStore.encode(snapshot)
+    restored = SearchTask.from_storage_dict(json.loads(row[5]))
+    assert [result["note_id"] for result in restored.results] == ["n1"]
+    assert restored.context["done_note_ids"] == ["n1"]
+    assert restored.progress.notes_processed == 0
+
+async def test_checkpointed_task_is_resumed_after_restart():
+    manager = TaskManager(WebsocketService())
+    task = await manager.create_task("遛狗", "c1")
+    task.update_state(TaskState.ANALYZING, TaskEvent.PROGRESS)
+    task.results.append({"note_id": "n1"})
+    task.context["done_note_ids"] = ["n1"]
+    await manager.checkpoint(task)
+    waiting = await manager.create_task("钓鱼", "c2")
+    waiting.update_state(TaskState.WAITING_USER_INPUT, TaskEvent.REQUIRE_INPUT)
+    await manager.checkpoint(waiting)
+
+    restarted = TaskManager(WebsocketService())
+    resumed = await restarted.recover_interrupted_tasks()
+
+    assert [t.task_id for t in resumed] == [task.task_id]
+    assert resumed[0].state == TaskState.RUNNING
+    assert resumed[0].context["done_note_ids"] == ["n1"]
+    assert restarted.tasks[waiting.task_id].state == TaskState.WAITING_USER_INPUT
+    assert await restarted.get_client_tasks("c2")
+
+async def test_checkpoints_can_be_disabled(set_config):
+    set_config("task.checkpoint.enabled", False)
+    manager = TaskManager(WebsocketService())
+    task = await manager.create_task("遛狗", "c1")
+    await manager.checkpoint(task)
+    assert await TaskManager(WebsocketService()).recover_interrupted_tasks() == []
+
+async def test_recovery_logs_only_the_recovered_tasks(caplog):
+    manager = TaskManager(WebsocketService())
+    await manager.create_task("遛狗", "c1")
+    await manager.create_task("钓鱼", "c1")
+
+    restarted = TaskManager(WebsocketService())
+    restarted.create_pending_task("露营", "c2")
+    with caplog.at_level("INFO", logger="services.task_manager"):
+        resumed = await restarted.recover_interrupted_tasks()
+
+    assert len(resumed) == 2
+    assert "Recovered 2 unfinished tasks from checkpoints, 2 to resume" in caplog.text
@@ -0,0 +1,12 @@
+from tools.token_tools import estimate_tokens
+
+def test_cjk_characters_count_one_token_each():
+    assert estimate_tokens("遛狗技巧") == 4
+
+def test_other_characters_count_four_per_token():
+    assert estimate_tokens("walking dogs") == 3
+    assert estimate_tokens("遛狗技巧 walking dogs") == 8
+
+def test_non_string_content_is_serialized():
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens({"a": "狗"}) == estimate_tokens('{"a": "狗"}')
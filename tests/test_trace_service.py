@@ -0,0 +1,56 @@
+import asyncio
+import os
+from services.trace_service import TraceService, bind_trace, span
+
+def test_tracing_is_off_by_default():
+    with span("task.search", task_id="t1") as attrs:
+        attrs["keyword"] = "遛狗"
+    assert TraceService()._task_spans == {}
+    assert not os.path.exists("logs/trace.jsonl")
+
+async def test_spans_nest_and_build_a_waterfall(set_config):
+    set_config("trace.enabled", True)
+    bind_trace(task_id="t1")
+    with span("task.keyword", keyword="遛狗"):
+        with span("browser.search"):
+            await asyncio.sleep(0.01)
+
+        async def child():
+            with span("llm.request", model="m"):
+                pass
+        await asyncio.create_task(child())
+
+    trace = await TraceService().waterfall("t1")
+    assert [s["name"] for s in trace["spans"]] == ["task.keyword", "browser.search", "llm.request"]
+    assert [s["depth"] for s in trace["spans"]] == [0, 1, 1]
+    assert trace["stages"]["browser.search"]["count"] == 1
+    assert await TraceService().waterfall("missing") is None
+
+async def test_evicted_task_spans_are_read_back_from_file(set_config):
+    set_config("trace.enabled", True)
+    set_config("trace.max_tasks", 1)
+    for task_id in ("t1", "t2"):
+        with span("task.search", task_id=task_id):
+            pass
+
+    tracer = TraceService()
+    assert "t1" not in tracer._task_spans
+    spans = await tracer.get_spans("t1")
+    assert [s["task_id"] for s in spans] == ["t1"]
+
+async def test_trace_file_is_rotated(set_config):
+    set_config("trace.enabled", True)
+    set_config("trace.flush_size", 1)
+    set_config("trace.max_bytes", 500)
+    set_config("trace.backup_count", 2)
+    for i in range(30):
+        with span("ws.send", task_id="t1", payload="x" * 100):
+            pass
+
+    tracer = TraceService()
+    await asyncio.get_running_loop().run_in_executor(tracer._io, lambda: None)
+    assert os.path.exists("logs/trace.jsonl.1") and os.path.exists("logs/trace.jsonl.2")
+    assert not os.path.exists("logs/trace.jsonl.3")
+    assert all(os.path.getsize(path) < 1000 for path in ("logs/trace.jsonl", "logs/trace.jsonl.1"))
+    tracer._task_spans.clear()
+    assert 0 < len(await tracer.get_spans("t1")) < 30
@@ -0,0 +1,44 @@
+from services.triage_service import NoteTriageService, TriageDecision
+
+NOTES = [
+    {"id": "a", "title": "遛狗技巧大全", "liked_count": "1.2万"},
+    {"id": "b", "title": "今天的晚饭", "liked_count": "3"},
+    {"id": "c", "title": "牵引绳怎么选", "liked_count": "500"},
+]
+
+def test_parse_count_handles_xiaohongshu_formats():
+    assert NoteTriageService._parse_count("1.2万") == 12000
+    assert NoteTriageService._parse_count("3k") == 3000
+    assert NoteTriageService._parse_count("10+") == 10
+    assert NoteTriageService._parse_count(None) == 0
+
+def test_local_score_prefers_title_overlap(fake_ai):
+    service = NoteTriageService(fake_ai())
+    assert service.local_score(["遛狗技巧"], NOTES[0]) > service.local_score(["遛狗技巧"], NOTES[1])
+
+async def test_without_cheap_model_only_local_scores_are_used(fake_ai):
+    ai = fake_ai()
+    service = NoteTriageService(ai)
+
+    decisions = dict((note["id"], decision) for note, decision in await service.triage("遛狗", "遛狗技巧", NOTES))
+
+    assert ai.calls == []
+    assert decisions["a"] == TriageDecision.ANALYZE
+    assert TriageDecision.SKIP not in decisions.values()
+
+async def test_cheap_model_rescores_uncertain_notes(fake_ai, set_config):
+    set_config("task.triage.model", "cheap-model")
+    ai = fake_ai(responses={"triage": {"scores": {"b": "5", "c": "80"}}})
+    service = NoteTriageService(ai)
+
+    result = await service.triage("遛狗", "遛狗技巧", NOTES)
+
+    assert ai.count("triage") == 1
+    assert [(note["id"], decision) for note, decision in result] == [
+        ("a", TriageDecision.ANALYZE), ("c", TriageDecision.ANALYZE), ("b", TriageDecision.SKIP)
+    ]
+
+async def test_disabled_triage_analyzes_everything(fake_ai, set_config):
+    set_config("task.triage.enabled", False)
+    result = await NoteTriageService(fake_ai()).triage("遛狗", "遛狗技巧", NOTES)
+    assert [decision for _, decision in result] == [TriageDecision.ANALYZE] * 3
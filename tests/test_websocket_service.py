@@ -0,0 +1,254 @@
+import asyncio
+import base64
+import json
+import shutil
+import subprocess
+from pathlib import Path
+import pytest
+from services.task_state import SearchTask, TaskEvent, TaskState
+from services.websocket_service import WebsocketService, msgpack
+
+ROOT = Path(__file__).resolve().parent.parent
+
+async def flush():
+    """让各连接的发送任务把队列中的消息发完"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def connect(fake_ws, client_id="c1", **kwargs):
+    service = WebsocketService()
+    ws = fake_ws()
+    await service.connect(client_id, ws, **kwargs)
+    await flush()
+    return service, ws
+
+def task_updates(count: int):
+    task = SearchTask("遛狗", "c1")
+    messages = []
+    for i in range(count):
+        task.progress.notes_processed = i + 1
+        messages.append(task.build_update("progress"))
+    return task, messages
+
+def updates(ws):
+    return [m for m in ws.messages if m["type"] == "search_task_update"]
+
+async def test_queued_task_updates_are_coalesced(fake_ws):
+    service, ws = await connect(fake_ws)
+    task, messages = task_updates(3)
+    for message in messages:
+        await service.send_message("c1", message)
+    await flush()
+
+    sent = updates(ws)
+    assert len(sent) == 1
+    assert sent[0]["seq"] == 3
+    assert sent[0]["task"]["progress"]["notes_processed"] == 3
+
+async def test_updates_of_different_tasks_are_kept(fake_ws):
+    service, ws = await connect(fake_ws)
+    for _ in range(2):
+        _, messages = task_updates(1)
+        await service.send_message("c1", messages[0])
+    await flush()
+    assert len(updates(ws)) == 2
+
+async def test_chat_chunks_are_merged(fake_ws, set_config):
+    set_config("websocket.outbound.chat_flush_interval", 0.05)
+    service, ws = await connect(fake_ws)
+    chunks = ["今天", "天气", "不错，", "适合", "遛狗。"]
+    for chunk in chunks:
+        await service.send_message("c1", {"type": "chat_response", "content": chunk, "message_type": "chat"})
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.1)
+
+    sent = [m for m in ws.messages if m["type"] == "chat_response"]
+    assert 1 < len(sent) < len(chunks)
+    assert "".join(m["content"] for m in sent) == "".join(chunks)
+    assert sent[-1]["msg_seq"] == ws.messages[-1]["msg_seq"]
+
+async def test_long_chat_content_is_sent_without_waiting(fake_ws, set_config):
+    set_config("websocket.outbound.chat_flush_interval", 10)
+    set_config("websocket.outbound.chat_flush_chars", 10)
+    service, ws = await connect(fake_ws)
+    await service.send_message("c1", {"type": "chat_response", "content": "首句", "message_type": "chat"})
+    await flush()
+    await service.send_message("c1", {"type": "chat_response", "content": "一" * 6, "message_type": "chat"})
+    await service.send_message("c1", {"type": "chat_response", "content": "二" * 6, "message_type": "chat"})
+    await flush()
+    assert [m["content"] for m in ws.messages if m["type"] == "chat_response"] == ["首句", "一" * 6 + "二" * 6]
+
+async def test_slow_connection_is_dropped_without_affecting_others(fake_ws, set_config):
+    set_config("websocket.outbound.max_queue", 3)
+    service, fast = await connect(fake_ws)
+    slow = fake_ws()
+    blocked = asyncio.Event()
+
+    async def stuck_send(text):
+        await blocked.wait()
+    slow.send_text = stuck_send
+    await service.connect("c1", slow)
+
+    for i in range(10):
+        await service.send_message("c1", {"type": "chat_response", "content": str(i), "message_type": "task_progress"})
+        await flush()
+
+    assert service.connection_count("c1") == 1
+    assert slow.closed and not fast.closed
+    assert [m["content"] for m in fast.messages if m["type"] == "chat_response"] == [str(i) for i in range(10)]
+
+async def test_coalesced_update_keeps_message_order(fake_ws):
+    service, ws = await connect(fake_ws)
+    _, messages = task_updates(2)
+    await service.send_message("c1", messages[0])
+    await service.send_message("c1", {"type": "chat_response", "content": "笔记摘要", "message_type": "task_note_summary"})
+    await service.send_message("c1", messages[1])
+    await service.send_message("c1", {"type": "chat_response", "content": "进度", "message_type": "task_progress"})
+    await flush()
+
+    seqs = [m["msg_seq"] for m in ws.messages if "msg_seq" in m]
+    assert seqs == sorted(seqs)
+    # 按客户端的方式丢弃序号不大于已收到序号的消息，所有内容都应被接收
+    last, received = 0, []
+    for message in ws.messages:
+        if message.get("msg_seq", last + 1) > last:
+            last = message.get("msg_seq", last)
+            received.append(message.get("message_type") or message["type"])
+    assert received == ["resume", "task_note_summary", "search_task_update", "task_progress"]
+    assert updates(ws)[0]["task"]["progress"]["notes_processed"] == 2
+
+def chat(content, message_type="chat"):
+    return {"type": "chat_response", "content": content, "message_type": message_type}
+
+async def test_reconnect_replays_missed_messages(fake_ws):
+    service, ws = await connect(fake_ws)
+    resume = ws.messages[0]
+    assert resume["status"] == "new"
+    await service.send_message("c1", chat("已收到", "task_progress"))
+    await flush()
+    last_seq = ws.messages[-1]["msg_seq"]
+    service.disconnect("c1", ws)
+
+    await service.send_message("c1", chat("断线期间", "task_progress"))
+    await service.send_message("c1", chat("第一段"))
+    await service.send_message("c1", chat("第二段"))
+    again = fake_ws()
+    await service.connect("c1", again, last_seq=last_seq, epoch=resume["epoch"])
+    await flush()
+
+    assert again.messages[0]["status"] == "ok" and again.messages[0]["replayed"] == 2
+    assert [m["content"] for m in again.messages[1:]] == ["断线期间", "第一段第二段"]
+
+async def test_replay_resumes_from_the_middle_of_merged_chat_chunks(fake_ws):
+    service, ws = await connect(fake_ws)
+    epoch = ws.messages[0]["epoch"]
+    for content in ("一二", "三四", "五六"):
+        await service.send_message("c1", chat(content))
+    service.disconnect("c1", ws)
+
+    again = fake_ws()
+    first_chunk_seq = ws.messages[0]["last_seq"] + 1
+    await service.connect("c1", again, last_seq=first_chunk_seq, epoch=epoch)
+    await flush()
+    assert again.messages[-1]["content"] == "三四五六"
+
+async def test_unknown_epoch_or_evicted_messages_reset(fake_ws, set_config):
+    set_config("websocket.replay.max_messages", 2)
+    service, ws = await connect(fake_ws)
+    epoch = ws.messages[0]["epoch"]
+    for i in range(4):
+        await service.send_message("c1", chat(str(i), "task_progress"))
+    service.disconnect("c1", ws)
+
+    stale = fake_ws()
+    await service.connect("c1", stale, last_seq=0, epoch="old-epoch")
+    await flush()
+    assert stale.messages[0]["status"] == "reset"
+    assert [m["content"] for m in stale.messages[1:]] == ["2", "3"]
+
+    gap = fake_ws()
+    await service.connect("c1", gap, last_seq=1, epoch=epoch)
+    await flush()
+    assert gap.messages[0]["status"] == "reset"
+
+async def test_messages_fan_out_to_every_connection(fake_ws):
+    service, first = await connect(fake_ws)
+    second = fake_ws()
+    await service.connect("c1", second)
+    task_only = fake_ws()
+    await service.connect("c1", task_only, task_id="t1")
+
+    await service.send_message("c1", chat("所有连接", "task_progress"))
+    await service.send_message("c1", {**chat("任务消息", "task_progress"), "task_id": "t1"})
+    await flush()
+
+    for ws in (first, second):
+        assert [m["content"] for m in ws.messages if m["type"] == "chat_response"] == ["所有连接", "任务消息"]
+    assert [m["content"] for m in task_only.messages if m["type"] == "chat_response"] == ["任务消息"]
+
+async def test_oldest_connection_is_dropped_over_the_limit(fake_ws, set_config):
+    set_config("websocket.max_connections_per_client", 2)
+    service, first = await connect(fake_ws)
+    second, third = fake_ws(), fake_ws()
+    await service.connect("c1", second)
+    await service.connect("c1", third)
+    await flush()
+    assert service.connection_count("c1") == 2
+    assert first.closed and not second.closed
+
+async def test_zero_connection_limit_means_unlimited(fake_ws, set_config):
+    set_config("websocket.max_connections_per_client", 0)
+    service, _ = await connect(fake_ws)
+    for _ in range(3):
+        await service.connect("c1", fake_ws())
+    assert service.connection_count("c1") == 4
+
+async def connect_msgpack(fake_ws, **ws_kwargs):
+    service = WebsocketService()
+    ws = fake_ws(**ws_kwargs)
+    await service.connect("c1", ws, encoding="msgpack")
+    await service.send_message("c1", chat("短消息", "task_progress"))
+    await service.send_message("c1", chat("长" * 5000, "task_progress"))
+    await flush()
+    return ws
+
+@pytest.mark.skipif(msgpack is None, reason="msgpack not installed")
+async def test_large_messages_use_msgpack_without_compression(fake_ws):
+    ws = await connect_msgpack(fake_ws)
+    assert [m["content"] for m in ws.messages if m["type"] == "chat_response"] == ["短消息"]
+    assert [msgpack.unpackb(frame)["content"] for frame in ws.binary_frames] == ["长" * 5000]
+
+@pytest.mark.skipif(msgpack is None, reason="msgpack not installed")
+async def test_negotiated_compression_keeps_json(fake_ws):
+    ws = await connect_msgpack(fake_ws, extensions=["permessage-deflate"])
+    assert not ws.binary_frames
+    assert len([m for m in ws.messages if m["type"] == "chat_response"]) == 2
+
+@pytest.mark.skipif(msgpack is None, reason="msgpack not installed")
+async def test_offered_but_not_negotiated_compression_uses_msgpack(fake_ws):
+    ws = await connect_msgpack(fake_ws, headers={"sec-websocket-extensions": "permessage-deflate"}, extensions=[])
+    assert len(ws.binary_frames) == 1
+
+@pytest.mark.skipif(msgpack is None or shutil.which("node") is None, reason="requires msgpack and node")
+def test_browser_msgpack_decoder_round_trip():
+    message = {
+        "type": "search_task_update", "seq": 7, "ok": True, "none": None, "ratio": 0.125,
+        "ints": [0, 127, 128, 255, 256, 65535, 65536, 2 ** 32 - 1, 2 ** 32, -1, -32, -33, -128, -129, -32768,
+                 -32769, -2 ** 31, -2 ** 31 - 1],
+        "strings": ["", "遛狗", "x" * 31, "x" * 32, "长" * 100, "y" * 70000],
+        "array16": list(range(20)),
+        "map16": {f"k{i}": i for i in range(20)},
+        "nested": {"progress": {"keyword_states": {"遛狗": {"state": "searching"}}}},
+    }
+    script = (
+        "const src = require('fs').readFileSync(process.argv[1], 'utf8');"
+        "const MsgPack = new Function(src + '\\nreturn MsgPack;')();"
+        "const bytes = new Uint8Array(Buffer.from(require('fs').readFileSync(0, 'utf8'), 'base64'));"
+        "process.stdout.write(JSON.stringify(MsgPack.decode(bytes)));"
+    )
+    result = subprocess.run(
+        ["node", "-e", script, str(ROOT / "static" / "js" / "msgpack.js")],
+        input=base64.b64encode(msgpack.packb(message, use_bin_type=True)).decode(),
+        capture_output=True, text=True, timeout=30, check=True
+    )
+    assert json.loads(result.stdout) == message
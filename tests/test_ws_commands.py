@@ -0,0 +1,104 @@
+import asyncio
+from pydantic import BaseModel
+from services.websocket_service import WebsocketService
+
+class EchoArgs(BaseModel):
+    text: str
+
+async def flush():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def setup(fake_ws, handler=None):
+    service = WebsocketService()
+    calls = []
+
+    async def echo(client_id, args):
+        calls.append(args.text)
+        return {"status": "success", "text": args.text}
+    service.register_command("echo", EchoArgs, handler or echo)
+    ws = fake_ws()
+    await service.connect("c1", ws)
+    return service, ws, calls
+
+def acks(ws):
+    return [m for m in ws.messages if m["type"] == "ack"]
+
+async def test_command_is_acknowledged_with_its_result(fake_ws):
+    service, ws, calls = await setup(fake_ws)
+    await service.dispatch("c1", {"type": "command", "id": "r1", "command": "echo", "args": {"text": "hi"}})
+    await flush()
+    assert calls == ["hi"]
+    ack = acks(ws)[0]
+    assert ack["id"] == "r1" and ack["status"] == "success" and ack["result"]["text"] == "hi"
+
+async def test_invalid_and_unknown_commands_are_rejected(fake_ws):
+    service, ws, calls = await setup(fake_ws)
+    await service.dispatch("c1", {"type": "command", "id": "r1", "command": "echo", "args": {}})
+    await service.dispatch("c1", {"type": "command", "id": "r2", "command": "missing"})
+    await service.dispatch("c1", {"type": "command", "command": "echo", "args": {"text": "no id"}})
+    await flush()
+    assert calls == []
+    assert [(ack["id"], ack["status"]) for ack in acks(ws)] == [("r1", "error"), ("r2", "error")]
+    assert "Invalid arguments" in acks(ws)[0]["result"]["message"]
+
+async def test_repeated_request_id_returns_the_previous_ack(fake_ws):
+    service, ws, calls = await setup(fake_ws)
+    request = {"type": "command", "id": "r1", "command": "echo", "args": {"text": "hi"}}
+    await service.dispatch("c1", request)
+    await flush()
+    await service.dispatch("c1", request)
+    await flush()
+    assert calls == ["hi"]
+    assert [ack.get("duplicate", False) for ack in acks(ws)] == [False, True]
+
+async def test_request_in_flight_is_not_run_twice(fake_ws):
+    release = asyncio.Event()
+
+    async def slow(client_id, args):
+        await release.wait()
+        return {"status": "success"}
+    service, ws, _ = await setup(fake_ws, slow)
+    request = {"type": "command", "id": "r1", "command": "echo", "args": {"text": "hi"}}
+    await service.dispatch("c1", request)
+    await service.dispatch("c1", request)
+    release.set()
+    await flush()
+    assert len(acks(ws)) == 1
+
+async def test_busy_when_too_many_commands_in_flight(fake_ws, set_config):
+    set_config("websocket.commands.max_in_flight", 1)
+    release = asyncio.Event()
+
+    async def slow(client_id, args):
+        await release.wait()
+        return {"status": "success"}
+    service, ws, _ = await setup(fake_ws, slow)
+    await service.dispatch("c1", {"type": "command", "id": "r1", "command": "echo", "args": {"text": "a"}})
+    await service.dispatch("c1", {"type": "command", "id": "r2", "command": "echo", "args": {"text": "b"}})
+    await flush()
+    busy = acks(ws)[0]
+    assert busy["id"] == "r2" and busy["status"] == "busy" and busy["retry_after"] > 0
+
+    release.set()
+    await flush()
+    await service.dispatch("c1", {"type": "command", "id": "r2", "command": "echo", "args": {"text": "b"}})
+    await flush()
+    assert [(ack["id"], ack["status"]) for ack in acks(ws)[1:]] == [("r1", "success"), ("r2", "success")]
+
+async def test_handler_errors_are_reported_in_the_ack(fake_ws):
+    async def broken(client_id, args):
+        raise RuntimeError("boom")
+    service, ws, _ = await setup(fake_ws, broken)
+    await service.dispatch("c1", {"type": "command", "id": "r1", "command": "echo", "args": {"text": "a"}})
+    await flush()
+    assert acks(ws)[0]["status"] == "error" and acks(ws)[0]["result"]["message"] == "boom"
+
+async def test_chat_service_registers_its_commands(make_chat_service, fake_ws):
+    service = await make_chat_service()
+    ws = fake_ws()
+    await service.websocket_service.connect("c1", ws)
+    await service.websocket_service.dispatch(
+        "c1", {"type": "command", "id": "r1", "command": "cancel_search", "args": {"task_id": "missing"}})
+    await flush()
+    assert acks(ws)[0]["status"] == "success"
@@ -1,14 +1,132 @@
 import json
 import logging
 import re
+from typing import Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+_CLOSERS = {'{': '}', '[': ']'}
+
+def _strip_code_fence(text: str) -> str:
+    """取出第一个 ``` 代码块中的内容，缺少结尾标记（输出被截断）时取到文本末尾"""
+    match = re.search(r'```[a-zA-Z]*\s*\n?', text)
+    if not match:
+        return text
+    body = text[match.end():]
+    end_idx = body.find('```')
+    return body if end_idx == -1 else body[:end_idx]
+
+def repair_json_text(text: str) -> Tuple[Optional[str], bool]:
+    """从模型输出中截取第一个 JSON 对象，并修复常见的格式问题
+
+    处理代码块标记、对象前后的多余文字、// 和 /* */ 注释、多余的结尾逗号，
+    以及输出被截断时未闭合的字符串、数组和对象。
+
+    Returns:
+        (修复后的 JSON 文本, 是否被截断)，找不到 JSON 对象时返回 (None, False)
+    """
+    text = _strip_code_fence(text)
+    start_idx = text.find('{')
+    if start_idx == -1:
+        return None, False
+
+    out = []
+    stack = []
+    # 可安全截断的位置：(输出长度, 当时的括号栈)，用于修复截断的输出
+    cut_points = []
+    in_string = False
+    escaped = False
+    i = start_idx
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch == '/' and text.startswith('//', i):
+            end_idx = text.find('\n', i)
+            i = len(text) if end_idx == -1 else end_idx
+            continue
+        elif ch == '/' and text.startswith('/*', i):
+            end_idx = text.find('*/', i + 2)
+            i = len(text) if end_idx == -1 else end_idx + 2
+            continue
+        elif ch in _CLOSERS:
+            stack.append(ch)
+            out.append(ch)
+            cut_points.append((len(out), list(stack)))
+        elif ch in '}]':
+            # 去掉结尾多余的逗号
+            while out and out[-1] in ' \t\r\n':
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                return "".join(out), False
+        elif ch == ',':
+            cut_points.append((len(out), list(stack)))
+            out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+
+    # 输出被截断：先尝试直接补齐，失败时回退到上一个可截断的位置再补齐
+    body = "".join(out)
+    if in_string:
+        body += '"'
+    candidate = body.rstrip(' \t\r\n,:') + "".join(_CLOSERS[c] for c in reversed(stack))
+    try:
+        json.loads(candidate)
+        return candidate, True
+    except json.JSONDecodeError:
+        pass
+    for length, cut_stack in reversed(cut_points):
+        candidate = "".join(out[:length]).rstrip(' \t\r\n,') + "".join(_CLOSERS[c] for c in reversed(cut_stack))
+        try:
+            json.loads(candidate)
+            return candidate, True
+        except json.JSONDecodeError:
+            continue
+    return None, True
+
+def parse_json_tolerant(text: str) -> Tuple[Optional[Any], bool]:
+    """容错解析模型输出的 JSON
+
+    Returns:
+        (解析结果, 是否被截断)，解析失败时结果为 None
+    """
+    if not text:
+        return None, False
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    json_str, truncated = repair_json_text(text)
+    if json_str is None:
+        return None, truncated
+    try:
+        return json.loads(json_str), truncated
+    except json.JSONDecodeError:
+        return None, truncated
+
 def extract_json_from_text(text: str) -> dict:
     """从文本中提取JSON对象
     
     Args:
-        text: 可能包含JSON的文本字符串
+        text: 可能包含JSON的文本字符串，可以带代码块标记、注释、前后说明文字，或被截断
         
     Returns:
         解析后的JSON对象,如果解析失败返回None
@@ -20,27 +138,74 @@ def extract_json_from_text(text: str) -> dict:
         {'key': 'value'}
     """
     try:
-        # 尝试直接解析
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass
-        
-        # 查找第一个 { 和最后一个 }
-        start_idx = text.find('{')
-        end_idx = text.rfind('}')
-        
-        if start_idx != -1 and end_idx != -1:
-            json_str = text[start_idx:end_idx + 1]
-            return json.loads(json_str)
-            
-        logger.warning(f"No valid JSON found in text: {text}")
-        return None
+        result, truncated = parse_json_tolerant(text)
+        if result is None:
+            logger.warning(f"No valid JSON found in text: {text}")
+        elif truncated:
+            logger.warning("JSON in text was truncated, recovered partial result")
+        return result
         
     except Exception as e:
         logger.error(f"Error extracting JSON from text: {e}, text: {text}")
         return None 
 
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+def _matches_type(value: Any, expected) -> bool:
+    for type_name in (expected if isinstance(expected, list) else [expected]):
+        if type_name in ("number", "integer"):
+            # bool 是 int 的子类，需要排除
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if type_name == "number" or isinstance(value, int):
+                    return True
+        elif isinstance(value, _JSON_TYPES[type_name]):
+            return True
+    return False
+
+def _is_valid(value: Any, schema: dict) -> bool:
+    if "type" in schema and not _matches_type(value, schema["type"]):
+        return False
+    if isinstance(value, dict):
+        if any(key not in value for key in schema.get("required", [])):
+            return False
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value and not _is_valid(value[key], sub_schema):
+                return False
+    if isinstance(value, list) and "items" in schema:
+        return all(_is_valid(item, schema["items"]) for item in value)
+    return True
+
+def validate_json(data: Any, schema: dict) -> List[str]:
+    """按 JSON Schema 子集（type、properties、required、items）校验模型输出
+
+    Returns:
+        缺失或无效的顶层字段名列表，整体类型不符时返回 ["$"]，校验通过返回空列表
+
+    Example:
+        >>> validate_json({"a": 1}, {"type": "object", "required": ["a", "b"],
+        ...                          "properties": {"a": {"type": "string"}}})
+        ['a', 'b']
+    """
+    if "type" in schema and not _matches_type(data, schema["type"]):
+        return ["$"]
+    if not isinstance(data, dict):
+        return [] if _is_valid(data, schema) else ["$"]
+    invalid = []
+    properties = schema.get("properties", {})
+    for key in list(properties) + [k for k in schema.get("required", []) if k not in properties]:
+        if key not in data:
+            if key in schema.get("required", []):
+                invalid.append(key)
+        elif key in properties and not _is_valid(data[key], properties[key]):
+            invalid.append(key)
+    return invalid
+
 # 从字符串提取第一个数字  "综合可信度 50 左右， 返回 50"
 def extract_first_number(text: str) -> int:
     match = re.search(r'\d+', text)
@@ -0,0 +1,53 @@
+import json
+import re
+from typing import Any
+
+# CJK 字符（含全角标点）大致按 1 字 1 token 计算
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+def estimate_tokens(content: Any) -> int:
+    """粗略估算文本的 token 数量，不依赖具体模型的分词器
+
+    中文按每字 1 个 token，其余字符按每 4 个字符 1 个 token 估算。
+    非字符串内容先序列化为 JSON 再估算。
+
+    Example:
+        >>> estimate_tokens("遛狗技巧 walking dogs")
+        8
+    """
+    if content is None:
+        return 0
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    cjk_count = len(_CJK_PATTERN.findall(content))
+    other_count = len(content) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """按 estimate_tokens 的估算截断文本，使截断后的文本加上 suffix 不超过 max_tokens
+
+    文本本身不超过 max_tokens 时原样返回，连 suffix 都放不下时返回空字符串。
+
+    Example:
+        >>> truncate_to_tokens("遛狗技巧 walking dogs", 4)
+        '遛狗技…'
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(suffix)
+    if budget <= 0:
+        return suffix if estimate_tokens(suffix) <= max_tokens else ""
+    cjk_count = other_count = 0
+    end = 0
+    for end, char in enumerate(text):
+        if _CJK_PATTERN.match(char):
+            cjk_count += 1
+        else:
+            other_count += 1
+        if cjk_count + (other_count + 3) // 4 > budget:
+            break
+    prefix = text[:end]
+    # 前缀和 suffix 的非中文字符合并后向上取整，可能多出 1 个 token
+    while prefix and estimate_tokens(prefix + suffix) > max_tokens:
+        prefix = prefix[:-1]
+    return prefix + suffix